@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+"""_summary_
+    This is a stand-in Proxmox API for benchmarking the Ironsight API.
+    The cluster is seeded from the JSON in hypervisor_api/proxmox/examples/ and
+    scaled up to any number of nodes and VMs. Every call can be delayed and
+    failed at a set rate, and calls are counted so the benchmark can report
+    upstream calls per request.
+"""
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hypervisor_api", "proxmox", "examples")
+
+
+def load_example(name):
+    """_summary_
+        Load an example response from hypervisor_api/proxmox/examples/.
+    """
+    with open(os.path.join(EXAMPLES, name), "r") as f:
+        return json.load(f)
+
+
+def build_cluster(nodes=4, vms=200, templates=None, seed=0):
+    """_summary_
+        Build a cluster/resources listing scaled up from the examples.
+
+        Args:
+            nodes (int): Number of nodes.
+            vms (int): Number of VMs (templates included).
+            templates (int): Number of templates, defaults to one VM in 50.
+            seed (int): Random seed, the same seed builds the same cluster.
+
+        Returns:
+            dict: Nodes, VMs and storages (cluster/resources entries) and RRD samples.
+    """
+    rng = random.Random(seed)
+    summary = load_example("get_summary.json")["data"]
+    node_examples = load_example("get_nodes.json")["data"] + [item for item in summary if item["type"] == "node"]
+    vm_examples = [item for item in summary if item["type"] == "qemu"] + load_example("get_vms.json")
+    storage_example = next(item for item in summary if item["type"] == "storage")
+    templates = vms // 50 if templates is None else templates
+    cluster = {"nodes": [], "vms": [], "storages": []}
+    for i in range(nodes):
+        node = copy.deepcopy(node_examples[i % len(node_examples)])
+        node_name = f"pve{i + 1:02d}"
+        node.update({"node": node_name, "id": f"node/{node_name}", "type": "node", "status": "online",
+                     "cpu": rng.uniform(0.01, 0.6), "mem": int(node["maxmem"] * rng.uniform(0.1, 0.6))})
+        cluster["nodes"].append(node)
+        storage = copy.deepcopy(storage_example)
+        storage.update({"node": node_name, "id": f"storage/{node_name}/{storage['storage']}"})
+        cluster["storages"].append(storage)
+    for i in range(vms):
+        vm = {key: value for key, value in vm_examples[i % len(vm_examples)].items() if key not in ("cpus", "pid")}
+        vm_id = 100 + i
+        template = i < templates
+        running = not template and rng.random() < 0.7
+        vm.update({"vmid": vm_id, "id": f"qemu/{vm_id}", "type": "qemu",
+                   "name": f"{'template' if template else 'vm'}-{vm_id}",
+                   "node": f"pve{i % nodes + 1:02d}", "template": int(template),
+                   "status": "running" if running else "stopped", "maxcpu": vm.get("maxcpu") or 1,
+                   "cpu": rng.uniform(0, 0.5) if running else 0, "uptime": rng.randint(60, 10 ** 6) if running else 0})
+        cluster["vms"].append(vm)
+    cluster["samples"] = load_example("get_usage_graph.json")["data"][0]["data"]
+    return cluster
+
+# Create MockProxmox class
+
+
+class MockProxmox:
+
+    # Initialize MockProxmox class
+    def __init__(self, nodes=4, vms=200, latency=0, jitter=0, error_rate=0, seed=0, down_nodes=(), down_delay=0):
+        self.cluster = build_cluster(nodes, vms, seed=seed)
+        # Seconds added to every call (uniform jitter on top) and share of calls failing with a 500
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # Nodes that answer 595 (unreachable) after down_delay seconds, like a rebooting host behind the proxy
+        self.down_nodes = set(down_nodes)
+        self.down_delay = down_delay
+        self.rng = random.Random(seed)
+        # Upstream calls served, in total and per route
+        self.calls = {"total": 0, "by_route": {}}
+        self.next_upid = 0
+
+    def vm(self, node_name, vm_id):
+        """_summary_
+            Find a VM on a node.
+        """
+        for vm in self.cluster["vms"]:
+            if vm["vmid"] == vm_id and vm["node"] == node_name:
+                return vm
+        return None
+
+    def resources(self, resource_type=None):
+        """_summary_
+            Build the cluster/resources listing.
+        """
+        resources = []
+        if resource_type in (None, "node"):
+            resources += self.cluster["nodes"]
+        if resource_type in (None, "vm"):
+            resources += self.cluster["vms"]
+        if resource_type in (None, "storage"):
+            resources += self.cluster["storages"]
+        return resources
+
+    def rrddata(self, fields):
+        """_summary_
+            Build an hour of RRD samples (one a minute) ending now, from the example graph.
+        """
+        now = int(time.time()) // 60 * 60
+        samples = self.cluster["samples"]
+        return [{**{field: samples[i % len(samples)].get(field, 0) for field in fields}, "time": now - 60 * (59 - i)}
+                for i in range(60)]
+
+    def upid(self, node_name, task, vm_id):
+        """_summary_
+            Build a task ID.
+        """
+        self.next_upid += 1
+        return f"UPID:{node_name}:{self.next_upid:08X}:00000000:{int(time.time()):08X}:{task}:{vm_id}:root@pam:"
+
+
+def create_app(mock):
+    """_summary_
+        Create the stand-in Proxmox API.
+
+        Args:
+            mock (MockProxmox): Cluster and injection settings.
+
+        Returns:
+            FastAPI: ASGI app.
+    """
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def inject(request, call_next):
+        if not request.url.path.startswith("/api2/json/"):
+            return await call_next(request)
+        mock.calls["total"] += 1
+        if mock.latency or mock.jitter:
+            await asyncio.sleep(mock.latency + mock.rng.uniform(0, mock.jitter))
+        parts = request.url.path.split("/")
+        if len(parts) > 4 and parts[3] == "nodes" and parts[4] in mock.down_nodes:
+            await asyncio.sleep(mock.down_delay)
+            mock.calls["by_route"]["down nodes"] = mock.calls["by_route"].get("down nodes", 0) + 1
+            return JSONResponse({"data": None}, status_code=595)
+        if mock.error_rate and mock.rng.random() < mock.error_rate:
+            mock.calls["by_route"]["injected errors"] = mock.calls["by_route"].get("injected errors", 0) + 1
+            return JSONResponse({"data": None, "errors": "injected failure"}, status_code=500)
+        response = await call_next(request)
+        route = request.scope.get("route")
+        path = f"{request.method} {getattr(route, 'path', request.url.path)}"
+        mock.calls["by_route"][path] = mock.calls["by_route"].get(path, 0) + 1
+        return response
+
+    @app.get("/__bench/calls")
+    async def calls():
+        return mock.calls
+
+    @app.post("/__bench/reset")
+    async def reset():
+        mock.calls = {"total": 0, "by_route": {}}
+        return mock.calls
+
+    @app.post("/__bench/down")
+    async def set_down(nodes: str = ""):
+        mock.down_nodes = set(node for node in nodes.split(",") if node)
+        return sorted(mock.down_nodes)
+
+    @app.get("/api2/json/version")
+    async def version():
+        return {"data": {"version": "8.1.4", "release": "8.1"}}
+
+    @app.get("/api2/json/nodes")
+    async def get_nodes():
+        return {"data": mock.cluster["nodes"]}
+
+    @app.get("/api2/json/nodes/{node_name}/status")
+    async def get_node(node_name: str):
+        node = next((node for node in mock.cluster["nodes"] if node["node"] == node_name), None)
+        if node is None:
+            return JSONResponse({"data": None}, status_code=500)
+        return {"data": {"uptime": node["uptime"], "cpu": node["cpu"],
+                         "memory": {"used": node["mem"], "total": node["maxmem"]}}}
+
+    @app.get("/api2/json/nodes/{node_name}/qemu")
+    async def get_vms(node_name: str):
+        return {"data": [{key: value for key, value in vm.items() if key != "node"}
+                         for vm in mock.cluster["vms"] if vm["node"] == node_name]}
+
+    @app.get("/api2/json/nodes/{node_name}/qemu/{vm_id}/status/current")
+    async def get_vm(node_name: str, vm_id: int):
+        vm = mock.vm(node_name, vm_id)
+        if vm is None:
+            return JSONResponse({"data": None}, status_code=500)
+        return {"data": {**vm, "cpus": vm["maxcpu"]}}
+
+    @app.get("/api2/json/nodes/{node_name}/qemu/{vm_id}/config")
+    async def get_vm_config(node_name: str, vm_id: int):
+        vm = mock.vm(node_name, vm_id)
+        if vm is None:
+            return JSONResponse({"data": None}, status_code=500)
+        return {"data": {"name": vm["name"], "cores": vm["maxcpu"], "memory": vm.get("maxmem", 0) // 2 ** 20,
+                         "scsi0": f"local-lvm:vm-{vm_id}-disk-0,size={vm.get('maxdisk', 0) // 2 ** 30}G"}}
+
+    @app.get("/api2/json/nodes/{node_name}/rrddata")
+    async def get_node_rrddata(node_name: str):
+        return {"data": mock.rrddata(("cpu", "maxcpu", "memused", "memtotal", "netin", "netout", "loadavg",
+                                      "rootused", "roottotal", "iowait"))}
+
+    @app.get("/api2/json/nodes/{node_name}/qemu/{vm_id}/rrddata")
+    async def get_vm_rrddata(node_name: str, vm_id: int):
+        return {"data": mock.rrddata(("cpu", "maxcpu", "netin", "netout"))}
+
+    @app.get("/api2/json/cluster/resources")
+    async def get_resources(type: str = None):
+        return {"data": mock.resources(type)}
+
+    @app.get("/api2/json/cluster/nextid")
+    async def get_next_id():
+        return {"data": str(max((vm["vmid"] for vm in mock.cluster["vms"]), default=99) + 1)}
+
+    @app.get("/api2/json/nodes/{node_name}/tasks/{upid}/status")
+    async def get_task_status(node_name: str, upid: str):
+        return {"data": {"upid": upid, "status": "stopped", "exitstatus": "OK"}}
+
+    @app.post("/api2/json/nodes/{node_name}/qemu/{vm_id}/status/{action}")
+    async def power(node_name: str, vm_id: int, action: str):
+        vm = mock.vm(node_name, vm_id)
+        if vm is None:
+            return JSONResponse({"data": None}, status_code=500)
+        vm["status"] = "stopped" if action in ("stop", "shutdown") else "running"
+        return {"data": mock.upid(node_name, f"qm{action}", vm_id)}
+
+    @app.post("/api2/json/nodes/{node_name}/qemu/{vm_id}/config")
+    async def set_vm_config(node_name: str, vm_id: int):
+        return {"data": None}
+
+    @app.post("/api2/json/nodes/{node_name}/qemu/{vm_id}/clone")
+    async def clone(node_name: str, vm_id: int, request: Request):
+        params = {**request.query_params, **(await request.form())}
+        new_id = int(params["newid"])
+        template = mock.vm(node_name, vm_id)
+        if template is None or any(vm["vmid"] == new_id for vm in mock.cluster["vms"]):
+            return JSONResponse({"data": None}, status_code=500)
+        target = params.get("target", node_name)
+        mock.cluster["vms"].append({**template, "vmid": new_id, "id": f"qemu/{new_id}", "name": params.get("name"),
+                                    "node": target, "template": 0, "status": "stopped", "cpu": 0, "uptime": 0})
+        return {"data": mock.upid(node_name, "qmclone", new_id)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Proxmox API for benchmarks")
+    parser.add_argument("--port", type=int, default=8006)
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--vms", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0, help="Random milliseconds added on top of latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of calls failing with a 500 (0-1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--down-nodes", type=lambda value: value.split(","), default=[],
+                        help="Comma separated nodes answering 595 (unreachable)")
+    parser.add_argument("--down-delay", type=float, default=0, help="Milliseconds before a down node answers")
+    args = parser.parse_args()
+    mock = MockProxmox(args.nodes, args.vms, args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed,
+                       args.down_nodes, args.down_delay / 1000)
+    uvicorn.run(create_app(mock), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from mock_proxmox import build_cluster
+
+"""_summary_
+    This is the benchmark harness for the Ironsight API.
+    It starts the stand-in Proxmox API (bench/mock_proxmox.py) and the API
+    itself, drives each route at a set of concurrency levels and reports
+    throughput, p50/p99 latency and upstream calls per request. Results are
+    saved as JSON so runs can be compared for regressions.
+"""
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Routes driven by default, {vm} / {node} are replaced by a random VM / node of the cluster
+DEFAULT_ROUTES = ["/nodes", "/vms", "/vms?status=running&fields=name,node", "/templates",
+                  "/nodes/{node}/vms", "/vms/{vm}", "/usage/nodes", "/usage/vms"]
+
+
+def percentile(values, share):
+    """_summary_
+        Get a percentile (nearest rank) of a list of values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(share * len(values))) - 1))]
+
+
+def start_process(args, env=None):
+    """_summary_
+        Start a server process in the repository root.
+    """
+    return subprocess.Popen(args, cwd=ROOT, env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, timeout=30):
+    """_summary_
+        Wait until a server answers.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+def git_revision():
+    """_summary_
+        Get the current git revision, if any.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def drive(client, route, concurrency, requests, resolve):
+    """_summary_
+        Send requests to a route with a fixed number of concurrent clients.
+
+        Args:
+            client (httpx.AsyncClient): Client for the API.
+            route (str): Route, with optional {vm} / {node} placeholders.
+            concurrency (int): Requests in flight at once.
+            requests (int): Requests to send.
+            resolve (callable): Function filling in the placeholders of a route.
+
+        Returns:
+            dict: Latencies (seconds), errors and X-Upstream-Calls of every request, and the wall time.
+    """
+    latencies, upstream, errors = [], [], 0
+    remaining = [requests]
+
+    async def worker():
+        nonlocal errors
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.get(resolve(route))
+                await response.aread()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+            if "x-upstream-calls" in response.headers:
+                upstream.append(int(response.headers["x-upstream-calls"]))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"latencies": latencies, "upstream": upstream, "errors": errors, "wall": time.perf_counter() - start}
+
+
+async def benchmark(args, cluster):
+    """_summary_
+        Run every route at every concurrency level.
+
+        Returns:
+            list: One result per (route, concurrency).
+    """
+    rng = random.Random(args.seed)
+    vm_names = [vm["name"] for vm in cluster["vms"] if not vm["template"]]
+    node_names = [node["node"] for node in cluster["nodes"]]
+
+    def resolve(route):
+        return route.replace("{vm}", rng.choice(vm_names)).replace("{node}", rng.choice(node_names))
+
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=args.api_url, timeout=args.timeout, limits=limits) as client:
+        for route in args.routes:
+            for concurrency in args.concurrency:
+                # Warm up (connections, caches) before measuring
+                await drive(client, route, min(concurrency, args.warmup), args.warmup, resolve)
+                await client.post(f"{args.mock_url}/__bench/reset")
+                run = await drive(client, route, concurrency, args.requests, resolve)
+                calls = (await client.get(f"{args.mock_url}/__bench/calls")).json()
+                latencies = run["latencies"]
+                result = {
+                    "route": route, "concurrency": concurrency, "requests": args.requests, "errors": run["errors"],
+                    "throughput": round(len(latencies) / run["wall"], 2) if run["wall"] else None,
+                    "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+                    "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+                    "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+                    "upstream_per_request": round(calls["total"] / args.requests, 3),
+                    "upstream_calls_header": round(sum(run["upstream"]) / len(run["upstream"]), 3)
+                    if run["upstream"] else None,
+                    "upstream_by_route": calls["by_route"],
+                }
+                results.append(result)
+                print(f"{route:45} c={concurrency:<4} {result['throughput']:>9} req/s  "
+                      f"p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+                      f"upstream/req {result['upstream_per_request']:<7} errors {result['errors']}", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """_summary_
+        Compare results with a baseline run.
+
+        Args:
+            results (list): Results of this run.
+            baseline (dict): Saved baseline run.
+            threshold (float): Relative change counted as a regression (0.1 = 10%).
+
+        Returns:
+            list: Regressions found.
+    """
+    previous = {(result["route"], result["concurrency"]): result for result in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline.get('label')} ({baseline.get('git')}, {baseline.get('created')}):")
+    for result in results:
+        before = previous.get((result["route"], result["concurrency"]))
+        if before is None:
+            continue
+        changes = []
+        # (metric, True if higher is better)
+        for metric, higher_is_better in (("throughput", True), ("p50_ms", False), ("p99_ms", False),
+                                         ("upstream_per_request", False)):
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -threshold if higher_is_better else change > threshold
+            changes.append(f"{metric} {change:+.1%}{' REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append({"route": result["route"], "concurrency": result["concurrency"],
+                                    "metric": metric, "before": old, "after": new})
+        print(f"{result['route']:45} c={result['concurrency']:<4} " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Ironsight API against a stand-in Proxmox API")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--vms", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=10, help="Milliseconds added to every upstream call")
+    parser.add_argument("--jitter", type=float, default=5, help="Random milliseconds added on top of latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of upstream calls failing (0-1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--down-nodes", default="", help="Comma separated nodes answering 595 (unreachable)")
+    parser.add_argument("--down-delay", type=float, default=0, help="Milliseconds before a down node answers")
+    parser.add_argument("--routes", type=lambda value: value.split(","), default=DEFAULT_ROUTES,
+                        help="Comma separated routes, {vm} and {node} are filled in")
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 8, 32], help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--env", action="append", default=[],
+                        help="KEY=VALUE environment variable for the API (e.g. HYPERVISOR_ASYNC=true)")
+    parser.add_argument("--mock-port", type=int, default=8906)
+    parser.add_argument("--api-port", type=int, default=8900)
+    parser.add_argument("--api-url", help="Benchmark an API that is already running instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes (sharing one cache)")
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench", "results"))
+    parser.add_argument("--compare", help="Saved run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    args.mock_url = f"http://127.0.0.1:{args.mock_port}"
+    processes = [start_process([sys.executable, os.path.join("bench", "mock_proxmox.py"),
+                                "--port", str(args.mock_port), "--nodes", str(args.nodes), "--vms", str(args.vms),
+                                "--latency", str(args.latency), "--jitter", str(args.jitter),
+                                "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+                                "--down-nodes", args.down_nodes, "--down-delay", str(args.down_delay)])]
+    try:
+        wait_ready(f"{args.mock_url}/__bench/calls")
+        if args.api_url is None:
+            args.api_url = f"http://127.0.0.1:{args.api_port}"
+            env = {"HYPERVISOR": "proxmox", "HYPERVISOR_URL": args.mock_url}
+            if args.workers > 1:
+                # Same shared cache and merged metrics as main.py sets up for SERVER_WORKERS
+                shared = tempfile.mkdtemp(prefix="ironsight-bench-")
+                env.update({"HYPERVISOR_SHARED_CACHE": os.path.join(shared, "shared.db"),
+                            "PROMETHEUS_MULTIPROC_DIR": shared})
+            env.update(dict(item.split("=", 1) for item in args.env))
+            processes.append(start_process([sys.executable, "-m", "uvicorn", "main:ironsight_api",
+                                            "--port", str(args.api_port), "--log-level", "warning",
+                                            "--workers", str(args.workers)], env))
+            wait_ready(f"{args.api_url}/health")
+        cluster = build_cluster(args.nodes, args.vms, seed=args.seed)
+        results = asyncio.run(benchmark(args, cluster))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    run = {"label": args.label, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_revision(),
+           "config": {"nodes": args.nodes, "vms": args.vms, "latency": args.latency, "jitter": args.jitter,
+                      "error_rate": args.error_rate, "seed": args.seed, "requests": args.requests,
+                      "down_nodes": args.down_nodes, "down_delay": args.down_delay,
+                      "workers": args.workers, "env": args.env},
+           "results": results}
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+    with open(path, "w") as f:
+        json.dump(run, f, indent=4)
+    print(f"\nSaved {path}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,36 @@
     having to change the code.
 """
 
-def init_hypervisor(hypervisor):
+import os
+
+
+def init_hypervisor(hypervisor, asynchronous=None):
     """_summary_
         This function gets the hypervisor from the environment
-        variables.
+        variables. A federation of clusters is returned when
+        HYPERVISOR_CLUSTERS is set.
+
+        Args:
+            hypervisor (str): Name of the hypervisor.
+            asynchronous (bool): Use the asyncio backend. Defaults to HYPERVISOR_ASYNC.
     """
+    if asynchronous is None:
+        asynchronous = (os.getenv("HYPERVISOR_ASYNC") or "false").lower() in ("1", "true", "yes")
     try:
-        if hypervisor == "proxmox":
+        # Several clusters (HYPERVISOR_CLUSTERS) are served by one federated backend
+        from hypervisor_api.federation import clusters_from_env
+        clusters = clusters_from_env()
+        if hypervisor == "proxmox" and clusters:
+            from hypervisor_api.federation import FederatedHypervisor
+            if asynchronous:
+                from hypervisor_api.proxmox.async_proxmox import AsyncProxmox as backend
+            else:
+                from hypervisor_api.proxmox.proxmox import Proxmox as backend
+            return FederatedHypervisor({name: backend(url, auth, token, name) for name, (url, auth, token) in clusters.items()})
+        elif hypervisor == "proxmox" and asynchronous:
+            from hypervisor_api.proxmox.async_proxmox import AsyncProxmox
+            return AsyncProxmox()
+        elif hypervisor == "proxmox":
             from hypervisor_api.proxmox.proxmox import Proxmox
             return Proxmox()
         else:
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextvars
+import copy
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from loguru import logger
+from starlette.exceptions import HTTPException
+from hypervisor_api.singleflight import SingleFlight
+from hypervisor_api.resilience import current_deadline
+
+"""_summary_
+    This is the batch query layer of the Ironsight API.
+    A batch runs several read routes (sub-queries) concurrently inside one
+    request. Its sub-queries share a request-scoped memo, so an upstream
+    resource several of them need (the node list, the VM inventory...) is
+    fetched once for the whole batch and every sub-query sees the same data.
+"""
+
+# Memo of the batch being served (None outside of a batch)
+current_memo = contextvars.ContextVar("current_memo", default=None)
+
+# Routes a batch can't run: endless streams and non-JSON bodies
+EXCLUDED_PATHS = ("/batch", "/events", "/metrics")
+
+# Create RequestMemo class
+
+
+class RequestMemo:
+
+    # Initialize RequestMemo class
+    def __init__(self):
+        # key -> successful response, for the lifetime of one batch
+        self.responses = {}
+        self.lock = threading.Lock()
+        # Sub-queries asking for the same resource at once share one call
+        self.flight = SingleFlight()
+        self.hits = 0
+
+    def lookup(self, key):
+        """_summary_
+            Get a copy of a memoized response (callers modify responses in place).
+        """
+        with self.lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.hits += 1
+        return copy.deepcopy(response) if response is not None else None
+
+    def store(self, key, response):
+        """_summary_
+            Memoize a successful response.
+        """
+        if isinstance(response, dict) and response.get("status") == "success":
+            with self.lock:
+                self.responses.setdefault(key, copy.deepcopy(response))
+        return response
+
+    def do(self, key, func, *args):
+        """_summary_
+            Get a resource once per batch (threads).
+
+            Args:
+                key (str): Request key (backend URL and resource).
+                func (callable): Function getting the resource.
+                args: Arguments of the function.
+
+            Returns:
+                dict: Result of the function.
+        """
+        response = self.lookup(key)
+        if response is not None:
+            return response
+        return self.store(key, self.flight.do(key, func, *args))
+
+    async def do_async(self, key, func, *args):
+        """_summary_
+            Get a resource once per batch (asyncio).
+
+            Args:
+                key (str): Request key (backend URL and resource).
+                func (callable): Coroutine function getting the resource.
+                args: Arguments of the function.
+
+            Returns:
+                dict: Result of the function.
+        """
+        response = self.lookup(key)
+        if response is not None:
+            return response
+        return self.store(key, await self.flight.do_async(key, func, *args))
+
+    def stats(self):
+        """_summary_
+            Get the number of upstream reads made and shared within the batch.
+        """
+        flight = self.flight.stats()
+        with self.lock:
+            return {"reads": flight["requests"] + self.hits, "fetched": flight["upstream"],
+                    "shared": flight["collapsed"] + self.hits}
+
+
+def query_string(params):
+    """_summary_
+        Encode the parameters of a sub-query (lists become repeated parameters, booleans true/false).
+    """
+    pairs = []
+    for name, value in (params or {}).items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is None:
+                continue
+            pairs.append((name, str(item).lower() if isinstance(item, bool) else str(item)))
+    return urlencode(pairs).encode()
+
+
+async def dispatch(router, scope, path, params=None):
+    """_summary_
+        Run a read route in-process, inside the current request's context (trace, deadline, memo).
+
+        Args:
+            router (Router): Router of the API.
+            scope (dict): ASGI scope of the batch request.
+            path (str): Route path, e.g. /vms or /vms?status=running.
+            params (dict): Query parameters, added to those of the path.
+
+        Returns:
+            tuple: (status code, decoded body).
+    """
+    url = urlsplit(path)
+    if not url.path.startswith("/") or url.scheme or url.netloc or url.path.rstrip("/") in EXCLUDED_PATHS:
+        return 400, {"status": "error", "error": f"{path} can't be batched"}
+    query = b"&".join(part for part in (url.query.encode(), query_string(params)) if part)
+    sub_scope = {key: value for key, value in scope.items() if key not in ("route", "endpoint", "path_params")}
+    sub_scope.update({"method": "GET", "path": url.path, "raw_path": url.path.encode(), "query_string": query,
+                      "headers": [(b"accept", b"application/json")]})
+    response = {"status": 500, "body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    try:
+        await router(sub_scope, receive, send)
+    except HTTPException as e:
+        return e.status_code, {"status": "error", "error": e.detail}
+    except RequestValidationError as e:
+        return 422, {"status": "error", "error": jsonable_encoder(e.errors())}
+    except Exception as e:
+        logger.error(f"Error: Batched {path} failed: {e}")
+        return 500, {"status": "error", "error": str(e)}
+    if not response["body"]:
+        return response["status"], None
+    try:
+        return response["status"], json.loads(response["body"])
+    except ValueError:
+        return response["status"], response["body"].decode(errors="replace")
+
+
+async def run_batch(router, scope, queries, limit=None):
+    """_summary_
+        Run the sub-queries of a batch concurrently, sharing one memo of upstream responses.
+        Identical sub-queries run once.
+
+        Args:
+            router (Router): Router of the API.
+            scope (dict): ASGI scope of the batch request.
+            queries (list): Sub-queries, dicts with an optional id, a path and optional params.
+            limit (int): Most sub-queries per batch (HYPERVISOR_BATCH_MAX_QUERIES).
+
+        Returns:
+            dict: One result per sub-query, in order, and memo statistics.
+    """
+    limit = limit or int(os.getenv("HYPERVISOR_BATCH_MAX_QUERIES") or 20)
+    if len(queries) > limit:
+        return {"status": "error", "error": f"A batch takes at most {limit} queries"}
+    memo = RequestMemo()
+    memo_token = current_memo.set(memo)
+    # A batch is a read, bounded like any GET request
+    deadline_token = None
+    if current_deadline.get() is None:
+        deadline = float(os.getenv("HYPERVISOR_REQUEST_DEADLINE") or 30)
+        deadline_token = current_deadline.set(time.monotonic() + deadline)
+    try:
+        # (path, query string) -> task, so identical sub-queries share one run
+        runs = {}
+        for query in queries:
+            key = (query["path"], query_string(query.get("params")))
+            if key not in runs:
+                runs[key] = asyncio.ensure_future(dispatch(router, scope, query["path"], query.get("params")))
+        await asyncio.gather(*runs.values())
+    finally:
+        current_memo.reset(memo_token)
+        if deadline_token is not None:
+            current_deadline.reset(deadline_token)
+    results = []
+    for i, query in enumerate(queries):
+        status_code, body = runs[(query["path"], query_string(query.get("params")))].result()
+        results.append({"id": query.get("id") if query.get("id") is not None else str(i), "path": query["path"],
+                        "status_code": status_code, "result": body})
+    return {"status": "success", "data": results, "memo": memo.stats()}
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import copy
+import fnmatch
+import os
+import threading
+import time
+from collections import OrderedDict
+from hypervisor_api.shared import SharedStore
+
+"""_summary_
+    This is the response cache for the hypervisor interface.
+    It holds hypervisor read responses with per-resource TTLs, serves stale
+    entries while they are refreshed in the background, and evicts the least
+    recently used entries once it is full.
+"""
+
+# Default TTLs (seconds) by resource pattern, first match wins
+DEFAULT_TTLS = [
+    ("version", 3600),
+    ("cluster/resources", 5),
+    ("nodes", 10),
+    ("nodes/*/qemu/*/status/current", 2),
+    ("nodes/*/qemu/*/rrddata", 30),
+    ("nodes/*/qemu/*/config", 30),
+    ("nodes/*/rrddata", 30),
+    ("nodes/*/status", 5),
+]
+
+
+def parse_ttls(ttls):
+    """_summary_
+        Parse TTL rules from a "pattern=seconds,pattern=seconds" string.
+
+        Args:
+            ttls (str): TTL rules.
+
+        Returns:
+            list: List of (pattern, seconds) tuples.
+    """
+    rules = []
+    for rule in (ttls or "").split(","):
+        if "=" not in rule:
+            continue
+        pattern, seconds = rule.rsplit("=", 1)
+        rules.append((pattern.strip(), float(seconds)))
+    return rules
+
+
+def make_key(resource, params=None):
+    """_summary_
+        Build the key of a request from its resource and parameters.
+
+        Args:
+            resource (str): Resource path.
+            params (dict): Query parameters.
+
+        Returns:
+            str: Request key.
+    """
+    if not params:
+        return resource
+    return resource + "|" + "&".join(f"{key}={value}" for key, value in sorted(params.items()))
+
+# Create ResponseCache class
+
+
+class ResponseCache:
+
+    # Initialize ResponseCache class
+    def __init__(self, max_entries=1024, default_ttl=5, stale_ttl=30, ttls=None, fallback_ttl=300):
+        # Maximum number of responses kept before LRU eviction
+        self.max_entries = max_entries
+        # TTL for resources without a matching rule
+        self.default_ttl = default_ttl
+        # How long past its TTL an entry may still be served while it is refreshed
+        self.stale_ttl = stale_ttl
+        # How long past its TTL an entry may still be served when the hypervisor can't answer
+        self.fallback_ttl = max(fallback_ttl, stale_ttl)
+        # TTL rules, custom rules take precedence over the defaults
+        self.ttls = (ttls or []) + DEFAULT_TTLS
+        # key -> (resource, response, stored_at, ttl)
+        self.entries = OrderedDict()
+        # Keys currently being refreshed in the background
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        # Cross-process store shared by the workers (None in single-process mode)
+        self.shared = None
+        # Last shared invalidation applied, and what else to call when another worker invalidates
+        self.seen_invalidation = None
+        self.on_invalidate = None
+        # Seconds between two checks for other workers' invalidations, and when the last one was claimed
+        self.sync_interval = float(os.getenv("HYPERVISOR_SHARED_SYNC_INTERVAL") or 1)
+        self.synced_at = 0
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0,
+                         "evictions": 0, "invalidations": 0, "refreshes": 0, "fallbacks": 0}
+
+    @classmethod
+    def from_env(cls, namespace=""):
+        """_summary_
+            Create a response cache from the environment variables.
+
+            Returns:
+                ResponseCache: Response cache, or None if caching is disabled.
+        """
+        if (os.getenv("HYPERVISOR_CACHE") or "true").lower() not in ("1", "true", "yes"):
+            return None
+        cache = cls(max_entries=int(os.getenv("HYPERVISOR_CACHE_SIZE") or 1024),
+                   default_ttl=float(os.getenv("HYPERVISOR_CACHE_TTL") or 5),
+                   stale_ttl=float(os.getenv("HYPERVISOR_CACHE_STALE_TTL") or 30),
+                   ttls=parse_ttls(os.getenv("HYPERVISOR_CACHE_TTLS")),
+                   fallback_ttl=float(os.getenv("HYPERVISOR_CACHE_FALLBACK_TTL") or 300))
+        # Entries of several hypervisors (a federation) are kept apart by namespace
+        cache.shared = SharedStore.from_env(namespace + "|" if namespace else "")
+        return cache
+
+    def ttl_for(self, resource):
+        """_summary_
+            Get the TTL for a resource.
+
+            Args:
+                resource (str): Resource path.
+
+            Returns:
+                float: TTL in seconds.
+        """
+        path = resource.split("?", 1)[0]
+        for pattern, ttl in self.ttls:
+            if fnmatch.fnmatchcase(path, pattern):
+                return ttl
+        return self.default_ttl
+
+    def make_key(self, resource, params=None):
+        """_summary_
+            Build the cache key for a resource and its parameters.
+
+            Args:
+                resource (str): Resource path.
+                params (dict): Query parameters.
+
+            Returns:
+                str: Cache key.
+        """
+        return make_key(resource, params)
+
+    def load_shared(self, key):
+        """_summary_
+            Take a response another worker stored in the shared store, if it is newer than the local one.
+
+            Args:
+                key (str): Cache key.
+        """
+        shared = self.shared.get(key)
+        if shared is None:
+            return
+        resource, response, age, ttl = shared
+        stored_at = time.monotonic() - age
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or stored_at > entry[2]:
+                self.entries[key] = (resource, response, stored_at, ttl)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.counters["evictions"] += 1
+
+    def sync_due(self):
+        """_summary_
+            Claim the next check for other workers' invalidations, at most one every sync_interval seconds.
+
+            Returns:
+                bool: True if the caller should run sync_invalidations (never in single-process mode).
+        """
+        if self.shared is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.synced_at < self.sync_interval:
+                return False
+            self.synced_at = now
+            return True
+
+    def needs_shared(self, key):
+        """_summary_
+            Check whether a lookup should go to the shared store first (no fresh local copy of the key).
+        """
+        if self.shared is None:
+            return False
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry is None or time.monotonic() - entry[2] > entry[3]
+
+    def sync_invalidations(self):
+        """_summary_
+            Apply the invalidations other workers made since the last check (single-process: nothing to do).
+            Reads the shared store, see sync_due for how often to call it.
+        """
+        if self.shared is None:
+            return
+        synced = self.shared.invalidations(self.seen_invalidation)
+        if synced is None:
+            return
+        first = self.seen_invalidation is None
+        self.seen_invalidation, invalidations = synced
+        if first:
+            return
+        for prefixes in invalidations:
+            self.drop(prefixes)
+            if self.on_invalidate is not None:
+                self.on_invalidate(*prefixes)
+
+    def drop(self, prefixes):
+        """_summary_
+            Drop the local responses whose resource starts with one of the prefixes (all of them without prefixes).
+        """
+        with self.lock:
+            if not prefixes:
+                keys = list(self.entries)
+            else:
+                keys = [key for key, entry in self.entries.items()
+                        if entry[0].startswith(prefixes)]
+            for key in keys:
+                del self.entries[key]
+            self.counters["invalidations"] += len(keys)
+
+    def get(self, key):
+        """_summary_
+            Get a response from the local cache (see needs_shared and load_shared for the shared store).
+
+            Args:
+                key (str): Cache key.
+
+            Returns:
+                tuple: (response, state), state is "fresh", "stale" or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None, None
+            resource, response, stored_at, ttl = entry
+            age = time.monotonic() - stored_at
+            if age > ttl + self.stale_ttl:
+                # Too old to serve, but kept as a fallback for a while
+                if age > ttl + self.fallback_ttl:
+                    del self.entries[key]
+                self.counters["misses"] += 1
+                return None, None
+            self.entries.move_to_end(key)
+            if age > ttl:
+                self.counters["stale_hits"] += 1
+                state = "stale"
+            else:
+                self.counters["hits"] += 1
+                state = "fresh"
+        # Callers modify responses in place, so hand out a copy
+        return copy.deepcopy(response), state
+
+    def fallback(self, key):
+        """_summary_
+            Get the last good response for a key when the hypervisor can't answer, marked as stale.
+
+            Args:
+                key (str): Cache key.
+
+            Returns:
+                dict: Stale response (with its age in seconds), or None if there is none recent enough.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            resource, response, stored_at, ttl = entry
+            age = time.monotonic() - stored_at
+            if age > ttl + self.fallback_ttl:
+                return None
+            self.counters["fallbacks"] += 1
+        response = copy.deepcopy(response)
+        response.update({"stale": True, "stale_age": round(age, 1)})
+        return response
+
+    def set(self, key, resource, response):
+        """_summary_
+            Store a response in the cache, writing it through to the shared store.
+
+            Args:
+                key (str): Cache key.
+                resource (str): Resource path (used for TTL and invalidation).
+                response (dict): Response to store.
+        """
+        ttl = self.ttl_for(resource)
+        if ttl <= 0:
+            return
+        response = copy.deepcopy(response)
+        with self.lock:
+            self.entries[key] = (resource, response, time.monotonic(), ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+        if self.shared is not None:
+            self.shared.set(key, resource, response, ttl)
+
+    def start_refresh(self, key):
+        """_summary_
+            Claim the background refresh of a stale entry.
+
+            Args:
+                key (str): Cache key.
+
+            Returns:
+                bool: True if the caller should refresh it (no refresh already running).
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            self.counters["refreshes"] += 1
+            return True
+
+    def finish_refresh(self, key):
+        """_summary_
+            Release the background refresh of an entry.
+
+            Args:
+                key (str): Cache key.
+        """
+        with self.lock:
+            self.refreshing.discard(key)
+
+    def invalidate(self, *prefixes):
+        """_summary_
+            Drop every cached response whose resource starts with one of the prefixes.
+            Without prefixes, the whole cache is cleared.
+
+            Args:
+                prefixes (str): Resource path prefixes.
+        """
+        self.drop(prefixes)
+        if self.shared is not None:
+            self.sync_invalidations()
+            invalidation = self.shared.invalidate(*prefixes)
+            # Our own invalidation is already applied
+            if invalidation is not None and self.seen_invalidation == invalidation - 1:
+                self.seen_invalidation = invalidation
+
+    def stats(self):
+        """_summary_
+            Get cache statistics.
+
+            Returns:
+                dict: Hit/miss counters and cache size.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+            stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0
+        return stats
@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+from loguru import logger
+from hypervisor_api.utils import maybe_await, item_key
+from hypervisor_api.query import apply_query
+from hypervisor_api.tasks import parse_upid
+from hypervisor_api.versions import InventoryVersions
+
+"""_summary_
+    This is the multi-cluster federation for the hypervisor interface.
+    A FederatedHypervisor holds one backend per cluster, queries them
+    concurrently and merges their listings with a "cluster" label on each item.
+    Name and node lookups are routed to the owning cluster through an index,
+    and a cluster that is slow or down is reported as degraded instead of
+    holding up the merged response.
+"""
+
+
+def clusters_from_env():
+    """_summary_
+        Read the federated clusters from the environment.
+        HYPERVISOR_CLUSTERS lists name=url pairs (comma separated), each cluster's credentials are read from
+        HYPERVISOR_AUTH_{NAME} / HYPERVISOR_TOKEN_{NAME}, falling back to HYPERVISOR_AUTH / HYPERVISOR_TOKEN.
+
+        Returns:
+            dict: name -> (url, auth, token), empty when federation isn't configured.
+    """
+    clusters = {}
+    for entry in (os.getenv("HYPERVISOR_CLUSTERS") or "").split(","):
+        name, _, url = entry.strip().partition("=")
+        if not name or not url:
+            continue
+        key = name.upper().replace("-", "_")
+        clusters[name] = (url.rstrip("/"),
+                          os.getenv(f"HYPERVISOR_AUTH_{key}", os.getenv("HYPERVISOR_AUTH")),
+                          os.getenv(f"HYPERVISOR_TOKEN_{key}", os.getenv("HYPERVISOR_TOKEN")))
+    return clusters
+
+
+def listing_data(response):
+    """_summary_
+        Get the items of a listing response (a bare list or a dict with "data").
+    """
+    if isinstance(response, list):
+        return response
+    data = response.get("data") if isinstance(response, dict) else None
+    return data if isinstance(data, list) else []
+
+
+def label(response, cluster):
+    """_summary_
+        Add the cluster to a single item response.
+    """
+    if isinstance(response, dict) and isinstance(response.get("data"), dict):
+        response = {**response, "data": {**response["data"], "cluster": cluster}}
+    return response
+
+# Create FederatedTasks class
+
+
+class FederatedTasks:
+
+    # Initialize FederatedTasks class
+    def __init__(self, federation):
+        self.federation = federation
+
+    def trackers(self):
+        """_summary_
+            Get the task tracker of every cluster.
+        """
+        return [member.tasks for member in self.federation.members.values()]
+
+    def start(self):
+        """_summary_
+            Start polling in the background, in every cluster.
+        """
+        for tracker in self.trackers():
+            tracker.start()
+
+    async def stop(self):
+        """_summary_
+            Stop polling in every cluster.
+        """
+        for tracker in self.trackers():
+            await tracker.stop()
+
+    def owner(self, upid):
+        """_summary_
+            Get the task tracker of the cluster a task belongs to.
+        """
+        for tracker in self.trackers():
+            if tracker.get(upid) is not None:
+                return tracker
+        return None
+
+    def get(self, upid):
+        """_summary_
+            Get a task record from whichever cluster tracks it.
+        """
+        tracker = self.owner(upid)
+        return tracker.get(upid) if tracker is not None else None
+
+    def record(self, upid, resource=None):
+        """_summary_
+            Start tracking a task in the cluster of its node.
+        """
+        task = parse_upid(upid)
+        cluster = self.federation.node_index.get(task["node"]) if task is not None else None
+        if cluster is None:
+            return None
+        return self.federation.members[cluster].tasks.record(upid, resource)
+
+    async def wait(self, upid, timeout):
+        """_summary_
+            Wait until a task finishes (long-poll), in the cluster that tracks it.
+        """
+        tracker = self.owner(upid)
+        return await tracker.wait(upid, timeout) if tracker is not None else None
+
+    def list(self, status=None):
+        """_summary_
+            List the tracked tasks of every cluster, with their cluster.
+        """
+        return [{**task, "cluster": cluster} for cluster, member in self.federation.members.items()
+                for task in member.tasks.list(status)]
+
+    def in_flight(self):
+        """_summary_
+            List the tasks that are still running, in every cluster.
+        """
+        return self.list("running")
+
+# Create FederatedHypervisor class
+
+
+class FederatedHypervisor:
+
+    # Initialize FederatedHypervisor class
+    def __init__(self, members, timeout=None):
+        # cluster name -> hypervisor backend (Proxmox or AsyncProxmox)
+        self.members = dict(members)
+        # Seconds a cluster gets to answer a read before it is reported as degraded
+        self.timeout = timeout or float(os.getenv("HYPERVISOR_CLUSTER_TIMEOUT") or 10)
+        # VM / template name -> cluster and node name -> cluster, refreshed from every merged listing
+        self.vm_index = {}
+        self.node_index = {}
+        # Versions of the merged VM / node listings, for ETags and change feeds
+        self.versions = InventoryVersions.from_env("federation:" + ",".join(self.members))
+        # Task trackers of every cluster behind one interface
+        self.tasks = FederatedTasks(self)
+
+    async def call(self, cluster, method, *args, timeout=None, **kwargs):
+        """_summary_
+            Call a method of one cluster's backend.
+
+            Args:
+                cluster (str): Name of the cluster.
+                method (str): Hypervisor method name.
+                timeout (float): Seconds to wait for an answer, None to wait until it is done.
+
+            Returns:
+                any: Result of the method.
+        """
+        call = maybe_await(getattr(self.members[cluster], method), *args, **kwargs)
+        if timeout is None:
+            return await call
+        return await asyncio.wait_for(call, timeout)
+
+    async def offload(self, func, *args):
+        """_summary_
+            Make a version log call in a worker thread when it may wait on the shared store (SQLite).
+        """
+        if self.versions.shared is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    async def call_owner(self, cluster, method, *args, read=True, **kwargs):
+        """_summary_
+            Call a method of the cluster that owns a VM / node, reporting a timeout or failure as an error.
+
+            Args:
+                cluster (str): Name of the cluster.
+                method (str): Hypervisor method name.
+                read (bool): Reads get the cluster timeout, writes run until they are done.
+
+            Returns:
+                dict: Result of the method.
+        """
+        try:
+            return await self.call(cluster, method, *args, timeout=self.timeout if read else None, **kwargs)
+        except asyncio.TimeoutError:
+            logger.error(f"Error: Cluster {cluster} did not answer {method} within {self.timeout}s")
+            return {"status": "error", "error": f"Cluster {cluster} is degraded", "cluster": cluster}
+        except Exception as e:
+            logger.error(f"Error: Cluster {cluster} failed on {method}: {e}")
+            return {"status": "error", "error": f"Cluster {cluster} is degraded", "cluster": cluster}
+
+    async def gather(self, method, *args, **kwargs):
+        """_summary_
+            Call a method of every cluster concurrently, each within the cluster timeout.
+
+            Args:
+                method (str): Hypervisor method name.
+
+            Returns:
+                tuple: (cluster -> result of the clusters that answered, cluster -> error of the degraded ones).
+        """
+        names = list(self.members)
+        results = await asyncio.gather(*(self.call(name, method, *args, timeout=self.timeout, **kwargs)
+                                         for name in names), return_exceptions=True)
+        responses, degraded = {}, {}
+        for name, result in zip(names, results):
+            if isinstance(result, asyncio.TimeoutError):
+                degraded[name] = f"No answer within {self.timeout}s"
+            elif isinstance(result, Exception):
+                degraded[name] = str(result)
+            elif result is None:
+                # Methods wrapped in logger.catch return None when they raise
+                degraded[name] = "No answer"
+            elif isinstance(result, dict) and result.get("status") == "error":
+                degraded[name] = result.get("error")
+            else:
+                responses[name] = result
+        for name, error in degraded.items():
+            logger.error(f"Error: Cluster {name} is degraded ({method}): {error}")
+        return responses, degraded
+
+    def cluster_status(self, degraded):
+        """_summary_
+            Build the per-cluster status reported with merged responses.
+        """
+        return {name: {"status": "degraded", "error": degraded[name]} if name in degraded else {"status": "ok"}
+                for name in self.members}
+
+    def merge(self, responses, degraded):
+        """_summary_
+            Merge the listings of several clusters, labelling each item with its cluster.
+
+            Args:
+                responses (dict): cluster -> listing response.
+                degraded (dict): cluster -> error.
+
+            Returns:
+                dict: Merged listing, with the status of every cluster.
+        """
+        data = [{**item, "cluster": name} for name, response in responses.items()
+                for item in listing_data(response)]
+        response = {"status": "success", "data": data, "clusters": self.cluster_status(degraded)}
+        if not responses and degraded:
+            response.update({"status": "error", "error": "No cluster answered"})
+        return response
+
+    def update_index(self, index, responses, items, field):
+        """_summary_
+            Replace the index entries of the clusters that answered, keeping those of the degraded ones.
+            A name found in several clusters belongs to the first one listed in HYPERVISOR_CLUSTERS.
+        """
+        fresh = {}
+        for item in items:
+            if item.get(field) is not None:
+                fresh.setdefault(item.get(field), item["cluster"])
+        updated = {key: cluster for key, cluster in index.items() if cluster not in responses}
+        updated.update(fresh)
+        return updated
+
+    async def locate_vm(self, vm_name):
+        """_summary_
+            Get the cluster of a VM / template, refreshing the index on a miss.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+
+            Returns:
+                str: Name of the cluster, or None if no cluster has the VM.
+        """
+        if vm_name not in self.vm_index:
+            await self.get_vms()
+        return self.vm_index.get(vm_name)
+
+    async def locate_node(self, node_name):
+        """_summary_
+            Get the cluster of a node, refreshing the index on a miss.
+
+            Args:
+                node_name (str): Name of the node.
+
+            Returns:
+                str: Name of the cluster, or None if no cluster has the node.
+        """
+        if node_name not in self.node_index:
+            await self.get_nodes()
+        return self.node_index.get(node_name)
+
+    async def on_vm(self, vm_name, method, *args, read=True, **kwargs):
+        """_summary_
+            Route a call about a VM (by name) to the cluster that owns it.
+        """
+        cluster = await self.locate_vm(vm_name)
+        if cluster is None:
+            return {"status": "error", "error": "VM not found"}
+        return label(await self.call_owner(cluster, method, vm_name, *args, read=read, **kwargs), cluster)
+
+    async def on_node(self, node_name, method, *args, **kwargs):
+        """_summary_
+            Route a read about a node to the cluster that owns it.
+        """
+        cluster = await self.locate_node(node_name)
+        if cluster is None:
+            return {"status": "error", "error": "Node not found"}
+        return label(await self.call_owner(cluster, method, node_name, *args, **kwargs), cluster)
+
+    async def merged_stream(self, method, *args):
+        """_summary_
+            Merge the streams of every cluster, each item as soon as its cluster produces it.
+            A cluster that goes quiet for longer than the cluster timeout (before its first item or
+            between two items) is cut off and reported as degraded, a long but steady stream isn't.
+
+            Args:
+                method (str): Hypervisor iterator method name.
+
+            Yields:
+                dict: Item labelled with its cluster, or an error for a degraded cluster.
+        """
+        queue = asyncio.Queue()
+        done = object()
+
+        async def produce(name):
+            try:
+                items = getattr(self.members[name], method)(*args)
+                while True:
+                    if hasattr(items, "__anext__"):
+                        item = await asyncio.wait_for(anext(items, done), self.timeout)
+                    else:
+                        # Blocking iterators are advanced in a worker thread
+                        item = await asyncio.wait_for(asyncio.to_thread(next, items, done), self.timeout)
+                    if item is done:
+                        break
+                    await queue.put({**item, "cluster": name})
+            except asyncio.TimeoutError:
+                logger.error(f"Error: Cluster {name} produced nothing for {method} within {self.timeout}s")
+                await queue.put({"status": "error", "error": f"Cluster {name} is degraded", "cluster": name})
+            except Exception as e:
+                logger.error(f"Error: Cluster {name} failed on {method}: {e}")
+                await queue.put({"status": "error", "error": f"Cluster {name} is degraded", "cluster": name})
+            await queue.put(done)
+
+        producers = [asyncio.create_task(produce(name)) for name in self.members]
+        try:
+            remaining = len(producers)
+            while remaining:
+                item = await queue.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            for producer in producers:
+                producer.cancel()
+
+    async def close(self):
+        """_summary_
+            Close the HTTP sessions of every cluster.
+        """
+        for name in self.members:
+            await self.call(name, "close")
+
+    async def get_summary(self):
+        """_summary_
+            Get usage summary for all nodes/VMs of every cluster (realtime).
+        """
+        return self.merge(*await self.gather("get_summary"))
+
+    async def get_cache_stats(self):
+        """_summary_
+            Get the response cache counters of every cluster.
+        """
+        return {name: await self.call(name, "get_cache_stats") for name in self.members}
+
+    async def get_coalescing_stats(self):
+        """_summary_
+            Get the request coalescing counters of every cluster.
+        """
+        return {name: await self.call(name, "get_coalescing_stats") for name in self.members}
+
+    async def get_circuit_stats(self):
+        """_summary_
+            Get the state of the per-node circuit breakers of every cluster.
+        """
+        return {name: await self.call(name, "get_circuit_stats") for name in self.members}
+
+    async def get_tasks(self, status=None):
+        """_summary_
+            Get the tracked upstream tasks of every cluster.
+        """
+        return {"status": "success", "data": self.tasks.list(status)}
+
+    async def get_nodes(self):
+        """_summary_
+            Get the nodes of every cluster.
+
+            Returns:
+                dict: Merged node list, with the status of every cluster.
+        """
+        responses, degraded = await self.gather("get_nodes")
+        response = self.merge(responses, degraded)
+        self.node_index = self.update_index(self.node_index, responses, response["data"], "node")
+        if response["status"] == "success":
+            response["version"] = await self.offload(
+                self.versions.observe, "nodes", {item_key(node, "node"): node for node in response["data"]})
+        return response
+
+    async def get_node(self, node_name):
+        """_summary_
+            Get a node from the cluster that owns it.
+        """
+        return await self.on_node(node_name, "get_node")
+
+    @logger.catch
+    async def get_vms(self, **query):
+        """_summary_
+            Get the virtual machines of every cluster.
+            Filters, sort and pagination apply to the merged list.
+
+            Args:
+                query: Filters, fields, sort and pagination (see query.apply_query).
+
+            Returns:
+                dict: Merged VM list, with the status of every cluster.
+        """
+        responses, degraded = await self.gather("get_vms")
+        merged = self.merge(responses, degraded)
+        self.vm_index = self.update_index(self.vm_index, responses, merged["data"], "name")
+        if merged["status"] != "success":
+            return merged
+        version = await self.offload(self.versions.observe, "vms", {item_key(vm, "vmid"): vm for vm in merged["data"]})
+        response = apply_query(merged["data"], **query)
+        if response["status"] == "success":
+            response.update({"version": version, "clusters": merged["clusters"]})
+        return response
+
+    async def get_vm_changes(self, since=None):
+        """_summary_
+            Get the VMs added, removed and changed (keyed by cluster/vmid) since an inventory version.
+        """
+        response = await self.get_vms()
+        if response.get("status") != "success":
+            return response
+        return {"status": "success", **(await self.offload(self.versions.changes, "vms", since))}
+
+    async def count_vms(self, node=None, status=None, template=None):
+        """_summary_
+            Count the virtual machines of every cluster (or of the cluster owning a node).
+        """
+        if node is not None:
+            return await self.on_node(node, "count_vms", status, template)
+        responses, degraded = await self.gather("count_vms", None, status, template)
+        count = sum(response["data"]["count"] for response in responses.values())
+        return {"status": "success", "data": {"count": count}, "clusters": self.cluster_status(degraded)}
+
+    async def iter_vms(self, status=None, node=None, template=None, name=None, tags=None, fields=None):
+        """_summary_
+            Stream the virtual machines of every cluster.
+
+            Yields:
+                dict: Virtual machine labelled with its cluster, or an error.
+        """
+        async for vm in self.merged_stream("iter_vms", status, node, template, name, tags, fields):
+            yield vm
+
+    async def get_vms_on_node(self, node_name, **query):
+        """_summary_
+            Get the virtual machines of a node, from the cluster that owns it.
+        """
+        cluster = await self.locate_node(node_name)
+        if cluster is None:
+            return {"status": "error", "error": "Node not found"}
+        response = await self.call_owner(cluster, "get_vms_on_node", node_name, **query)
+        if response.get("status") == "success":
+            response["data"] = [{**vm, "cluster": cluster} for vm in response["data"]]
+        return response
+
+    async def get_vm_by_id(self, node_name, vm_id):
+        """_summary_
+            Get a virtual machine by ID, from the cluster that owns its node.
+        """
+        return await self.on_node(node_name, "get_vm_by_id", vm_id)
+
+    async def get_vm_by_name(self, vm_name):
+        """_summary_
+            Get a virtual machine by name, from the cluster that owns it.
+        """
+        return await self.on_vm(vm_name, "get_vm_by_name")
+
+    async def get_templates(self, **query):
+        """_summary_
+            Get the templates of every cluster.
+            Unlike a single cluster's bare list, the merged list always comes with the status of every cluster.
+
+            Returns:
+                dict: Merged list of templates (paged when a query is given), with the status of every cluster.
+        """
+        # With a query, a cluster answers with a status, so one that couldn't list its templates is degraded
+        responses, degraded = await self.gather("get_templates", template=True)
+        merged = self.merge(responses, degraded)
+        if not query or merged["status"] != "success":
+            return merged
+        response = apply_query(merged["data"], **query)
+        if response["status"] == "success":
+            response["clusters"] = merged["clusters"]
+        return response
+
+    async def start_vm(self, vm_name):
+        return await self.on_vm(vm_name, "start_vm", read=False)
+
+    async def stop_vm(self, vm_name):
+        return await self.on_vm(vm_name, "stop_vm", read=False)
+
+    async def power_toggle_vm(self, vm_name):
+        return await self.on_vm(vm_name, "power_toggle_vm", read=False)
+
+    async def reboot_vm(self, vm_name):
+        return await self.on_vm(vm_name, "reboot_vm", read=False)
+
+    async def bulk_power(self, action, names=None, node=None, prefix=None, template=False, status=None,
+                         limit=None):
+        """_summary_
+            Run a power action on many virtual machines, in the clusters that own them.
+
+            Returns:
+                dict: Result per VM, labelled with its cluster.
+        """
+        args = (node, prefix, template, status, limit)
+        if node is not None:
+            clusters = {await self.locate_node(node): names}
+        elif names:
+            # Unknown names are sent to the first cluster, which reports them as not found
+            clusters = {}
+            for vm_name in names:
+                cluster = await self.locate_vm(vm_name) or next(iter(self.members))
+                clusters.setdefault(cluster, []).append(vm_name)
+        else:
+            clusters = {name: None for name in self.members}
+        if None in clusters:
+            return {"status": "error", "error": "Node not found"}
+        clusters = list(clusters.items())
+        results = await asyncio.gather(*(self.call_owner(cluster, "bulk_power", action, cluster_names, *args,
+                                                         read=False) for cluster, cluster_names in clusters))
+        data, degraded = [], {}
+        for (cluster, _), result in zip(clusters, results):
+            if result.get("status") != "success":
+                degraded[cluster] = result.get("error")
+                continue
+            data += [{**item, "cluster": cluster} for item in result["data"]]
+        return {"status": "success", "data": data, "clusters": self.cluster_status(degraded)}
+
+    async def provision_vms(self, template_name, *args, **kwargs):
+        """_summary_
+            Clone many VMs from a template, in the cluster that owns the template.
+        """
+        cluster = await self.locate_vm(template_name)
+        if cluster is None:
+            return {"status": "error", "error": "Template not found"}
+        response = await self.call_owner(cluster, "provision_vms", template_name, *args, read=False, **kwargs)
+        return {**response, "cluster": cluster}
+
+    async def plan_placement(self, template_name, *args, **kwargs):
+        """_summary_
+            Dry run of a provisioning request, in the cluster that owns the template.
+        """
+        cluster = await self.locate_vm(template_name)
+        if cluster is None:
+            return {"status": "error", "error": "Template not found"}
+        return label(await self.call_owner(cluster, "plan_placement", template_name, *args, **kwargs), cluster)
+
+    async def create_vm(self, vm_name, template_name):
+        """_summary_
+            Create a virtual machine from a template, in the cluster that owns the template.
+        """
+        cluster = await self.locate_vm(template_name)
+        if cluster is None:
+            return {"status": "error", "error": "Template not found"}
+        return await self.call_owner(cluster, "create_vm", vm_name, template_name, read=False)
+
+    async def configure_vnc(self, vm_name, port):
+        return await self.on_vm(vm_name, "configure_vnc", port, read=False)
+
+    async def get_vm_config(self, vm_name):
+        return await self.on_vm(vm_name, "get_vm_config")
+
+    async def get_usage_graph(self, node_name=None, start=None, end=None):
+        """_summary_
+            Get the usage graph of a node (from its cluster) or of every node of every cluster.
+        """
+        if node_name:
+            return await self.on_node(node_name, "get_usage_graph", start, end)
+        response = self.merge(*await self.gather("get_usage_graph", None, start, end))
+        response["data"].sort(key=lambda node: (node.get("node"), node["cluster"]))
+        return response
+
+    def iter_usage_graph(self, start=None, end=None):
+        return self.merged_stream("iter_usage_graph", start, end)
+
+    async def get_vm_usage_graph(self, vm_name=None, start=None, end=None):
+        """_summary_
+            Get the usage graph of a VM (from its cluster) or of every VM of every cluster.
+        """
+        if vm_name:
+            return await self.on_vm(vm_name, "get_vm_usage_graph", start, end)
+        responses, degraded = await self.gather("get_vm_usage_graph", None, start, end)
+        graph_data = self.merge(responses, degraded)["data"]
+        # Sort graph data by vm_name
+        return sorted(graph_data, key=lambda k: (k["vm_name"], k["cluster"]))
+
+    def iter_vm_usage_graph(self, start=None, end=None):
+        return self.merged_stream("iter_vm_usage_graph", start, end)
+
+    async def get_usage_aggregate(self, metrics, start=None, end=None, top=10):
+        """_summary_
+            Aggregate node usage per cluster (percentiles don't merge across clusters).
+        """
+        responses, degraded = await self.gather("get_usage_aggregate", metrics, start, end, top)
+        return {"status": "success" if responses else "error", "data": responses,
+                "clusters": self.cluster_status(degraded)}
+
+    async def get_vm_usage_aggregate(self, metrics, start=None, end=None, top=10):
+        """_summary_
+            Aggregate VM usage per cluster (percentiles don't merge across clusters).
+        """
+        responses, degraded = await self.gather("get_vm_usage_aggregate", metrics, start, end, top)
+        return {"status": "success" if responses else "error", "data": responses,
+                "clusters": self.cluster_status(degraded)}
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import CollectorRegistry, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from hypervisor_api.tracing import record_span
+
+"""_summary_
+    This is the Prometheus metrics surface for the Ironsight API.
+    It times API routes and upstream hypervisor calls (per resource template,
+    e.g. nodes/{node}/qemu/{vmid}/rrddata), counts upstream errors by status
+    code, bytes and items returned, and tracks requests in flight.
+    With several workers (PROMETHEUS_MULTIPROC_DIR set), every worker's
+    samples are merged at scrape time.
+"""
+
+# Latency buckets (seconds), from cached answers to slow clones
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram("ironsight_request_duration_seconds", "API request latency",
+                            ["method", "route", "status"], buckets=BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge("ironsight_requests_in_progress", "API requests in flight", ["method"],
+                             multiprocess_mode="livesum")
+RESPONSE_BYTES = Counter("ironsight_response_bytes_total", "Bytes returned by the API", ["route"])
+RESPONSE_ITEMS = Counter("ironsight_response_items_total", "List items returned by the API", ["route"])
+UPSTREAM_LATENCY = Histogram("ironsight_upstream_request_duration_seconds", "Hypervisor call latency",
+                             ["cluster", "method", "resource"], buckets=BUCKETS)
+UPSTREAM_IN_PROGRESS = Gauge("ironsight_upstream_requests_in_progress", "Hypervisor calls in flight",
+                             ["cluster", "method"], multiprocess_mode="livesum")
+UPSTREAM_ERRORS = Counter("ironsight_upstream_errors_total", "Failed hypervisor calls",
+                          ["cluster", "method", "resource", "status_code"])
+UPSTREAM_BYTES = Counter("ironsight_upstream_response_bytes_total", "Bytes received from the hypervisor",
+                         ["cluster", "method", "resource"])
+UPSTREAM_RETRIES = Counter("ironsight_upstream_retries_total", "Hypervisor calls retried after a failure",
+                           ["cluster", "method", "resource"])
+
+# Path segment after these segments -> placeholder, so resources map to a bounded set of templates
+RESOURCE_PLACEHOLDERS = {"nodes": "{node}", "qemu": "{vmid}", "lxc": "{vmid}", "tasks": "{upid}",
+                         "storage": "{storage}", "pools": "{pool}"}
+
+
+def resource_template(resource):
+    """_summary_
+        Get the template of a hypervisor resource (nodes/pve1/qemu/100/status -> nodes/{node}/qemu/{vmid}/status).
+
+        Args:
+            resource (str): Resource path.
+
+        Returns:
+            str: Resource template.
+    """
+    parts = resource.strip("/").split("/")
+    for i in range(1, len(parts)):
+        placeholder = RESOURCE_PLACEHOLDERS.get(parts[i - 1])
+        if placeholder is not None and not parts[i].startswith("{"):
+            parts[i] = placeholder
+    return re.sub(r"UPID:[^/]+", "{upid}", "/".join(parts))
+
+
+@contextmanager
+def track_upstream(method, resource, cluster=None):
+    """_summary_
+        Time a hypervisor call (metrics and the current request's trace).
+        The caller stores the HTTP response in the yielded dict.
+
+        Args:
+            method (str): HTTP method.
+            resource (str): Resource path.
+            cluster (str): Name of the cluster in a federation (empty label otherwise).
+
+        Yields:
+            dict: Call, with "response" to fill in.
+    """
+    template = resource_template(resource)
+    cluster = cluster or ""
+    call = {"response": None}
+    status = "exception"
+    UPSTREAM_IN_PROGRESS.labels(cluster, method).inc()
+    start = time.perf_counter()
+    try:
+        yield call
+        response = call["response"]
+        if response is not None:
+            status = str(response.status_code)
+            UPSTREAM_BYTES.labels(cluster, method, template).inc(len(response.content))
+            if response.status_code != 200:
+                UPSTREAM_ERRORS.labels(cluster, method, template, status).inc()
+    except Exception:
+        UPSTREAM_ERRORS.labels(cluster, method, template, "exception").inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        UPSTREAM_LATENCY.labels(cluster, method, template).observe(duration)
+        UPSTREAM_IN_PROGRESS.labels(cluster, method).dec()
+        # Per-request trace (Server-Timing / X-Upstream-Calls)
+        record_span(method, resource, template, status, start, duration)
+
+
+def count_retry(method, resource, cluster=None):
+    """_summary_
+        Count a retried hypervisor call.
+
+        Args:
+            method (str): HTTP method.
+            resource (str): Resource path.
+            cluster (str): Name of the cluster in a federation (empty label otherwise).
+    """
+    UPSTREAM_RETRIES.labels(cluster or "", method, resource_template(resource)).inc()
+
+
+def count_items(route, items):
+    """_summary_
+        Count the list items returned by a route.
+
+        Args:
+            route (str): Route path template.
+            items (int): Number of items.
+    """
+    RESPONSE_ITEMS.labels(route).inc(items)
+
+
+# Collectors of the hypervisor backends served by this process
+COLLECTORS = []
+
+
+def register_collector(hypervisor):
+    """_summary_
+        Expose the counters of a hypervisor backend.
+
+        Args:
+            hypervisor (Proxmox): Hypervisor backend.
+    """
+    collector = HypervisorCollector(hypervisor)
+    COLLECTORS.append(collector)
+    REGISTRY.register(collector)
+
+
+def render_metrics():
+    """_summary_
+        Render every metric in the Prometheus text format.
+        With several workers, the samples of every worker are merged (the hypervisor
+        counters are those of the worker answering the scrape).
+
+        Returns:
+            tuple: (body, content type).
+    """
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in COLLECTORS:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def close_metrics():
+    """_summary_
+        Unregister the hypervisor collectors and, with several workers, drop this worker's live gauges.
+    """
+    while COLLECTORS:
+        REGISTRY.unregister(COLLECTORS.pop())
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+# Create HypervisorCollector class
+
+
+class HypervisorCollector:
+
+    # Initialize HypervisorCollector class
+    def __init__(self, hypervisor):
+        self.hypervisor = hypervisor
+
+    def collect(self):
+        """_summary_
+            Expose the hypervisor's own counters (cache, coalescing, tasks, VM store, circuits) at scrape time.
+            A federation exposes those of every cluster, labelled with its name.
+        """
+        members = getattr(self.hypervisor, "members", None)
+        labels = ["cluster"] if members is not None else []
+        members = members if members is not None else {None: self.hypervisor}
+        lookups = CounterMetricFamily("ironsight_cache_lookups", "Response cache lookups", labels=labels + ["result"])
+        entries = GaugeMetricFamily("ironsight_cache_entries", "Cached responses", labels=labels)
+        coalesced = CounterMetricFamily("ironsight_coalesced_requests", "GETs served by another in-flight call",
+                                        labels=labels)
+        tasks = GaugeMetricFamily("ironsight_tasks_running", "Upstream tasks in flight", labels=labels)
+        vms = GaugeMetricFamily("ironsight_vms", "VMs in the VM store", labels=labels)
+        circuits = GaugeMetricFamily("ironsight_circuit_open", "Upstream circuits not closed (1) per node",
+                                     labels=labels + ["node"])
+        for name, member in members.items():
+            cluster = [name] if labels else []
+            cache = getattr(member, "cache", None)
+            if cache is not None:
+                stats = cache.stats()
+                for result in ("hits", "stale_hits", "misses"):
+                    lookups.add_metric(cluster + [result], stats[result])
+                entries.add_metric(cluster, stats["entries"])
+            inflight = getattr(member, "inflight", None)
+            if inflight is not None:
+                coalesced.add_metric(cluster, inflight.stats()["collapsed"])
+            if getattr(member, "tasks", None) is not None:
+                tasks.add_metric(cluster, len(member.tasks.in_flight()))
+            if getattr(member, "vm_store", None) is not None:
+                vms.add_metric(cluster, len(member.vm_store))
+            breaker = getattr(member, "breaker", None)
+            if breaker is not None:
+                for key, circuit in breaker.stats().items():
+                    circuits.add_metric(cluster + [key], int(circuit["state"] != "closed"))
+        for family in (lookups, entries, coalesced, tasks, vms, circuits):
+            if family.samples:
+                yield family
+
+# Create MetricsMiddleware class
+
+
+class MetricsMiddleware:
+
+    # Initialize MetricsMiddleware class
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """_summary_
+            Time an API request and count the bytes it returns (streamed responses included).
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        response = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope, unknown paths share one label
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(method, route, str(response["status"])).observe(time.perf_counter() - start)
+            RESPONSE_BYTES.labels(route).inc(response["bytes"])
+            REQUESTS_IN_PROGRESS.labels(method).dec()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import re
+
+"""_summary_
+    This is the node placement engine for the hypervisor interface.
+    It scores the nodes of the cluster by their live CPU, memory and disk
+    headroom (from cluster/resources) minus the clones already pending on them,
+    and picks a target node for every clone of a batch with a placement strategy.
+"""
+
+# Configuration keys of VM disks (CD-ROM drives among them are skipped)
+DISK_KEY = re.compile(r"(ide|sata|scsi|virtio|efidisk|tpmstate)\d+$")
+
+
+def clone_demand(template, linked=None):
+    """_summary_
+        Get the resources a clone of a template will take.
+
+        Args:
+            template (dict): Template from cluster/resources.
+            linked (bool): Linked clones share the template disks and take no disk of their own.
+
+        Returns:
+            dict: vCPUs, memory and disk (bytes) of the clone.
+    """
+    return {"cpus": template.get("maxcpu") or 0, "mem": template.get("maxmem") or 0,
+            "disk": 0 if linked else template.get("maxdisk") or 0}
+
+
+def disk_storages(config):
+    """_summary_
+        Get the storages the disks of a VM are on.
+
+        Args:
+            config (dict): VM configuration (nodes/{node}/qemu/{vmid}/config).
+
+        Returns:
+            set: Storage names (pass-through devices by their path).
+    """
+    storages = set()
+    for key, value in config.items():
+        if DISK_KEY.match(key) and isinstance(value, str) and "media=cdrom" not in value:
+            storages.add(value.split(",")[0].split(":")[0])
+    return storages
+
+
+def on_shared_storage(config, storages):
+    """_summary_
+        Check whether every disk of a VM is on shared storage, which Proxmox needs to clone it to another node.
+
+        Args:
+            config (dict): VM configuration.
+            storages (list): Storages from cluster/resources.
+
+        Returns:
+            bool: True if clones can be placed on any node.
+    """
+    shared = {storage.get("storage") for storage in storages if storage.get("shared")}
+    return disk_storages(config) <= shared
+
+
+def node_state(node, storages=None):
+    """_summary_
+        Get the capacity and live usage of a node.
+
+        Args:
+            node (dict): Node from cluster/resources.
+            storages (list): Storages from cluster/resources, disk space is taken from
+                the ones on this node that hold VM images (the node's own disk is the root filesystem).
+
+        Returns:
+            dict: Node state used for scoring.
+    """
+    maxcpu = node.get("maxcpu") or 0
+    images = [storage for storage in storages or []
+              if storage.get("node") == node.get("node") and "images" in (storage.get("content") or "")]
+    disk_source = images or [node]
+    return {"node": node.get("node"), "online": node.get("status") == "online",
+            "maxcpu": maxcpu, "cpus": (node.get("cpu") or 0) * maxcpu,
+            "maxmem": node.get("maxmem") or 0, "mem": node.get("mem") or 0,
+            "maxdisk": sum(source.get("maxdisk") or 0 for source in disk_source),
+            "disk": sum(source.get("disk") or 0 for source in disk_source)}
+
+
+def add_demand(state, demand):
+    """_summary_
+        Account for a clone on a node.
+    """
+    for resource in ("cpus", "mem", "disk"):
+        state[resource] += demand[resource]
+
+
+def headroom(state, demand=None):
+    """_summary_
+        Get the headroom of a node, the free share of its scarcest resource (CPU, memory or disk).
+
+        Args:
+            state (dict): Node state.
+            demand (dict): Clone to account for first.
+
+        Returns:
+            float: Free share, below 0 when the node is overcommitted.
+    """
+    demand = demand or {"cpus": 0, "mem": 0, "disk": 0}
+    free = []
+    for resource, capacity in (("cpus", "maxcpu"), ("mem", "maxmem"), ("disk", "maxdisk")):
+        if state[capacity]:
+            free.append(1 - (state[resource] + demand[resource]) / state[capacity])
+    return min(free, default=0)
+
+
+def fits(state, demand, reserve=0.1):
+    """_summary_
+        Check whether a clone fits on a node, keeping a share of its memory and disk free.
+        CPU is not checked, vCPUs are overcommitted.
+
+        Args:
+            state (dict): Node state.
+            demand (dict): Clone to place.
+            reserve (float): Share of memory and disk to keep free.
+
+        Returns:
+            bool: True if the clone fits.
+    """
+    for resource, capacity in (("mem", "maxmem"), ("disk", "maxdisk")):
+        if state[capacity] and state[resource] + demand[resource] > state[capacity] * (1 - reserve):
+            return False
+    return state["online"]
+
+
+def spread(candidates, demand):
+    """_summary_
+        Spread clones out, picking the node left with the most headroom.
+    """
+    return max(candidates, key=lambda state: headroom(state, demand))
+
+
+def binpack(candidates, demand):
+    """_summary_
+        Pack clones tightly, picking the fullest node that still fits them.
+    """
+    return min(candidates, key=lambda state: headroom(state, demand))
+
+
+# Placement strategies, name -> function(candidate node states, demand) -> chosen node state
+STRATEGIES = {
+    "spread": spread,
+    "binpack": binpack,
+}
+
+
+def register_strategy(name, strategy):
+    """_summary_
+        Add a placement strategy.
+
+        Args:
+            name (str): Name of the strategy.
+            strategy (callable): Function(candidate node states, demand) returning the chosen node state.
+    """
+    STRATEGIES[name] = strategy
+
+# Create PlacementPlanner class
+
+
+class PlacementPlanner:
+
+    # Initialize PlacementPlanner class
+    def __init__(self, nodes, storages=None, pending=None, reserve=0.1):
+        # node name -> node state, with the pending clones accounted for
+        self.states = {node.get("node"): node_state(node, storages) for node in nodes}
+        for node_name, demand in pending or []:
+            if node_name in self.states:
+                add_demand(self.states[node_name], demand)
+        # Share of memory and disk kept free on every node
+        self.reserve = reserve
+        # Affinity group -> node its clones are placed on
+        self.groups = {}
+
+    def place(self, vm_name, demand, strategy="spread", group=None, nodes=None):
+        """_summary_
+            Pick a node for a clone and account for it.
+            Clones of the same affinity group go to the same node as long as it has room.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+                demand (dict): Resources of the clone.
+                strategy (str): Placement strategy (spread, binpack...).
+                group (str): Affinity group of the clone.
+                nodes (list): Only consider these nodes.
+
+            Returns:
+                dict: Placement decision.
+        """
+        decision = {"name": vm_name, "node": None, "strategy": strategy, "group": group}
+        candidates = [state for state in self.states.values()
+                      if (nodes is None or state["node"] in nodes) and fits(state, demand, self.reserve)]
+        if not candidates:
+            decision["error"] = "No node has room"
+            return decision
+        by_name = {state["node"]: state for state in candidates}
+        if group is not None and self.groups.get(group) in by_name:
+            chosen = by_name[self.groups[group]]
+            decision["strategy"] = "affinity"
+        else:
+            chosen = STRATEGIES[strategy](candidates, demand)
+            if group is not None:
+                self.groups.setdefault(group, chosen["node"])
+        add_demand(chosen, demand)
+        decision["node"] = chosen["node"]
+        decision["headroom"] = headroom(chosen)
+        return decision
+
+    def plan(self, vm_names, demand, strategy="spread", affinity=None, nodes=None):
+        """_summary_
+            Pick a node for every clone of a batch.
+
+            Args:
+                vm_names (list): Names of the virtual machines.
+                demand (dict): Resources of each clone.
+                strategy (str): Placement strategy (spread, binpack...).
+                affinity (dict): VM name -> affinity group.
+                nodes (list): Only consider these nodes.
+
+            Returns:
+                list: Placement decision per VM.
+        """
+        affinity = affinity or {}
+        return [self.place(vm_name, demand, strategy, affinity.get(vm_name), nodes) for vm_name in vm_names]
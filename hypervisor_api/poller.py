@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import time
+from loguru import logger
+from hypervisor_api.utils import maybe_await, item_key
+
+"""_summary_
+    This is the background inventory poller for the Ironsight API.
+    It refreshes inventory and usage from the hypervisor on a schedule, diffs
+    each snapshot against the previous one and pushes only the changes to
+    subscribers (e.g. the /events stream), so upstream load stays the same
+    however many dashboards are open.
+"""
+
+
+def diff_snapshots(old, new):
+    """_summary_
+        Diff two snapshots (dicts of key -> item).
+
+        Args:
+            old (dict): Previous snapshot.
+            new (dict): Current snapshot.
+
+        Returns:
+            dict: Added items, removed keys and changed fields per key.
+    """
+    added = [item for key, item in new.items() if key not in old]
+    removed = [key for key in old if key not in new]
+    changed = []
+    for key, item in new.items():
+        previous = old.get(key)
+        if previous is None or previous == item:
+            continue
+        fields = {field: value for field, value in item.items() if previous.get(field) != value}
+        fields.update({field: None for field in previous if field not in item})
+        changed.append({"key": key, "fields": fields})
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def snapshot_vms(response):
+    """_summary_
+        Build a VM snapshot (keyed by VMID, cluster/VMID in a federation) from a get_vms response.
+    """
+    return {item_key(vm, "vmid"): vm for vm in (response or {}).get("data") or []}
+
+
+def snapshot_nodes(response):
+    """_summary_
+        Build a node snapshot (keyed by node name, cluster/node in a federation) from a get_nodes response.
+    """
+    return {item_key(node, "node"): node for node in (response or {}).get("data") or []}
+
+
+def snapshot_node_usage(response):
+    """_summary_
+        Build a usage snapshot (keyed by node name, latest sample) from a get_usage_graph response.
+    """
+    snapshot = {}
+    for node in (response or {}).get("data") or []:
+        samples = node.get("data") or []
+        if samples:
+            snapshot[item_key(node, "node")] = samples[-1]
+    return snapshot
+
+# Create InventoryPoller class
+
+
+class InventoryPoller:
+
+    # Initialize InventoryPoller class
+    def __init__(self, hypervisor, interval=None, usage_interval=None):
+        self.hypervisor = hypervisor
+        # Seconds between inventory / usage refreshes
+        self.interval = interval or float(os.getenv("HYPERVISOR_POLL_INTERVAL") or 5)
+        self.usage_interval = usage_interval or float(os.getenv("HYPERVISOR_USAGE_POLL_INTERVAL") or 60)
+        # topic -> (hypervisor method name, snapshot builder, interval)
+        self.topics = {
+            "vms": ("get_vms", snapshot_vms, self.interval),
+            "nodes": ("get_nodes", snapshot_nodes, self.interval),
+            "usage_nodes": ("get_usage_graph", snapshot_node_usage, self.usage_interval),
+        }
+        # Latest snapshot, version and poll time of each topic
+        self.snapshots = {topic: {} for topic in self.topics}
+        self.versions = {topic: 0 for topic in self.topics}
+        self.polled_at = {topic: 0 for topic in self.topics}
+        # Subscriber queues -> set of topics they want
+        self.subscribers = {}
+        self.task = None
+
+    def start(self):
+        """_summary_
+            Start polling in the background.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """_summary_
+            Stop polling.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def subscribe(self, topics=None, max_events=100):
+        """_summary_
+            Subscribe to change events.
+
+            Args:
+                topics (list): Topics to receive, defaults to all of them.
+                max_events (int): Events buffered before the oldest are dropped.
+
+            Returns:
+                asyncio.Queue: Queue that events are pushed to.
+        """
+        topics = set(topics or self.topics) & set(self.topics)
+        queue = asyncio.Queue(maxsize=max_events)
+        self.subscribers[queue] = topics
+        # Start with the current state, so clients don't need a separate full fetch
+        for topic in topics:
+            if self.polled_at[topic]:
+                self.push(queue, self.snapshot_event(topic))
+        return queue
+
+    def unsubscribe(self, queue):
+        """_summary_
+            Stop pushing events to a subscriber.
+
+            Args:
+                queue (asyncio.Queue): Queue returned by subscribe.
+        """
+        self.subscribers.pop(queue, None)
+
+    def snapshot_event(self, topic):
+        """_summary_
+            Build a full snapshot event for a topic.
+        """
+        return {"topic": topic, "type": "snapshot", "version": self.versions[topic],
+                "data": list(self.snapshots[topic].values())}
+
+    def push(self, queue, event):
+        """_summary_
+            Push an event to a subscriber, dropping its oldest event if it can't keep up.
+        """
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def publish(self, event):
+        """_summary_
+            Push an event to every subscriber of its topic.
+        """
+        for queue, topics in list(self.subscribers.items()):
+            if event["topic"] in topics:
+                self.push(queue, event)
+
+    async def poll(self, topic):
+        """_summary_
+            Refresh one topic and publish what changed.
+
+            Args:
+                topic (str): Topic to refresh.
+        """
+        method, build_snapshot, _ = self.topics[topic]
+        response = await maybe_await(getattr(self.hypervisor, method))
+        self.polled_at[topic] = time.monotonic()
+        if not isinstance(response, dict) or response.get("status") != "success":
+            logger.error(f"Error: Poller could not refresh {topic}")
+            return
+        snapshot = build_snapshot(response)
+        changes = diff_snapshots(self.snapshots[topic], snapshot)
+        self.snapshots[topic] = snapshot
+        if changes["added"] or changes["removed"] or changes["changed"]:
+            self.versions[topic] += 1
+            self.publish({"topic": topic, "type": "changes", "version": self.versions[topic], **changes})
+
+    async def run(self):
+        """_summary_
+            Poll every topic that has subscribers when it is due.
+        """
+        while True:
+            wanted = set().union(*self.subscribers.values()) if self.subscribers else set()
+            now = time.monotonic()
+            due = [topic for topic in wanted
+                   if now - self.polled_at[topic] >= self.topics[topic][2]]
+            for topic in due:
+                try:
+                    await self.poll(topic)
+                except Exception as e:
+                    logger.error(f"Error: Poller failed on {topic}: {e}")
+            await asyncio.sleep(1)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextvars
+import httpx
+from loguru import logger
+from hypervisor_api.proxmox.proxmox import Proxmox
+from hypervisor_api.utils import asynchronous
+
+"""_summary_
+    This is the asyncio Proxmox hypervisor communication interface for the Ironsight API.
+    It shares the request and response logic of the Proxmox class (its flows become
+    coroutine methods), but talks to Proxmox through a non-blocking HTTP client so that
+    API routes can await it without stalling the event loop. Only the transport calls
+    (HTTP requests, retry pauses, fan-outs, coalescing, background refreshes and shared
+    store I/O) differ.
+"""
+
+# Create AsyncProxmox class
+
+
+@asynchronous
+class AsyncProxmox(Proxmox):
+
+    # Transport failures of the HTTP client, and the timeouts among them
+    transport_errors = httpx.TransportError
+    timeout_errors = httpx.TimeoutException
+
+    def __init__(self, url=None, auth=None, token=None, cluster=None):
+        super().__init__(url, auth, token, cluster)
+        # Background cache refresh tasks in flight
+        self.background_tasks = set()
+
+    def create_session(self):
+        """_summary_
+            Create a pooled keep-alive async HTTP client for the Proxmox API.
+
+            Returns:
+                httpx.AsyncClient: Client with a sized connection pool.
+        """
+        limits = httpx.Limits(max_connections=self.pool_connections * self.pool_maxsize,
+                              max_keepalive_connections=self.pool_maxsize)
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        return httpx.AsyncClient(limits=limits, timeout=timeout, headers={"Accept": "application/json"})
+
+    async def close(self):
+        """_summary_
+            Close the HTTP client and release pooled connections.
+        """
+        await self.session.aclose()
+
+    async def send(self, method, url, timeout, **kwargs):
+        """_summary_
+            Send an HTTP request to the Proxmox API.
+
+            Args:
+                method (str): HTTP method.
+                url (str): URL of the resource.
+                timeout (tuple): (connect, read) timeout in seconds.
+                kwargs: Headers, query parameters and form data.
+
+            Returns:
+                httpx.Response: Response.
+        """
+        return await self.session.request(method, url, timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                                          **kwargs)
+
+    async def pause(self, delay):
+        """_summary_
+            Wait before retrying a call.
+        """
+        await asyncio.sleep(delay)
+
+    async def offload(self, func, *args):
+        """_summary_
+            Make a call that may wait on the shared store (SQLite between workers) in a worker thread,
+            so the event loop never waits on the database. Without a shared store it is made right away.
+
+            Args:
+                func (callable): Cache or version log method.
+                args: Arguments of the method.
+
+            Returns:
+                object: Result of the method.
+        """
+        if self.versions.shared is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    async def share(self, flight, key, func, *args):
+        """_summary_
+            Await a call once for every concurrent caller with the same key.
+
+            Args:
+                flight (SingleFlight | RequestMemo): Calls in flight (upstream or within a batch).
+                key (str): Request key.
+                func (callable): Coroutine function making the call.
+                args: Arguments of the function.
+
+            Returns:
+                dict: Result of the function.
+        """
+        return await flight.do_async(key, func, *args)
+
+    def refresh_in_background(self, key, resource, params):
+        """_summary_
+            Start the refresh of a stale cache entry.
+            The refresh outlives the request, so it doesn't inherit its deadline or trace.
+        """
+        task = asyncio.create_task(self.revalidate(key, resource, params), context=contextvars.Context())
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def fan_out(self, func, items, limit=None):
+        """_summary_
+            Await a coroutine function for every item concurrently, bounded by max_concurrency.
+            A failure is turned into an error result for that item only.
+
+            Args:
+                func (callable): Coroutine function to call with each item.
+                items (list): Items to fan out over.
+                limit (int): Concurrency bound, defaults to max_concurrency.
+
+            Returns:
+                list: Results in the same order as items.
+        """
+        semaphore = asyncio.Semaphore(limit or self.max_concurrency)
+
+        async def run(item):
+            async with semaphore:
+                try:
+                    return await func(item)
+                except Exception as e:
+                    logger.error(f"Error: {e}")
+                    return {"status": "error", "error": str(e)}
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
+
+    async def fan_out_iter(self, func, items, limit=None):
+        """_summary_
+            Like fan_out, but yield each result as soon as its call completes.
+
+            Args:
+                func (callable): Coroutine function to call with each item.
+                items (list): Items to fan out over.
+                limit (int): Concurrency bound, defaults to max_concurrency.
+
+            Yields:
+                tuple: (item, result) in completion order.
+        """
+        semaphore = asyncio.Semaphore(limit or self.max_concurrency)
+
+        async def run(item):
+            async with semaphore:
+                try:
+                    return item, await func(item)
+                except Exception as e:
+                    logger.error(f"Error: {e}")
+                    return item, {"status": "error", "error": str(e)}
+
+        tasks = [asyncio.ensure_future(run(item)) for item in items]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Don't leave calls running if the consumer went away
+            for task in tasks:
+                task.cancel()
+
+    async def wait_for_task(self, upid, timeout):
+        """_summary_
+            Wait until an upstream task finishes.
+
+            Args:
+                upid (str): Task ID.
+                timeout (float): Maximum seconds to wait.
+
+            Returns:
+                dict: Task record, or None if it isn't tracked.
+        """
+        return await self.tasks.wait(upid, timeout)
+
+    async def iter_vms(self, status=None, node=None, template=None, name=None, tags=None, fields=None):
+        """_summary_
+            Stream virtual machines from the hypervisor, without building the sorted list.
+
+            Args:
+                status (str): Power status filter.
+                node (str): Node filter.
+                template (bool): Template filter.
+                name (str): Name glob filter.
+                tags (list): Tags filter.
+                fields (list): Fields to return.
+
+            Yields:
+                dict: Virtual machine, or an error.
+        """
+        for vm in self.stream_vms(await self.get_vm_store(), status, node, template, name, tags, fields):
+            yield vm
+
+    async def iter_usage_graph(self, start=None, end=None):
+        """_summary_
+            Stream the usage graph of every node, each node as soon as its samples are in.
+
+            Args:
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+
+            Yields:
+                dict: Usage graph of a node, or an error.
+        """
+        start, end = self.usage_range(start, end)
+        node_names = await self.get_node_names()
+        if node_names is None:
+            yield {"status": "error", "error": "Node list could not be retrieved"}
+            return
+        async for node_name, result in self.fan_out_iter(lambda name: self.ingest_node_usage(name, start), node_names):
+            samples = self.usage_store.query(("node", node_name), start, end)
+            yield self.build_node_usage(node_name, result, samples)
+
+    async def iter_vm_usage_graph(self, start=None, end=None):
+        """_summary_
+            Stream the usage graph of every VM, each VM as soon as its samples are in.
+
+            Args:
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+
+            Yields:
+                dict: Usage graph of a VM, or an error.
+        """
+        start, end = self.usage_range(start, end)
+        vm_list = await self.get_vm_list()
+        if vm_list is None:
+            yield {"status": "error", "error": "VM list could not be retrieved"}
+            return
+        async for vm, result in self.fan_out_iter(lambda vm: self.ingest_vm_usage(vm, start), vm_list):
+            samples = self.usage_store.query(("vm", vm.get("vmid")), start, end)
+            yield self.build_vm_usage(vm, result, samples)
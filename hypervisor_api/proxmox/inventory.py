@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""_summary_
+    This is the Proxmox inventory engine for the Ironsight API.
+    It builds node and resource views from a single cluster/resources
+    listing, instead of walking nodes/{node}/qemu node by node. VM views are
+    served by the VMStore, which is loaded from the same listing.
+"""
+
+# Create Inventory class
+
+
+class Inventory:
+
+    # Initialize Inventory class
+    def __init__(self, resources, stale=False):
+        # Raw cluster/resources entries (nodes, VMs, containers, storage, pools...)
+        self.resources = resources or []
+        # True when the entries are a stale copy served because Proxmox couldn't answer
+        self.stale = stale
+
+    def filter(self, resource_type=None, **fields):
+        """_summary_
+            Get resources of a type, optionally matching field values.
+
+            Args:
+                resource_type (str): cluster/resources type (node, qemu, lxc, storage, pool...).
+                fields: Field values the resources must match.
+
+            Returns:
+                list: Matching resources.
+        """
+        return [resource for resource in self.resources
+                if (resource_type is None or resource.get("type") == resource_type)
+                and all(resource.get(key) == value for key, value in fields.items())]
+
+    def get_nodes(self):
+        """_summary_
+            Get all nodes in the cluster.
+
+            Returns:
+                list: List of nodes.
+        """
+        return self.filter("node")
+
+    def has_node(self, node_name):
+        """_summary_
+            Check whether a node is part of the cluster.
+
+            Args:
+                node_name (str): Name of the node.
+
+            Returns:
+                bool: True if the node exists.
+        """
+        return len(self.filter("node", node=node_name)) > 0
@@ -1,57 +1,921 @@
 #!/usr/bin/env python3
 
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
 import os
+import re
+import threading
+import time
 from loguru import logger
 from dotenv import load_dotenv
+from hypervisor_api.proxmox.inventory import Inventory
+from hypervisor_api.proxmox.vm_store import VMStore
+from hypervisor_api.cache import ResponseCache, make_key
+from hypervisor_api.singleflight import SingleFlight
+from hypervisor_api.batch import current_memo
+from hypervisor_api.metrics import track_upstream, count_retry
+from hypervisor_api.resilience import RetryPolicy, CircuitBreaker, remaining, is_failure, breaker_key, unavailable, \
+    current_deadline
+from hypervisor_api.timeseries import TimeSeriesStore
+from hypervisor_api.tasks import TaskTracker
+from hypervisor_api.versions import InventoryVersions
+from hypervisor_api.query import apply_query, match_vm, project, split_list
+from hypervisor_api.placement import PlacementPlanner, STRATEGIES, clone_demand, headroom, on_shared_storage
+from hypervisor_api.utils import flow
 load_dotenv()
 
 """_summary_
     This is the Proxmox hypervisor communication interface for the Ironsight API.
     It is responsible for communicating with Proxmox for VM and container management.
+    Methods that call Proxmox are flows (see utils.flow), written once for this
+    blocking backend and the asyncio one, which only swaps the transport calls.
+    Flows never block between their yields: upstream calls go through send and
+    shared store I/O through offload (see utils.flow).
 """
 
+# Power actions supported by bulk_power
+BULK_ACTIONS = ("start", "stop", "reboot", "toggle_power")
+
 # Create Proxmox class
 
 
-class Proxmox:
+class Proxmox:
+
+    # Transport failures of the HTTP client, and the timeouts among them
+    transport_errors = requests.RequestException
+    timeout_errors = requests.Timeout
+
+    # Initialize Proxmox class
+    def __init__(self, url=None, auth=None, token=None, cluster=None):
+        # Get hypervisor URL from class constructor (one cluster of a federation), or the environment
+        self.hypervisor_url = url or os.getenv("HYPERVISOR_URL")
+        # Name of the cluster in a federation (None on its own), labels the upstream call metrics
+        self.cluster = cluster
+        # Get hypervisor API key from class constructor
+        self.hypervisor_auth = auth or os.getenv("HYPERVISOR_AUTH")
+        self.hypervisor_token = token or os.getenv("HYPERVISOR_TOKEN")
+        # Set up hypervisor URL / URL schema
+        self.url_schema = "{hypervisor_url}/api2/json/{resource}"
+        # Connection pool settings (number of host pools, connections kept per host)
+        self.pool_connections = int(os.getenv("HYPERVISOR_POOL_CONNECTIONS") or 10)
+        self.pool_maxsize = int(os.getenv("HYPERVISOR_POOL_MAXSIZE") or 20)
+        # Connect / read timeouts in seconds
+        self.connect_timeout = float(os.getenv("HYPERVISOR_CONNECT_TIMEOUT") or 5)
+        self.read_timeout = float(os.getenv("HYPERVISOR_READ_TIMEOUT") or 30)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        # Jittered retries of failed GETs and a circuit breaker per node, so broken nodes fail fast
+        self.retry = RetryPolicy.from_env()
+        self.breaker = CircuitBreaker.from_env()
+        # Maximum number of concurrent upstream calls in a per-node / per-VM fan-out
+        self.max_concurrency = int(os.getenv("HYPERVISOR_MAX_CONCURRENCY") or 8)
+        # Compact VM store indexed by name, VMID, node, status and template flag, so lookups don't scan every VM
+        self.vm_store = VMStore()
+        # VMIDs handed out to clones, vmid -> expiry (None while the clone is running)
+        self.reserved_ids = {}
+        # Clones placed but not finished yet, vmid -> (node, resources), counted against node headroom
+        self.pending_clones = {}
+        self.id_lock = threading.RLock()
+        # Default placement strategy for new clones and share of node memory / disk kept free
+        self.placement_strategy = os.getenv("HYPERVISOR_PLACEMENT_STRATEGY") or "spread"
+        self.placement_reserve = float(os.getenv("HYPERVISOR_PLACEMENT_RESERVE") or 0.1)
+        # Seconds to wait for a clone task before giving up on the following steps
+        self.clone_timeout = float(os.getenv("HYPERVISOR_CLONE_TIMEOUT") or 600)
+        # Response cache for read calls (None when disabled), shared between workers when HYPERVISOR_SHARED_CACHE is set
+        self.cache = ResponseCache.from_env(self.hypervisor_url)
+        if self.cache is not None:
+            self.cache.on_invalidate = self.forget_reads
+        # Seconds the VM store is trusted before it is refreshed from cluster/resources (cached)
+        self.inventory_ttl = float(os.getenv("HYPERVISOR_INVENTORY_TTL") or
+                                   (self.cache.ttl_for("cluster/resources") if self.cache else 0))
+        # Coalescing of concurrent identical GETs into one upstream call (None when disabled)
+        coalesce = (os.getenv("HYPERVISOR_COALESCE") or "true").lower() in ("1", "true", "yes")
+        self.inflight = SingleFlight() if coalesce else None
+        # Local store of RRD usage samples, ingested incrementally
+        self.usage_store = TimeSeriesStore.from_env()
+        # Tracker of the upstream tasks (UPIDs) started by write calls
+        self.tasks = TaskTracker(self)
+        # Versions of the VM / node listings, for ETags and change feeds
+        self.versions = InventoryVersions.from_env(self.hypervisor_url)
+        # Set up long-lived keep-alive session shared by every method
+        self.session = self.create_session()
+
+    def create_session(self):
+        """_summary_
+            Create a pooled keep-alive HTTP session for the Proxmox API.
+
+            Returns:
+                requests.Session: Session with a sized connection pool.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept": "application/json"})
+        return session
+
+    def close(self):
+        """_summary_
+            Close the HTTP session and release pooled connections.
+        """
+        self.session.close()
+
+    def get_headers(self, post=False):
+        """_summary_
+            Get the authentication headers for a Proxmox API call.
+
+            Args:
+                post (bool): Include the CSRF prevention token for write calls.
+
+            Returns:
+                dict: Request headers (unset values are left out).
+        """
+        headers = {"Authorization": self.hypervisor_auth}
+        if post:
+            headers["CSRFPreventionToken"] = self.hypervisor_token
+        return {key: value for key, value in headers.items() if value is not None}
+
+    def parse_response(self, response):
+        """_summary_
+            Parse an HTTP response from the Proxmox API.
+
+            Args:
+                response (requests.Response | httpx.Response): Response to parse.
+
+            Returns:
+                dict: Result of the API call.
+        """
+        # Check for error in response
+        if response.status_code != 200:
+            logger.error(f"Error: {response.status_code}")
+            logger.error(f"Response: {response.text}")
+            return {"status": "error", "error": response.status_code, "response": response.text}
+        response = response.json()
+        response['status'] = "success"
+        return response
+
+    def call_timeout(self):
+        """_summary_
+            Get the (connect, read) timeout of an upstream call, cut down to what is left of the request's deadline.
+
+            Returns:
+                tuple: (connect, read) timeout in seconds, None if the deadline has passed.
+        """
+        left = remaining()
+        if left is None:
+            return self.timeout
+        if left <= 0:
+            return None
+        return min(self.connect_timeout, left), min(self.read_timeout, left)
+
+    def fan_out(self, func, items, limit=None):
+        """_summary_
+            Call a function for every item concurrently, bounded by max_concurrency.
+            A failure is turned into an error result for that item only.
+
+            Args:
+                func (callable): Function to call with each item.
+                items (list): Items to fan out over.
+                limit (int): Concurrency bound, defaults to max_concurrency.
+
+            Returns:
+                list: Results in the same order as items.
+        """
+        if not items:
+            return []
+        # Each call runs in a copy of the caller's context, so request tracing follows it into the pool
+        calls = [(contextvars.copy_context(), item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(limit or self.max_concurrency, len(items))) as executor:
+            return list(executor.map(lambda call: call[0].run(self.call_safely, func, call[1]), calls))
+
+    def fan_out_iter(self, func, items, limit=None):
+        """_summary_
+            Like fan_out, but yield each result as soon as its call completes.
+
+            Args:
+                func (callable): Function to call with each item.
+                items (list): Items to fan out over.
+                limit (int): Concurrency bound, defaults to max_concurrency.
+
+            Yields:
+                tuple: (item, result) in completion order.
+        """
+        if not items:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(limit or self.max_concurrency, len(items)))
+        try:
+            futures = {executor.submit(contextvars.copy_context().run, self.call_safely, func, item): item
+                       for item in items}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Don't start the remaining calls if the consumer went away
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def call_safely(self, func, item):
+        """_summary_
+            Call a function for a fan-out item, turning a failure into an error result.
+        """
+        try:
+            return func(item)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            return {"status": "error", "error": str(e)}
+
+    def send(self, method, url, timeout, **kwargs):
+        """_summary_
+            Send an HTTP request to the Proxmox API.
+
+            Args:
+                method (str): HTTP method.
+                url (str): URL of the resource.
+                timeout (tuple): (connect, read) timeout in seconds.
+                kwargs: Headers, query parameters and form data.
+
+            Returns:
+                requests.Response: Response.
+        """
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def pause(self, delay):
+        """_summary_
+            Wait before retrying a call.
+        """
+        time.sleep(delay)
+
+    def share(self, flight, key, func, *args):
+        """_summary_
+            Make a call once for every concurrent caller with the same key.
+
+            Args:
+                flight (SingleFlight | RequestMemo): Calls in flight (upstream or within a batch).
+                key (str): Request key.
+                func (callable): Function making the call.
+                args: Arguments of the function.
+
+            Returns:
+                dict: Result of the function.
+        """
+        return flight.do(key, func, *args)
+
+    def offload(self, func, *args):
+        """_summary_
+            Make a call that may wait on the shared store (SQLite between workers).
+            Blocking callers already run off the event loop, so it is made right away.
+
+            Args:
+                func (callable): Cache or version log method.
+                args: Arguments of the method.
+
+            Returns:
+                object: Result of the method.
+        """
+        return func(*args)
+
+    def refresh_in_background(self, key, resource, params):
+        """_summary_
+            Start the refresh of a stale cache entry.
+            The refresh outlives the request, so it doesn't inherit its deadline or trace.
+        """
+        threading.Thread(target=contextvars.Context().run, args=(self.revalidate, key, resource, params),
+                         daemon=True).start()
+
+    def usage_range(self, start=None, end=None):
+        """_summary_
+            Resolve a usage time range, defaulting to the last hour.
+
+            Args:
+                start (int): Start of the range (unix time).
+                end (int): End of the range (unix time).
+
+            Returns:
+                tuple: (start, end)
+        """
+        end = int(end) if end is not None else int(time.time())
+        start = int(start) if start is not None else end - 3600
+        return start, end
+
+    def build_node_usage(self, node_name, result, samples):
+        """_summary_
+            Build the usage graph entry for one node.
+
+            Args:
+                node_name (str): Name of the node.
+                result (dict): Result of ingesting nodes/{node}/rrddata.
+                samples (list): Samples from the usage store.
+
+            Returns:
+                dict: Usage graph entry.
+        """
+        temp_data = {}
+        temp_data["data"] = samples
+        temp_data["node"] = node_name
+        self.mark_usage(temp_data, result)
+        return temp_data
+
+    def build_vm_usage(self, vm, result, samples):
+        """_summary_
+            Build the usage graph entry for one virtual machine.
+
+            Args:
+                vm (dict): VM from the VM list.
+                result (dict): Result of ingesting nodes/{node}/qemu/{vmid}/rrddata.
+                samples (list): Samples from the usage store.
+
+            Returns:
+                dict: Usage graph entry.
+        """
+        temp_data = {}
+        temp_data["data"] = samples
+        temp_data["node"] = vm.get("node")
+        temp_data["vm_name"] = vm.get("name")
+        temp_data["status"] = vm.get("status")
+        self.mark_usage(temp_data, result)
+        return temp_data
+
+    def mark_usage(self, entry, result):
+        """_summary_
+            Mark a usage graph entry whose samples couldn't be refreshed (stale samples from the store,
+            unavailable when the node's circuit is open or it didn't answer).
+
+            Args:
+                entry (dict): Usage graph entry.
+                result (dict): Result of ingesting the rrddata.
+        """
+        if result.get("status") != "success":
+            entry["error"] = result.get("error")
+            if result.get("unavailable"):
+                entry["unavailable"] = True
+                entry["stale"] = bool(entry["data"])
+        elif result.get("stale"):
+            entry["stale"] = True
+
+    def select_vms(self, vm_list, names=None, node=None, prefix=None, template=False, status=None):
+        """_summary_
+            Select VMs from a VM list by name and/or filters.
+
+            Args:
+                vm_list (list): VMs to select from.
+                names (list): Names of the VMs to select.
+                node (str): Only VMs on this node.
+                prefix (str): Only VMs whose name starts with this prefix.
+                template (bool): Select templates (True) or regular VMs (False), None for both.
+                status (str): Only VMs with this power status (e.g. running, stopped).
+
+            Returns:
+                tuple: (selected VMs, names that were not found)
+        """
+        selected = vm_list
+        missing = []
+        if names is not None:
+            by_name = {vm.get("name"): vm for vm in vm_list}
+            missing = [name for name in names if name not in by_name]
+            selected = [by_name[name] for name in dict.fromkeys(names) if name in by_name]
+        if node is not None:
+            selected = [vm for vm in selected if vm.get("node") == node]
+        if prefix is not None:
+            selected = [vm for vm in selected if (vm.get("name") or "").startswith(prefix)]
+        if template is not None:
+            selected = [vm for vm in selected if bool(vm.get("template")) == template]
+        if status is not None:
+            selected = [vm for vm in selected if vm.get("status") == status]
+        return selected, missing
+
+    def power_resource(self, action, vm):
+        """_summary_
+            Get the status resource to post to for a power action on a VM.
+
+            Args:
+                action (str): start, stop, reboot or toggle_power.
+                vm (dict): VM from the VM list.
+
+            Returns:
+                str: Resource to post to.
+        """
+        if action == "toggle_power":
+            action = "stop" if vm.get("status") == "running" else "start"
+        return f"nodes/{vm.get('node')}/qemu/{vm.get('vmid')}/status/{action}"
+
+    def build_bulk_result(self, action, vm, response):
+        """_summary_
+            Build the per-VM result of a bulk power action.
+
+            Args:
+                action (str): Power action.
+                vm (dict): VM from the VM list.
+                response (dict): Result of the API call.
+
+            Returns:
+                dict: Per-VM result.
+        """
+        result = {"name": vm.get("name"), "vmid": vm.get("vmid"), "node": vm.get("node"),
+                  "action": action, "status": response.get("status")}
+        if response.get("status") == "success":
+            result["data"] = response.get("data")
+        else:
+            result["error"] = response.get("error")
+        return result
+
+    def provision_names(self, names=None, prefix=None, count=None):
+        """_summary_
+            Get the names of the VMs to provision.
+
+            Args:
+                names (list): Names of the VMs.
+                prefix (str): Name prefix, used with count (e.g. lab- gives lab-01, lab-02...).
+                count (int): Number of VMs to name from the prefix.
+
+            Returns:
+                list: Unique VM names, in order.
+        """
+        vm_names = list(names or [])
+        if prefix is not None and count:
+            width = len(str(count))
+            vm_names += [f"{prefix}{index:0{width}d}" for index in range(1, count + 1)]
+        return list(dict.fromkeys(vm_names))
+
+    def expire_reservations(self):
+        """_summary_
+            Drop reservations (and pending placements) of finished clones once they are past their grace period.
+        """
+        with self.id_lock:
+            now = time.monotonic()
+            self.reserved_ids = {vm_id: expires for vm_id, expires in self.reserved_ids.items()
+                                 if expires is None or expires > now}
+            self.pending_clones = {vm_id: pending for vm_id, pending in self.pending_clones.items()
+                                   if vm_id in self.reserved_ids}
+
+    def claim_vm_ids(self, count, inventory, next_id, dry_run=False):
+        """_summary_
+            Reserve a block of free VMIDs.
+
+            Args:
+                count (int): Number of VMIDs.
+                inventory (Inventory): Current inventory of the cluster VMs.
+                next_id (int): First free VMID according to the hypervisor (cluster/nextid).
+                dry_run (bool): Only pick the VMIDs, don't reserve them.
+
+            Returns:
+                list: Reserved VMIDs.
+        """
+        with self.id_lock:
+            self.expire_reservations()
+            used = {resource.get("vmid") for resource in inventory.resources} | set(self.reserved_ids)
+            vm_ids = []
+            vm_id = max(next_id, 100)
+            while len(vm_ids) < count:
+                if vm_id not in used:
+                    vm_ids.append(vm_id)
+                    if not dry_run:
+                        self.reserved_ids[vm_id] = None
+                vm_id += 1
+        return vm_ids
+
+    def release_vm_id(self, vm_id, grace=0):
+        """_summary_
+            Release a reserved VMID.
+
+            Args:
+                vm_id (int): Reserved VMID.
+                grace (float): Seconds to keep it reserved, so cached listings catch up with the new VM.
+        """
+        with self.id_lock:
+            if grace:
+                self.reserved_ids[vm_id] = time.monotonic() + grace
+            else:
+                self.reserved_ids.pop(vm_id, None)
+                self.pending_clones.pop(vm_id, None)
+
+    def plan_clones(self, inventory, next_id, template_name, vm_names, linked=None, strategy=None,
+                    affinity=None, dry_run=False, shared=False):
+        """_summary_
+            Pick a node and reserve a VMID for every clone of a batch, as one atomic step.
+
+            Args:
+                inventory (Inventory): Current inventory of the cluster (nodes and VMs).
+                next_id (int): First free VMID according to the hypervisor (cluster/nextid).
+                template_name (str): Name of the template.
+                vm_names (list): Names of the virtual machines.
+                linked (bool): Linked clones instead of full copies.
+                strategy (str): Placement strategy (spread, binpack or template), defaults to placement_strategy.
+                affinity (dict): VM name -> affinity group, clones of a group are placed together.
+                dry_run (bool): Only plan, don't reserve anything.
+                shared (bool): Every disk of the template is on shared storage, otherwise clones stay on its node.
+
+            Returns:
+                dict: Template location, clones as (name, vmid, node), VMs that were skipped and the placement decisions.
+        """
+        location = self.vm_store.locate(template_name)
+        if location is None:
+            logger.error(f"Error: Template {template_name} not found")
+            return {"status": "error", "error": "Template not found"}
+        strategy = strategy or self.placement_strategy
+        if strategy != "template" and strategy not in STRATEGIES:
+            return {"status": "error", "error": f"Unknown placement strategy {strategy}"}
+        template_node, template_id = location
+        template = (inventory.filter("qemu", node=template_node, vmid=template_id) or [{}])[0]
+        demand = clone_demand(template, linked)
+        # Names are unique in this API, existing VMs are not cloned again
+        skipped = [self.build_provision_result(vm_name, None, None, "reserved", "VM already exists")
+                   for vm_name in vm_names if vm_name in self.vm_store]
+        new_names = [vm_name for vm_name in vm_names if vm_name not in self.vm_store]
+        # The template strategy keeps every clone on the template's node, so does a template with local disks
+        nodes = [template_node] if strategy == "template" or not shared else None
+        with self.id_lock:
+            self.expire_reservations()
+            planner = PlacementPlanner(inventory.get_nodes(), inventory.filter("storage"),
+                                       self.pending_clones.values(), self.placement_reserve)
+            decisions = planner.plan(new_names, demand, "spread" if strategy == "template" else strategy,
+                                     affinity, nodes)
+            placed = [decision for decision in decisions if decision["node"] is not None]
+            vm_ids = self.claim_vm_ids(len(placed), inventory, next_id, dry_run)
+            for decision, vm_id in zip(placed, vm_ids):
+                decision["vmid"] = vm_id
+                if not dry_run:
+                    self.pending_clones[vm_id] = (decision["node"], demand)
+        skipped += [self.build_provision_result(decision["name"], None, None, "placing", decision["error"])
+                    for decision in decisions if decision["node"] is None]
+        return {"status": "success", "template": location, "demand": demand,
+                "clones": [(decision["name"], decision["vmid"], decision["node"]) for decision in placed],
+                "skipped": skipped, "placement": decisions,
+                "nodes": {name: headroom(state) for name, state in planner.states.items()}}
+
+    def task_error(self, task):
+        """_summary_
+            Get the error of a finished upstream task.
+
+            Args:
+                task (dict): Task record.
+
+            Returns:
+                str: Error message, or None if the task succeeded.
+        """
+        if task is None:
+            return "Task not found"
+        if task.get("status") == "running":
+            return "Timed out waiting for task"
+        if task.get("exitstatus") != "OK":
+            return task.get("exitstatus") or "Task failed"
+        return None
+
+    def build_provision_result(self, vm_name, vm_id, node_name, step, error=None):
+        """_summary_
+            Build a provisioning progress event / per-VM result.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+                vm_id (int): ID of the virtual machine.
+                node_name (str): Name of the node.
+                step (str): Step reached (cloning, cloned, configured, started, done).
+                error (str): Error of the failed step.
+
+            Returns:
+                dict: Progress event.
+        """
+        result = {"name": vm_name, "vmid": vm_id, "node": node_name, "step": step,
+                  "status": "error" if error else "success"}
+        if error:
+            result["error"] = error
+        return result
+
+    def update_vm_index(self, vm_list):
+        """_summary_
+            Update the VM store (and its name index) in place from a complete VM listing.
+
+            Args:
+                vm_list (list): VMs with name, node and vmid (qemu listing or cluster/resources).
+        """
+        self.vm_store.update(vm_list)
+        # Usage history of deleted VMs would otherwise be kept forever
+        self.usage_store.retain("vm", {vm.get("vmid") for vm in vm_list})
+
+    def index_vm(self, vm_name, node_name, vm_id):
+        """_summary_
+            Add or move a VM in the VM store.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+                node_name (str): Name of the node.
+                vm_id (int): ID of the virtual machine.
+        """
+        self.vm_store.put(vm_name, node_name, vm_id)
+
+    def forget_vm(self, vm_name):
+        """_summary_
+            Drop a VM from the VM store (e.g. when it went missing), the next read refreshes the store.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+        """
+        self.vm_store.remove(vm_name)
+
+    @flow
+    def refresh_vm_index(self):
+        """_summary_
+            Refresh the VM name index with a single (uncached) cluster/resources call.
+
+            Returns:
+                Inventory: Inventory of the cluster VMs, or None if it could not be retrieved.
+        """
+        inventory = yield self.get_inventory("vm", use_cache=False)
+        if inventory is None:
+            logger.error("Error: VM index could not be refreshed")
+            return None
+        self.update_vm_index(inventory.filter("qemu"))
+        return inventory
+
+    @flow
+    def lookup_vm(self, vm_name):
+        """_summary_
+            Look up the node and ID of a VM by name, refreshing the index on a miss.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+
+            Returns:
+                tuple: (node_name, vm_id), or None if the VM doesn't exist.
+        """
+        location = self.vm_store.locate(vm_name)
+        if location is None:
+            yield self.refresh_vm_index()
+            location = self.vm_store.locate(vm_name)
+        return location
+
+    def track_task(self, response, resource):
+        """_summary_
+            Record the upstream task started by a write call, if it started one.
+
+            Args:
+                response (dict): Result of the API call.
+                resource (str): Resource that was posted.
+        """
+        upid = response.get("data")
+        if isinstance(upid, str) and upid.startswith("UPID:"):
+            self.tasks.record(upid, resource)
+
+    def get_tasks(self, status=None):
+        """_summary_
+            Get the tracked upstream tasks.
+
+            Args:
+                status (str): Only tasks with this status (running or stopped).
+
+            Returns:
+                dict: Tasks, newest first.
+        """
+        return {"status": "success", "data": self.tasks.list(status)}
+
+    @flow
+    def get_task_status(self, node_name, upid):
+        """_summary_
+            Get the status of an upstream task.
+
+            Args:
+                node_name (str): Name of the node running the task.
+                upid (str): Task ID.
+
+            Returns:
+                dict: Task status.
+        """
+        return (yield self.get_resource(f"nodes/{node_name}/tasks/{upid}/status", use_cache=False))
+
+    def get_coalescing_stats(self):
+        """_summary_
+            Get request coalescing statistics.
+
+            Returns:
+                dict: Requests, upstream calls and calls collapsed into another one.
+        """
+        if self.inflight is None:
+            return {"status": "error", "error": "Coalescing is disabled"}
+        return {"status": "success", "data": self.inflight.stats()}
+
+    def get_circuit_stats(self):
+        """_summary_
+            Get the state of the per-node circuit breakers.
+
+            Returns:
+                dict: Node (or "cluster") -> circuit state and consecutive failures.
+        """
+        return {"status": "success", "data": self.breaker.stats()}
+
+    def get_cache_stats(self):
+        """_summary_
+            Get response cache statistics.
+
+            Returns:
+                dict: Cache hit/miss counters.
+        """
+        if self.cache is None:
+            return {"status": "error", "error": "Cache is disabled"}
+        return {"status": "success", "data": self.cache.stats()}
+
+    @flow
+    def invalidate_cache(self, resource):
+        """_summary_
+            Drop cached (and in-flight) responses that a write to a resource may have changed.
+
+            Args:
+                resource (str): Resource that was written to.
+        """
+        prefixes = ["cluster/resources"]
+        # Writes below a VM (power, config, clone) also change that VM and its node
+        match = re.match(r"nodes/([^/]+)/qemu/(\d+)", resource)
+        if match:
+            node_name, vm_id = match.groups()
+            prefixes += [f"nodes/{node_name}/qemu/{vm_id}/", f"nodes/{node_name}/status"]
+        if self.cache is not None:
+            yield self.offload(self.cache.invalidate, *prefixes)
+        self.forget_reads(*prefixes)
+
+    def forget_reads(self, *prefixes):
+        """_summary_
+            Stop reusing in-flight reads and the VM store after a write (made by this worker or another one).
+
+            Args:
+                prefixes (str): Resource path prefixes that were invalidated.
+        """
+        # Reads already in flight started before the write, later reads shouldn't join them
+        if self.inflight is not None:
+            self.inflight.forget(*prefixes)
+        if not prefixes or any(prefix.startswith("cluster/resources") for prefix in prefixes):
+            self.vm_store.expire()
+
+    @flow
+    def revalidate(self, key, resource, params):
+        """_summary_
+            Refresh a stale cache entry in the background.
+
+            Args:
+                key (str): Cache key.
+                resource (str): Resource to get.
+                params (dict): Query parameters.
+        """
+        # Runs in a fresh context, bounded by its own deadline rather than the request's
+        current_deadline.set(time.monotonic() + self.connect_timeout + self.read_timeout)
+        try:
+            response = yield self.fetch_resource(resource, params)
+            if response.get("status") == "success":
+                yield self.offload(self.cache.set, key, resource, response)
+        except Exception as e:
+            logger.error(f"Error: Could not refresh {resource}: {e}")
+        finally:
+            self.cache.finish_refresh(key)
+
+    @flow
+    def get_resource(self, resource, params=None, use_cache=True):
+        """_summary_
+            Get a resource from the Proxmox API, going through the response cache.
+            Within a batch request, each resource is read once and shared by every sub-query.
+
+            Args:
+                resource (str): Resource to get.
+                params (dict): Query parameters.
+                use_cache (bool): Set to False to always go to Proxmox.
+
+            Returns:
+                dict: Result of the API call.
+        """
+        memo = current_memo.get()
+        if memo is None or not use_cache:
+            return (yield self.read_resource(resource, params, use_cache))
+        return (yield self.share(memo, f"{self.hypervisor_url} {make_key(resource, params)}", self.read_resource,
+                                 resource, params))
+
+    @flow
+    def read_resource(self, resource, params=None, use_cache=True):
+        """_summary_
+            Get a resource through the response cache.
+            Stale cached responses are served while they are refreshed in the background.
+
+            Args:
+                resource (str): Resource to get.
+                params (dict): Query parameters.
+                use_cache (bool): Set to False to always go to Proxmox.
+
+            Returns:
+                dict: Result of the API call.
+        """
+        if self.cache is None or not use_cache:
+            response = yield self.fetch_resource(resource, params)
+            if self.cache is not None and response.get("status") == "success":
+                yield self.offload(self.cache.set, self.cache.make_key(resource, params), resource, response)
+            return (yield self.fall_back(resource, params, response))
+        # Writes made through another worker drop our copies too
+        if self.cache.sync_due():
+            yield self.offload(self.cache.sync_invalidations)
+        key = self.cache.make_key(resource, params)
+        # Another worker may have fetched it since
+        if self.cache.needs_shared(key):
+            yield self.offload(self.cache.load_shared, key)
+        response, state = self.cache.get(key)
+        if state == "stale" and self.cache.start_refresh(key):
+            self.refresh_in_background(key, resource, params)
+        if response is not None:
+            return response
+        response = yield self.fetch_resource(resource, params)
+        if response.get("status") == "success":
+            yield self.offload(self.cache.set, key, resource, response)
+        return (yield self.fall_back(resource, params, response))
+
+    @flow
+    def fall_back(self, resource, params, response):
+        """_summary_
+            Serve the last good response, marked as stale, when the hypervisor couldn't answer.
+
+            Args:
+                resource (str): Resource that was requested.
+                params (dict): Query parameters.
+                response (dict): Result of the API call.
 
-    # Initialize Proxmox class
-    def __init__(self):
-        # Get hypervisor URL from class constructor
-        self.hypervisor_url = os.getenv("HYPERVISOR_URL")
-        # Get hypervisor API key from class constructor
-        self.hypervisor_auth = os.getenv("HYPERVISOR_AUTH")
-        self.hypervisor_token = os.getenv("HYPERVISOR_TOKEN")
-        # Set up hypervisor URL / URL schema
-        self.url_schema = "{hypervisor_url}/api2/json/{resource}"
+            Returns:
+                dict: Result of the API call, or the stale response.
+        """
+        if not response.get("unavailable") or self.cache is None:
+            return response
+        key = self.cache.make_key(resource, params)
+        if self.cache.shared is not None:
+            yield self.offload(self.cache.load_shared, key)
+        stale = self.cache.fallback(key)
+        if stale is None:
+            return response
+        logger.warning(f"Serving stale {resource} ({stale['stale_age']}s old): {response.get('error')}")
+        return stale
 
-    def get_resource(self, resource, params=None):
+    @flow
+    def fetch_resource(self, resource, params=None):
         """_summary_
-            Get a resource from the Proxmox API.
+            Get a resource from the Proxmox API (uncached).
+            Concurrent identical requests share one upstream call.
 
             Args:
                 resource (str): Resource to get.
+                params (dict): Query parameters.
 
             Returns:
                 dict: Result of the API call.
         """
+        if self.inflight is None:
+            return (yield self.request_resource(resource, params))
+        return (yield self.share(self.inflight, make_key(resource, params), self.request_resource, resource, params))
+
+    @flow
+    def request_resource(self, resource, params=None):
+        """_summary_
+            Send a GET request to the Proxmox API.
+            Failed calls are retried with jittered backoff within the request's deadline,
+            and calls to a node whose circuit is open fail fast.
+
+            Args:
+                resource (str): Resource to get.
+                params (dict): Query parameters.
+
+            Returns:
+                dict: Result of the API call (marked unavailable if the node couldn't answer).
+        """
         url = self.url_schema.format(
             hypervisor_url=self.hypervisor_url, resource=resource)
-        response = requests.get(url, headers={
-                                "Accept": "application/json", "Authorization": self.hypervisor_auth}, params=params)
-        # Check for error in response
-        if response.status_code != 200:
-            logger.error(f"Error: {response.status_code}")
-            logger.error(f"Response: {response.text}")
-            return {"status": "error", "error": response.status_code, "response": response.text}
-        response = response.json()
-        response['status'] = "success"
-        return response
+        key = breaker_key(resource)
+        attempt = 0
+        while True:
+            timeout = self.call_timeout()
+            if timeout is None:
+                return unavailable("Deadline exceeded")
+            if not self.breaker.allow(key):
+                return unavailable(f"{key} is unavailable")
+            attempt += 1
+            try:
+                with track_upstream("GET", resource, self.cluster) as call:
+                    call["response"] = yield self.send("GET", url, timeout, headers=self.get_headers(), params=params)
+                error = call["response"].status_code if is_failure(call["response"].status_code) else None
+            except self.transport_errors as e:
+                error = str(e) or type(e).__name__
+                # Timeouts cut short by the deadline aren't the node's fault
+                if timeout[1] < self.read_timeout and isinstance(e, self.timeout_errors):
+                    self.breaker.release(key)
+                    return unavailable("Deadline exceeded")
+            except BaseException:
+                # Cut off before an outcome (e.g. cancelled), so a probe mustn't leave the circuit half-open
+                self.breaker.release(key)
+                raise
+            if error is None:
+                self.breaker.succeed(key)
+                return self.parse_response(call["response"])
+            self.breaker.fail(key)
+            delay = self.retry.delay(attempt)
+            if delay is None:
+                logger.error(f"Error: GET {resource} failed after {attempt} attempts: {error}")
+                return unavailable(error)
+            count_retry("GET", resource, self.cluster)
+            yield self.pause(delay)
 
+    @flow
     def post_resource(self, resource, data=None, params=None):
         """_summary_
             Post a resource to the Proxmox API.
+            Writes aren't retried, but fail fast when the node's circuit is open.
 
             Args:
                 resource (str): Resource to post.
@@ -61,17 +925,32 @@ class Proxmox:
         """
         url = self.url_schema.format(
             hypervisor_url=self.hypervisor_url, resource=resource)
-        response = requests.post(url, headers={
-            "Accept": "application/json", "Authorization": self.hypervisor_auth, "CSRFPreventionToken": self.hypervisor_token}, data=data, params=params)
-        # Check for error in response
-        if response.status_code != 200:
-            logger.error(f"Error: {response.status_code}")
-            logger.error(f"Response: {response.text}")
-            return {"status": "error", "error": response.status_code, "response": response.text}
-        response = response.json()
-        response['status'] = "success"
+        key = breaker_key(resource)
+        if not self.breaker.allow(key):
+            return unavailable(f"{key} is unavailable")
+        timeout = self.call_timeout() or self.timeout
+        try:
+            with track_upstream("POST", resource, self.cluster) as call:
+                call["response"] = yield self.send("POST", url, timeout, headers=self.get_headers(post=True),
+                                                   data=data, params=params)
+        except self.transport_errors:
+            self.breaker.fail(key)
+            raise
+        except BaseException:
+            # Cut off before an outcome (e.g. cancelled), so a probe mustn't leave the circuit half-open
+            self.breaker.release(key)
+            raise
+        if is_failure(call["response"].status_code):
+            self.breaker.fail(key)
+        else:
+            self.breaker.succeed(key)
+        response = self.parse_response(call["response"])
+        if response.get("status") == "success":
+            yield self.invalidate_cache(resource)
+            self.track_task(response, resource)
         return response
 
+    @flow
     def get_summary(self):
         """_summary_
             Get summary from the hypervisor.
@@ -83,10 +962,11 @@ class Proxmox:
             "hypervisor": "Proxmox",
             "hypervisor_url": self.hypervisor_url,
             "hypervisor_api_url": self.url_schema.format(hypervisor_url=self.hypervisor_url, resource=""),
-            "version": self.get_version().get("data").get("version"),
+            "version": (yield self.get_version()).get("data").get("version"),
         }
         return summary_response
 
+    @flow
     def get_version(self):
         """_summary_
             Get version information from the hypervisor.
@@ -94,8 +974,9 @@ class Proxmox:
             Returns:
                 dict: Version information.
         """
-        return self.get_resource("version")
+        return (yield self.get_resource("version"))
 
+    @flow
     def get_nodes(self):
         """_summary_
             Get all nodes from the hypervisor.
@@ -103,8 +984,13 @@ class Proxmox:
             Returns:
                 list: List of nodes.
         """
-        return self.get_resource("nodes")
+        response = yield self.get_resource("nodes")
+        if response.get("status") == "success":
+            response["version"] = yield self.offload(
+                self.versions.observe, "nodes", {node.get("node"): node for node in response.get("data") or []})
+        return response
 
+    @flow
     def get_node(self, node_name):
         """_summary_
             Get a node from the hypervisor.
@@ -115,56 +1001,185 @@ class Proxmox:
             Returns:
                 dict: Node status/details.
         """
-        return self.get_resource(f"nodes/{node_name}/status")
+        return (yield self.get_resource(f"nodes/{node_name}/status"))
+
+    @flow
+    def get_inventory(self, resource_type=None, use_cache=True):
+        """_summary_
+            Get an inventory of the whole cluster with a single cluster/resources call.
+
+            Args:
+                resource_type (str): Only fetch this resource type (vm, node, storage or sdn).
+                use_cache (bool): Set to False to always go to Proxmox.
+
+            Returns:
+                Inventory: Inventory of the cluster, or None if it could not be retrieved.
+        """
+        params = {"type": resource_type} if resource_type else None
+        resources = yield self.get_resource("cluster/resources", params=params, use_cache=use_cache)
+        if resources.get("status") == "error":
+            logger.error("Error: Cluster resources could not be retrieved")
+            return None
+        return Inventory(resources.get("data"), resources.get("stale", False))
+
+    @flow
+    def get_vm_store(self, use_cache=True):
+        """_summary_
+            Get the VM store, refreshing it in place from cluster/resources once it is older than inventory_ttl.
+
+            Args:
+                use_cache (bool): Set to False to always refresh from Proxmox.
+
+            Returns:
+                VMStore: VM store, or None if it could not be refreshed.
+        """
+        # Writes made through another worker expire the store too
+        if self.cache is not None and self.cache.sync_due():
+            yield self.offload(self.cache.sync_invalidations)
+        if use_cache and self.vm_store.updated_at and self.vm_store.age() < self.inventory_ttl:
+            return self.vm_store
+        inventory = yield self.get_inventory("vm", use_cache=use_cache)
+        if inventory is None:
+            return None
+        self.update_vm_index(inventory.filter("qemu"))
+        # A stale listing is served, but the next read tries Proxmox again
+        self.vm_store.stale = inventory.stale
+        if inventory.stale:
+            self.vm_store.expire()
+        return self.vm_store
+
+    @flow
+    def has_node(self, node_name):
+        """_summary_
+            Check whether a node is part of the cluster.
+
+            Args:
+                node_name (str): Name of the node.
+
+            Returns:
+                bool: True if the node exists.
+        """
+        inventory = yield self.get_inventory("node")
+        return inventory is not None and inventory.has_node(node_name)
 
+    @flow
     @logger.catch
-    def get_vms(self):
+    def get_vms(self, **query):
         """_summary_
             Get virtual machines from the hypervisor.
 
+            Args:
+                query: Filters, fields, sort and pagination (see query.apply_query).
+
             Returns:
                 list: List of virtual machines.
         """
-        node_list = self.get_nodes().get("data")
-        # Parse node list to pull out node names
-        try:
-            node_names = [node.get("node") for node in node_list]
-        except Exception as e:
-            logger.error(e)
-            return {"status": "error", "error": e, "data": []}
-        # Get virtual machines from each node and merge into one list
-        vm_list = []
-        for node in node_names:
-            vm_data = self.get_resource(f"nodes/{node}/qemu").get("data")
-            # Append VM data to list
-            for vm in vm_data:
-                vm['node'] = node
-                # Sort VM data by key
-                vm = dict(sorted(vm.items()))
-                vm_list.append(vm)
-        # Return VM list
-        return {"status": "success", "data": vm_list}
-
-    def get_vms_on_node(self, node_name):
+        store = yield self.get_vm_store()
+        if store is None:
+            return {"status": "error", "error": "VM list could not be retrieved", "data": []}
+        vm_list = store.listing()
+        version = yield self.offload(self.versions.observe, "vms", {vm.get("vmid"): vm for vm in vm_list})
+        response = apply_query(vm_list, **query)
+        if response["status"] == "success":
+            response["version"] = version
+            if store.stale:
+                response["stale"] = True
+        return response
+
+    @flow
+    def get_vm_changes(self, since=None):
+        """_summary_
+            Get the VMs added, removed and changed since an inventory version.
+
+            Args:
+                since (int): Version the client has (from a previous listing or changes call).
+
+            Returns:
+                dict: Changes, or the full list if the version is unknown.
+        """
+        response = yield self.get_vms()
+        if response.get("status") != "success":
+            return response
+        return {"status": "success", **(yield self.offload(self.versions.changes, "vms", since))}
+
+    @flow
+    def count_vms(self, node=None, status=None, template=None):
+        """_summary_
+            Count virtual machines, from the VM store indexes.
+
+            Args:
+                node (str): Only VMs on this node.
+                status (str): Only VMs with this power status.
+                template (bool): Templates (True) or regular VMs (False), None for both.
+
+            Returns:
+                dict: Number of VMs.
+        """
+        store = yield self.get_vm_store()
+        if store is None:
+            return {"status": "error", "error": "VM list could not be retrieved"}
+        return {"status": "success", "data": {"count": store.count(node, status, template)}}
+
+    def iter_vms(self, status=None, node=None, template=None, name=None, tags=None, fields=None):
+        """_summary_
+            Stream virtual machines from the hypervisor, without building the sorted list.
+
+            Args:
+                status (str): Power status filter.
+                node (str): Node filter.
+                template (bool): Template filter.
+                name (str): Name glob filter.
+                tags (list): Tags filter.
+                fields (list): Fields to return.
+
+            Yields:
+                dict: Virtual machine, or an error.
+        """
+        yield from self.stream_vms(self.get_vm_store(), status, node, template, name, tags, fields)
+
+    def stream_vms(self, store, status=None, node=None, template=None, name=None, tags=None, fields=None):
+        """_summary_
+            Stream the virtual machines of the VM store matching the filters (see iter_vms).
+
+            Args:
+                store (VMStore): VM store, None if it could not be refreshed.
+
+            Yields:
+                dict: Virtual machine, or an error.
+        """
+        if store is None:
+            yield {"status": "error", "error": "VM list could not be retrieved"}
+            return
+        tags, fields = split_list(tags), split_list(fields)
+
+        # Indexed fields narrow the records down before any dict is built
+        for record in store.select(node, status, template):
+            vm = record.as_dict(sort_keys=False)
+            if match_vm(vm, name=name, tags=tags):
+                yield project(vm, fields)
+
+    @flow
+    def get_vms_on_node(self, node_name, **query):
         """_summary_
             Get all virtual machines from a node.
 
             Args:
                 node_name (str): Name of the node.
+                query: Filters, fields, sort and pagination (see query.apply_query).
 
             Returns:
                 list: List of virtual machines.
         """
-        vm_list = self.get_resource(f"nodes/{node_name}/qemu")
-        if vm_list.get("status") == "success":
-            for vm in vm_list.get("data"):
-                vm['node'] = node_name
-                # Sort VM data by key
-                vm = dict(sorted(vm.items()))
-            return vm_list
-        else:
-            return {"status": "error", "error": vm_list.get("error"), "response": vm_list.get("response")}
+        store = yield self.get_vm_store()
+        if store is None:
+            return {"status": "error", "error": "VM list could not be retrieved"}
+        records = store.select(node_name, query.get("status"), query.get("template"))
+        # Only a node without matching VMs needs checking
+        if not records and not (yield self.has_node(node_name)):
+            return {"status": "error", "error": "Node not found"}
+        return apply_query(store.listing(records), **query)
 
+    @flow
     def get_vm_by_id(self, node_name, vm_id):
         """_summary_
             Get a virtual machine from the hypervisor by ID.
@@ -176,7 +1191,7 @@ class Proxmox:
             Returns:
                 dict: Virtual machine status/details.
         """
-        vm_data = self.get_resource(
+        vm_data = yield self.get_resource(
             f"nodes/{node_name}/qemu/{vm_id}/status/current")
         if vm_data.get("status") == "error":
             return {"status": "error", "error": vm_data.get("error"), "response": vm_data.get("response")}
@@ -184,57 +1199,91 @@ class Proxmox:
         vm_data['node'] = node_name
         return {"status": "success", "data": vm_data}
 
+    @flow
     def get_vm_by_name(self, vm_name):
         """_summary_
             Get a virtual machine from the hypervisor by name.
-            (Warning, this is more expensive than getting by ID due to looping through all VMs/nodes.)
+            The node and ID are looked up in the VM name index, which is refreshed on a miss.
 
             Args:
-                node_name (str): Name of the node.
                 vm_name (str): Name of the virtual machine.
 
             Returns:
                 dict: Virtual machine status/details.
         """
-        # Cant get VM by name, so get all VMs and loop through them to get the ID
-        vm_list = self.get_vms().get("data")
-        for vm in vm_list:
-            if vm.get("name") == vm_name:
-                vm_data = self.get_vm_by_id(
-                    vm.get("node"), vm.get("vmid")).get("data")
-                return {"status": "success", "data": vm_data}
-        return {"status": "error", "error": "VM not found"}
+        location = yield self.lookup_vm(vm_name)
+        if location is None:
+            return {"status": "error", "error": "VM not found"}
+        node_name, vm_id = location
+        vm_data = yield self.get_vm_by_id(node_name, vm_id)
+        if vm_data.get("status") == "error":
+            # VM may have been moved or deleted, refresh the index and try once more
+            self.forget_vm(vm_name)
+            location = yield self.lookup_vm(vm_name)
+            if location is None:
+                return {"status": "error", "error": "VM not found"}
+            node_name, vm_id = location
+            vm_data = yield self.get_vm_by_id(node_name, vm_id)
+            if vm_data.get("status") == "error":
+                self.forget_vm(vm_name)
+                return {"status": "error", "error": "VM not found"}
+        return {"status": "success", "data": vm_data.get("data")}
 
-    def get_templates(self):
+    @flow
+    def get_templates(self, **query):
         """_summary_
             Get templates from the hypervisor.
 
+            Args:
+                query: Filters, fields, sort and pagination (see query.apply_query).
+
             Returns:
-                list: List of templates.
+                list: List of templates (a paged response when a query is given).
         """
-        # Get list of VMs, if template=1 then it is a template
-        vm_list = self.get_vms().get("data")
-        template_list = [vm for vm in vm_list if vm.get("template") == 1]
-        return template_list
+        store = yield self.get_vm_store()
+        if store is None:
+            return [] if not query else {"status": "error", "error": "VM list could not be retrieved"}
+        templates = store.listing(store.select(query.get("node"), query.get("status"), template=True))
+        if not query:
+            return templates
+        return apply_query(templates, **query)
 
-    def start_vm(self, vm_name):
+    @flow
+    def post_vm_resource(self, vm_name, action, data=None, params=None):
         """_summary_
-            Power on a virtual machine.
+            Post to a resource of a virtual machine looked up by name.
+            (nodes/{node}/qemu/{vmid}/{action})
 
             Args:
                 vm_name (str): Name of the virtual machine.
+                action (str): Resource below the VM to post to.
+
+            Returns:
+                dict: Result of the API call.
         """
-        try:
-            vm_data = self.get_vm_by_name(vm_name).get("data")
-            vm_id = vm_data.get("vmid")
-            node_name = vm_data.get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
+        location = yield self.lookup_vm(vm_name)
+        if location is None:
+            logger.error(f"Error: VM {vm_name} not found")
             return {"error": "VM not found"}
-        response = self.post_resource(
-            f"nodes/{node_name}/qemu/{vm_id}/status/start")
+        node_name, vm_id = location
+        response = yield self.post_resource(
+            f"nodes/{node_name}/qemu/{vm_id}/{action}", data=data, params=params)
+        if response.get("status") == "error":
+            # Don't keep a location that may have gone stale
+            self.forget_vm(vm_name)
         return response
 
+    @flow
+    def start_vm(self, vm_name):
+        """_summary_
+            Power on a virtual machine.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+        """
+        return (yield self.post_vm_resource(vm_name, "status/start"))
+
+    @flow
     def stop_vm(self, vm_name):
         """_summary_
             Power off a virtual machine.
@@ -242,19 +1291,9 @@ class Proxmox:
             Args:
                 vm_name (str): Name of the virtual machine.
         """
-        try:
-            vm_data = self.get_vm_by_name(vm_name).get("data")
-            vm_id = vm_data.get("vmid")
-            node_name = vm_data.get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
-            return {"error": "VM not found"}
-        print("Stopping VM...")
-        print(f'"nodes/{node_name}/qemu/{vm_id}/status/stop')
-        response = self.post_resource(
-            f"nodes/{node_name}/qemu/{vm_id}/status/stop")
-        return response
+        return (yield self.post_vm_resource(vm_name, "status/stop"))
 
+    @flow
     def power_toggle_vm(self, vm_name):
         """_summary_
             Toggle power on/off a virtual machine.
@@ -262,25 +1301,25 @@ class Proxmox:
             Args:
                 vm_name (str): Name of the virtual machine.
         """
-        try:
-            vm_data = self.get_vm_by_name(vm_name).get("data")
-            vm_id = vm_data.get("vmid")
-            node_name = vm_data.get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
+        vm_data = (yield self.get_vm_by_name(vm_name)).get("data")
+        if vm_data is None:
+            logger.error(f"Error: VM {vm_name} not found")
             return {"error": "VM not found"}
+        vm_id = vm_data.get("vmid")
+        node_name = vm_data.get("node")
         # If VM is running, power off
         if vm_data.get("status") == "running":
-            print(f"Powering off VM {vm_name}")
-            response = self.post_resource(
+            logger.info(f"Powering off VM {vm_name}")
+            response = yield self.post_resource(
                 f"nodes/{node_name}/qemu/{vm_id}/status/stop")
         # Else power on
         else:
-            print(f"Powering on VM {vm_name}")
-            response = self.post_resource(
+            logger.info(f"Powering on VM {vm_name}")
+            response = yield self.post_resource(
                 f"nodes/{node_name}/qemu/{vm_id}/status/start")
         return response
 
+    @flow
     def reboot_vm(self, vm_name):
         """_summary_
             Reboot a virtual machine.
@@ -288,49 +1327,292 @@ class Proxmox:
             Args:
                 vm_name (str): Name of the virtual machine.
         """
-        try:
-            vm_id = self.get_vm_by_name(vm_name).get("vmid")
-            node_name = self.get_vm_by_name(vm_name).get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
-            return {"error": "VM not found"}
-        response = self.post_resource(
-            f"nodes/{node_name}/qemu/{vm_id}/status/reboot")
-        return response
+        return (yield self.post_vm_resource(vm_name, "status/reboot"))
 
-    def create_vm(self, vm_name, template_name):
+    @flow
+    def bulk_power(self, action, names=None, node=None, prefix=None, template=False, status=None, limit=None):
         """_summary_
-            Create a virtual machine from a template.
+            Run a power action on many virtual machines at once.
+            Targets are resolved from a single inventory read and dispatched concurrently.
+
+            Args:
+                action (str): start, stop, reboot or toggle_power.
+                names (list): Names of the VMs.
+                node (str): Only VMs on this node.
+                prefix (str): Only VMs whose name starts with this prefix.
+                template (bool): Select templates (True) or regular VMs (False), None for both.
+                status (str): Only VMs with this power status.
+                limit (int): Number of actions dispatched at once, defaults to max_concurrency.
+
+            Returns:
+                dict: Result per VM.
+        """
+        if action not in BULK_ACTIONS:
+            return {"status": "error", "error": f"Unknown action {action}"}
+        store = yield self.get_vm_store()
+        if store is None:
+            return {"status": "error", "error": "VM list could not be retrieved"}
+        vm_list = store.listing()
+        targets, missing = self.select_vms(vm_list, names, node, prefix, template, status)
+        responses = yield self.fan_out(
+            lambda vm: self.post_resource(self.power_resource(action, vm)), targets, limit)
+        results = [self.build_bulk_result(action, vm, response) for vm, response in zip(targets, responses)]
+        results += [{"name": name, "action": action, "status": "error", "error": "VM not found"} for name in missing]
+        return {"status": "success", "data": results}
+
+    @flow
+    def get_next_vm_id(self):
+        """_summary_
+            Get the first free VMID from the hypervisor.
+
+            Returns:
+                int: VMID, or None if it could not be retrieved.
+        """
+        response = yield self.get_resource("cluster/nextid", use_cache=False)
+        if response.get("status") != "success":
+            return None
+        return int(response.get("data"))
+
+    @flow
+    def read_cluster(self):
+        """_summary_
+            Read the cluster (nodes, VMs and templates) and the first free VMID, to place new clones.
+            The VM name index is refreshed along the way.
+
+            Returns:
+                tuple: (Inventory, next VMID), or (None, None) if the cluster could not be read.
+        """
+        # Uncached, so VMIDs and headroom come from a current view of the cluster
+        inventory = yield self.get_inventory(use_cache=False)
+        # cluster/nextid guards against VMIDs taken outside of this API
+        next_id = yield self.get_next_vm_id()
+        if inventory is None or next_id is None:
+            return None, None
+        self.update_vm_index(inventory.filter("qemu"))
+        return inventory, next_id
+
+    @flow
+    def template_on_shared_storage(self, inventory, template_name):
+        """_summary_
+            Check whether clones of a template can go to another node (all of its disks are on shared storage).
 
             Args:
+                inventory (Inventory): Current inventory of the cluster (with its storages).
                 template_name (str): Name of the template.
-                vm_name (str): Name of the virtual machine.
+
+            Returns:
+                bool: True if the template's disks are all shared, False if not or if its configuration can't be read.
         """
-        try:
-            template_vm_data = self.get_vm_by_name(template_name)
-            template_id = template_vm_data.get("vmid")
-            node_name = template_vm_data.get("node")
-        except:
-            print(f"Error: Template {template_name} not found")
-            return {"error": "Template not found"}
-
-        # Get a VMID not being used by any VM
-        vm_list = self.get_vms().get("data")
-        vm_ids = [vm.get("vmid") for vm in vm_list]
-        vm_id = max(vm_ids) + 1
+        location = self.vm_store.locate(template_name)
+        if location is None:
+            return False
+        node_name, template_id = location
+        response = yield self.get_resource(f"nodes/{node_name}/qemu/{template_id}/config")
+        if response.get("status") != "success":
+            return False
+        return on_shared_storage(response.get("data") or {}, inventory.filter("storage"))
+
+    def wait_for_task(self, upid, timeout):
+        """_summary_
+            Wait until an upstream task finishes.
 
+            Args:
+                upid (str): Task ID.
+                timeout (float): Maximum seconds to wait.
+
+            Returns:
+                dict: Task record, or None if it isn't tracked.
+        """
+        deadline = time.monotonic() + timeout
+        task = self.tasks.get(upid)
+        while task is not None and task["status"] == "running" and time.monotonic() < deadline:
+            time.sleep(self.tasks.interval)
+            # Only poll if the background task loop hasn't just done it
+            task = self.tasks.get(upid)
+            if task["updated_at"] is None or time.time() - task["updated_at"] >= self.tasks.interval:
+                self.tasks.update(upid, self.get_task_status(task["node"], upid))
+                task = self.tasks.get(upid)
+        return task
+
+    @flow
+    def clone_vm(self, vm_name, vm_id, node_name, template_id, linked=None, target=None):
+        """_summary_
+            Clone a template into a reserved VMID.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+                vm_id (int): Reserved VMID.
+                node_name (str): Node of the template.
+                template_id (int): ID of the template.
+                linked (bool): Linked clone (shares the template disks) instead of a full copy, None for the hypervisor default.
+                target (str): Node to clone to, defaults to the template's node.
+
+            Returns:
+                dict: Result of the API call.
+        """
         # Parameters for creating a VM are newid, node and vmid
-        params = {
+        data = {
             "newid": vm_id,
             "node": node_name,
             "vmid": template_id,
             "name": vm_name
         }
-
-        response = self.post_resource(
-            f"nodes/{node_name}/qemu/{template_id}/clone", params)
+        # Without full, templates get linked clones and regular VMs full copies
+        if linked is not None:
+            data["full"] = 0 if linked else 1
+        if target is not None and target != node_name:
+            data["target"] = target
+        response = yield self.post_resource(f"nodes/{node_name}/qemu/{template_id}/clone", data)
+        if response.get("status") == "success":
+            self.index_vm(vm_name, target or node_name, vm_id)
+            # Keep the VMID reserved for a while, cached listings may not show the new VM yet
+            self.release_vm_id(vm_id, grace=60)
+        else:
+            self.release_vm_id(vm_id)
         return response
 
+    @flow
+    def provision_vm(self, clone, template, linked=None, config=None, start=False, progress=None):
+        """_summary_
+            Clone, configure and start one virtual machine, reporting each step.
+
+            Args:
+                clone (tuple): (name, reserved VMID, target node) of the virtual machine.
+                template (tuple): (node, vmid) of the template.
+                linked (bool): Linked clone instead of a full copy.
+                config (dict): Configuration to apply after the clone (e.g. cores, memory).
+                start (bool): Start the virtual machine once it is ready.
+                progress (callable): Called with a progress event after each step.
+
+            Returns:
+                dict: Result of the last step.
+        """
+        vm_name, vm_id, node_name = clone
+        template_node, template_id = template
+
+        def report(step, error=None):
+            result = self.build_provision_result(vm_name, vm_id, node_name, step, error)
+            if progress is not None:
+                progress(result)
+            return result
+
+        response = yield self.clone_vm(vm_name, vm_id, template_node, template_id, linked, node_name)
+        if response.get("status") != "success":
+            return report("cloning", str(response.get("error")))
+        report("cloning")
+        # The VM stays locked until the clone task finishes
+        error = self.task_error((yield self.wait_for_task(response.get("data"), self.clone_timeout)))
+        if error:
+            return report("cloning", error)
+        report("cloned")
+        if config:
+            response = yield self.post_resource(f"nodes/{node_name}/qemu/{vm_id}/config", config)
+            if response.get("status") != "success":
+                return report("configuring", str(response.get("error")))
+            report("configured")
+        if start:
+            response = yield self.post_resource(f"nodes/{node_name}/qemu/{vm_id}/status/start")
+            if response.get("status") != "success":
+                return report("starting", str(response.get("error")))
+            report("started")
+        return report("done")
+
+    @flow
+    def provision_vms(self, template_name, names=None, prefix=None, count=None, linked=None,
+                      config=None, start=False, limit=None, progress=None, strategy=None, affinity=None):
+        """_summary_
+            Provision many virtual machines from a template at once.
+            Every clone is placed on a node and VMIDs are reserved as one block, then
+            each VM is cloned, configured and started in its own pipeline, with a
+            bounded number of pipelines at once.
+
+            Args:
+                template_name (str): Name of the template.
+                names (list): Names of the virtual machines.
+                prefix (str): Name prefix, used with count.
+                count (int): Number of virtual machines to name from the prefix.
+                linked (bool): Linked clones instead of full copies.
+                config (dict): Configuration to apply to every clone.
+                start (bool): Start the virtual machines once they are ready.
+                limit (int): Number of pipelines run at once, defaults to max_concurrency.
+                progress (callable): Called with a progress event after each step.
+                strategy (str): Placement strategy (spread, binpack or template).
+                affinity (dict): VM name -> affinity group.
+
+            Returns:
+                dict: Result per VM.
+        """
+        vm_names = self.provision_names(names, prefix, count)
+        if not vm_names:
+            return {"status": "error", "error": "No VM names given"}
+        inventory, next_id = yield self.read_cluster()
+        if inventory is None:
+            return {"status": "error", "error": "VMIDs could not be reserved"}
+        shared = yield self.template_on_shared_storage(inventory, template_name)
+        plan = self.plan_clones(inventory, next_id, template_name, vm_names, linked, strategy, affinity,
+                                shared=shared)
+        if plan["status"] != "success":
+            return plan
+        results = yield self.fan_out(
+            lambda clone: self.provision_vm(clone, plan["template"], linked, config, start, progress),
+            plan["clones"], limit)
+        return {"status": "success", "data": results + plan["skipped"]}
+
+    @flow
+    def plan_placement(self, template_name, names=None, prefix=None, count=None, linked=None,
+                       strategy=None, affinity=None):
+        """_summary_
+            Show where a batch of clones would be placed, without creating anything (dry run).
+
+            Args:
+                template_name (str): Name of the template.
+                names (list): Names of the virtual machines.
+                prefix (str): Name prefix, used with count.
+                count (int): Number of virtual machines to name from the prefix.
+                linked (bool): Linked clones instead of full copies.
+                strategy (str): Placement strategy (spread, binpack or template).
+                affinity (dict): VM name -> affinity group.
+
+            Returns:
+                dict: Placement decision per VM and node headroom after placement.
+        """
+        vm_names = self.provision_names(names, prefix, count)
+        if not vm_names:
+            return {"status": "error", "error": "No VM names given"}
+        inventory, next_id = yield self.read_cluster()
+        if inventory is None:
+            return {"status": "error", "error": "Cluster could not be read"}
+        shared = yield self.template_on_shared_storage(inventory, template_name)
+        plan = self.plan_clones(inventory, next_id, template_name, vm_names, linked, strategy, affinity,
+                                dry_run=True, shared=shared)
+        if plan["status"] != "success":
+            return plan
+        return {"status": "success", "data": {"demand": plan["demand"], "placement": plan["placement"],
+                                              "skipped": plan["skipped"], "nodes": plan["nodes"]}}
+
+    @flow
+    def create_vm(self, vm_name, template_name):
+        """_summary_
+            Create a virtual machine from a template.
+
+            Args:
+                template_name (str): Name of the template.
+                vm_name (str): Name of the virtual machine.
+        """
+        inventory, next_id = yield self.read_cluster()
+        if inventory is None:
+            return {"status": "error", "error": "VM list could not be retrieved"}
+        shared = yield self.template_on_shared_storage(inventory, template_name)
+        plan = self.plan_clones(inventory, next_id, template_name, [vm_name], shared=shared)
+        if plan["status"] != "success":
+            return plan
+        if not plan["clones"]:
+            return {"status": "error", "error": plan["skipped"][0]["error"]}
+        node_name, template_id = plan["template"]
+        _, vm_id, target = plan["clones"][0]
+        return (yield self.clone_vm(vm_name, vm_id, node_name, template_id, target=target))
+
+    @flow
     def create_vnc_proxy(self, vm_name):
         """_summary_
             Create a VNC proxy for a virtual machine.
@@ -338,16 +1620,9 @@ class Proxmox:
             Args:
                 vm_name (str): Name of the virtual machine.
         """
-        try:
-            vm_id = self.get_vm_by_name(vm_name).get("vmid")
-            node_name = self.get_vm_by_name(vm_name).get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
-            return {"error": "VM not found"}
-        response = self.post_resource(
-            f"nodes/{node_name}/qemu/{vm_id}/vncproxy")
-        return response
+        return (yield self.post_vm_resource(vm_name, "vncproxy"))
 
+    @flow
     def configure_vnc(self, vm_name, port):
         """_summary_
             Configure VNC for a virtual machine.
@@ -355,23 +1630,15 @@ class Proxmox:
             Args:
                 vm_name (str): Name of the virtual machine.
                 port (int): VNC port.
-                password (str): VNC password.
         """
-        try:
-            vm_id = self.get_vm_by_name(vm_name).get("vmid")
-            node_name = self.get_vm_by_name(vm_name).get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
-            return {"error": "VM not found"}
         # Subtract 5900 from the port, Proxmox adds 5900 to the arg
         port = int(port) - 5900
         params = {
             "args": "-vnc 0.0.0.0:{}".format(port)
         }
-        response = self.post_resource(
-            f"nodes/{node_name}/qemu/{vm_id}/config", params=params)
-        return response
+        return (yield self.post_vm_resource(vm_name, "config", params=params))
 
+    @flow
     def get_vm_config(self, vm_name):
         """_summary_
             Get configuration for a virtual machine.
@@ -379,91 +1646,247 @@ class Proxmox:
             Args:
                 vm_name (str): Name of the virtual machine.
         """
-        try:
-            vm_id = self.get_vm_by_name(vm_name).get("vmid")
-            node_name = self.get_vm_by_name(vm_name).get("node")
-        except:
-            print(f"Error: VM {vm_name} not found")
+        location = yield self.lookup_vm(vm_name)
+        if location is None:
+            logger.error(f"Error: VM {vm_name} not found")
             return {"error": "VM not found"}
-        response = self.get_resource(
+        node_name, vm_id = location
+        response = yield self.get_resource(
             f"nodes/{node_name}/qemu/{vm_id}/config")
+        if response.get("status") == "error":
+            self.forget_vm(vm_name)
         return response
 
+    @flow
+    def get_usage_aggregate(self, metrics, start=None, end=None, top=10):
+        """_summary_
+            Aggregate node usage across the cluster (totals, mean, p95 and top nodes).
+
+            Args:
+                metrics (list): RRD metrics to aggregate (e.g. cpu, memused).
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+                top (int): Number of top nodes to return per metric.
+        """
+        start, end = self.usage_range(start, end)
+        node_list = yield self.get_nodes()
+        if node_list.get("status") == "error":
+            logger.error(f"Error: Node list could not be retrieved")
+            return {"status": "error", "error": "Node list could not be retrieved", "data": {}}
+        node_names = sorted(node.get("node") for node in node_list.get("data"))
+        yield self.fan_out(lambda name: self.ingest_node_usage(name, start), node_names)
+        keys = [("node", name) for name in node_names]
+        data = self.usage_store.aggregate(keys, node_names, metrics, start, end, top)
+        return {"status": "success", "start": start, "end": end, "data": data}
+
+    @flow
+    def get_vm_usage_aggregate(self, metrics, start=None, end=None, top=10):
+        """_summary_
+            Aggregate VM usage across the cluster (totals, mean, p95 and top VMs).
+
+            Args:
+                metrics (list): RRD metrics to aggregate (e.g. cpu, mem).
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+                top (int): Number of top VMs to return per metric.
+        """
+        start, end = self.usage_range(start, end)
+        vm_list = (yield self.get_vms()).get("data")
+        yield self.fan_out(lambda vm: self.ingest_vm_usage(vm, start), vm_list)
+        keys = [("vm", vm.get("vmid")) for vm in vm_list]
+        labels = [vm.get("name") for vm in vm_list]
+        data = self.usage_store.aggregate(keys, labels, metrics, start, end, top)
+        return {"status": "success", "start": start, "end": end, "data": data}
+
+    @flow
+    def ingest_usage(self, key, resource, start):
+        """_summary_
+            Ingest new RRD samples for a node / VM into the usage store, if it is due.
+            Only the smallest timeframe covering what hasn't been ingested yet is fetched,
+            reaching back when a range starts before what has been fetched so far.
+
+            Args:
+                key (tuple): (kind, name) of the series.
+                resource (str): rrddata resource of the node / VM.
+                start (int): Oldest timestamp wanted.
+
+            Returns:
+                dict: Result of the API call.
+        """
+        if not self.usage_store.is_due(key) and not self.usage_store.needs_backfill(key, start):
+            return {"status": "success"}
+        timeframe = self.usage_store.timeframe_for(key, start)
+        graph_data = yield self.get_resource(resource, params={"timeframe": timeframe, "cf": "AVERAGE"})
+        if graph_data.get("status") == "success":
+            self.usage_store.ingest(key, graph_data.get("data"), timeframe)
+        return graph_data
+
+    @flow
+    def ingest_node_usage(self, node_name, start):
+        """_summary_
+            Ingest new RRD samples for a node (see ingest_usage).
+        """
+        return (yield self.ingest_usage(("node", node_name), f"nodes/{node_name}/rrddata", start))
+
+    @flow
+    def ingest_vm_usage(self, vm, start):
+        """_summary_
+            Ingest new RRD samples for a virtual machine from the VM list (see ingest_usage).
+        """
+        return (yield self.ingest_usage(("vm", vm.get("vmid")),
+                                        f"nodes/{vm.get('node')}/qemu/{vm.get('vmid')}/rrddata", start))
+
+    @flow
+    def get_node_names(self):
+        """_summary_
+            Get the names of the nodes, for per-node usage.
+
+            Returns:
+                list: Node names, or None if the node list could not be retrieved.
+        """
+        node_list = yield self.get_nodes()
+        if node_list.get("status") == "error":
+            logger.error(f"Error: Node list could not be retrieved")
+            return None
+        return [node.get("node") for node in node_list.get("data")]
+
+    @flow
+    def get_vm_list(self):
+        """_summary_
+            Get the VMs from a fresh cluster/resources read (cached), refreshing the VM name index.
+
+            Returns:
+                list: VMs, or None if the VM list could not be retrieved.
+        """
+        inventory = yield self.get_inventory("vm")
+        if inventory is None:
+            return None
+        vm_list = inventory.filter("qemu")
+        self.update_vm_index(vm_list)
+        return vm_list
+
+    @flow
     def get_summary(self):
         """_summary_
             Get usage summary for all nodes/VMs (realtime).
         """
-        response = self.get_resource("cluster/resources")
+        response = yield self.get_resource("cluster/resources")
         return response
 
-    def get_usage_graph(self, node_name=None):
+    @flow
+    def get_usage_graph(self, node_name=None, start=None, end=None):
         """_summary_
-            Get usage graph for a node.
-        """
+            Get usage graph for a node (or every node), served from the usage store.
 
-        # Init in case something goes wrong
-        graph_data = None
+            Args:
+                node_name (str): Name of the node, all nodes if not given.
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+        """
+        start, end = self.usage_range(start, end)
 
         # If node name is provided, get usage graph for a specific node
         if node_name:
-            graph_data = self.get_resource(f"nodes/{node_name}/rrddata?timeframe=hour&cf=AVERAGE")
-            if graph_data.get("status") == "error":
+            result = yield self.ingest_node_usage(node_name, start)
+            if result.get("status") == "error":
                 logger.error(f"Error: Node {node_name} not found")
                 return {"status": "error", "error": "Node not found", "data": []}
-            graph_data["node"] = node_name
-            response = graph_data
+            response = {"status": "success", "node": node_name,
+                        "data": self.usage_store.query(("node", node_name), start, end)}
 
         # If no node name is provided, get usage graph for all nodes
         else:
             graph_data = []
             # Get a list of nodes
-            node_list = self.get_nodes()
+            node_list = yield self.get_nodes()
             if node_list.get("status") == "error":
                 logger.error(f"Error: Node list could not be retrieved")
                 return {"status": "error", "error": "Node list could not be retrieved", "data": []}
             else:
                 node_list = node_list.get("data")
-            # Get usage graph for each node
-            for node in node_list:
-                node_name = node.get("node")
-                temp_data = {}
-                temp_data["data"] = self.get_resource(f"nodes/{node_name}/rrddata?timeframe=hour&cf=AVERAGE").get("data")
-                temp_data["node"] = node_name
-                graph_data.append(temp_data)
+            # Ingest new samples for each node concurrently
+            node_names = [node.get("node") for node in node_list]
+            node_results = yield self.fan_out(lambda name: self.ingest_node_usage(name, start), node_names)
+            for node_name, result in zip(node_names, node_results):
+                samples = self.usage_store.query(("node", node_name), start, end)
+                graph_data.append(self.build_node_usage(node_name, result, samples))
             # Sort the list by node name
             graph_data.sort(key=lambda x: x.get("node"))
             response = {"status": "success", "data": graph_data}
-        
+
         return response
 
-    def get_vm_usage_graph(self, vm_name=None):
+    def iter_usage_graph(self, start=None, end=None):
         """_summary_
-            Get usage graph for a virtual machine.
+            Stream the usage graph of every node, each node as soon as its samples are in.
+
+            Args:
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+
+            Yields:
+                dict: Usage graph of a node, or an error.
+        """
+        start, end = self.usage_range(start, end)
+        node_names = self.get_node_names()
+        if node_names is None:
+            yield {"status": "error", "error": "Node list could not be retrieved"}
+            return
+        for node_name, result in self.fan_out_iter(lambda name: self.ingest_node_usage(name, start), node_names):
+            samples = self.usage_store.query(("node", node_name), start, end)
+            yield self.build_node_usage(node_name, result, samples)
+
+    @flow
+    def get_vm_usage_graph(self, vm_name=None, start=None, end=None):
+        """_summary_
+            Get usage graph for a virtual machine (or every VM), served from the usage store.
+
+            Args:
+                vm_name (str): Name of the virtual machine, all VMs if not given.
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
         """
-        graph_data = None
+        start, end = self.usage_range(start, end)
         if vm_name:
-            try:
-                vm_id = self.get_vm_by_name(vm_name).get("data").get("vmid")
-                node_name = self.get_vm_by_name(vm_name).get("data").get("node")
-            except:
-                print(f"Error: VM {vm_name} not found")
+            location = yield self.lookup_vm(vm_name)
+            if location is None:
+                logger.error(f"Error: VM {vm_name} not found")
                 return {"error": "VM not found"}
-            graph_data = self.get_resource(
-                f"nodes/{node_name}/qemu/{vm_id}/rrddata?timeframe=hour&cf=AVERAGE")
+            node_name, vm_id = location
+            result = yield self.ingest_usage(("vm", vm_id), f"nodes/{node_name}/qemu/{vm_id}/rrddata", start)
+            if result.get("status") == "error":
+                return result
+            graph_data = {"status": "success", "data": self.usage_store.query(("vm", vm_id), start, end)}
         else:
             # Get all of the VM graph usage and return it in a list
             graph_data = []
-            vm_list = self.get_vms().get("data")
-            for vm in vm_list:
-                vm_id = vm.get("vmid")
-                node_name = vm.get("node")
-                temp_data = {}
-                temp_data["data"] = self.get_resource(
-                    f"nodes/{node_name}/qemu/{vm_id}/rrddata?timeframe=hour&cf=AVERAGE").get("data")
-                temp_data["node"] = node_name
-                temp_data["vm_name"] = vm.get("name")
-                temp_data["status"] = vm.get("status")
-                graph_data.append(temp_data)
+            vm_list = (yield self.get_vms()).get("data")
+            # Ingest new samples for each VM concurrently
+            vm_results = yield self.fan_out(lambda vm: self.ingest_vm_usage(vm, start), vm_list)
+
+            for vm, result in zip(vm_list, vm_results):
+                samples = self.usage_store.query(("vm", vm.get("vmid")), start, end)
+                graph_data.append(self.build_vm_usage(vm, result, samples))
             # Sort graph data by vm_name
             graph_data = sorted(graph_data, key=lambda k: k['vm_name'])
-        return graph_data
\ No newline at end of file
+        return graph_data
+
+    def iter_vm_usage_graph(self, start=None, end=None):
+        """_summary_
+            Stream the usage graph of every VM, each VM as soon as its samples are in.
+
+            Args:
+                start (int): Start of the time range (unix time), defaults to an hour before end.
+                end (int): End of the time range (unix time), defaults to now.
+
+            Yields:
+                dict: Usage graph of a VM, or an error.
+        """
+        start, end = self.usage_range(start, end)
+        vm_list = self.get_vm_list()
+        if vm_list is None:
+            yield {"status": "error", "error": "VM list could not be retrieved"}
+            return
+        for vm, result in self.fan_out_iter(lambda vm: self.ingest_vm_usage(vm, start), vm_list):
+            samples = self.usage_store.query(("vm", vm.get("vmid")), start, end)
+            yield self.build_vm_usage(vm, result, samples)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+import sys
+import threading
+import time
+
+"""_summary_
+    This is the in-memory VM store for the Proxmox hypervisor.
+    VMs from cluster/resources are kept as compact __slots__ records, updated
+    in place from fresh listings, with secondary indexes by name, VMID, node,
+    power status and template flag, so lookups and counts don't scan the
+    whole inventory.
+"""
+
+# cluster/resources fields of a VM, other fields are kept in the record's extra dict
+VM_FIELDS = ("id", "type", "vmid", "name", "node", "status", "template", "tags", "pool", "lock", "hastate",
+             "maxcpu", "cpu", "maxmem", "mem", "maxdisk", "disk", "diskread", "diskwrite",
+             "netin", "netout", "uptime")
+VM_FIELD_SET = frozenset(VM_FIELDS)
+
+# Fields shared by many VMs, interned so every record points to the same string
+INTERNED_FIELDS = ("type", "node", "status", "pool", "lock", "hastate")
+
+# Create VMRecord class
+
+
+class VMRecord:
+
+    __slots__ = VM_FIELDS + ("extra",)
+
+    # Initialize VMRecord class
+    def __init__(self, resource=None):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        if resource is not None:
+            self.load(resource)
+
+    def load(self, resource):
+        """_summary_
+            Replace the record fields with a cluster/resources entry.
+
+            Args:
+                resource (dict): VM from cluster/resources (or a nodes/{node}/qemu listing).
+        """
+        for field in VM_FIELDS:
+            setattr(self, field, resource.get(field))
+        for field in INTERNED_FIELDS:
+            value = getattr(self, field)
+            if isinstance(value, str):
+                setattr(self, field, sys.intern(value))
+        # "cpus" is derived from maxcpu
+        extra = {field: value for field, value in resource.items() if field not in VM_FIELD_SET and field != "cpus"}
+        self.extra = extra or None
+
+    def as_dict(self, sort_keys=True):
+        """_summary_
+            Build the VM dict, shaped like a nodes/{node}/qemu listing.
+
+            Args:
+                sort_keys (bool): Sort the keys (as listings do).
+
+            Returns:
+                dict: Virtual machine.
+        """
+        vm = {field: getattr(self, field) for field in VM_FIELDS if getattr(self, field) is not None}
+        if self.extra:
+            vm.update(self.extra)
+        # nodes/{node}/qemu calls the vCPU count "cpus"
+        vm["cpus"] = self.maxcpu
+        return dict(sorted(vm.items())) if sort_keys else vm
+
+    def index_key(self):
+        """_summary_
+            Get the indexed fields of the record.
+        """
+        return (self.name, self.node, self.status, bool(self.template))
+
+# Create VMStore class
+
+
+class VMStore:
+
+    # Initialize VMStore class
+    def __init__(self):
+        # vmid -> record, in listing order
+        self.by_vmid = {}
+        # name -> record (names are unique in this API)
+        self.by_name = {}
+        # node / status -> {vmid: record}
+        self.by_node = {}
+        self.by_status = {}
+        # template flag -> {vmid: record}
+        self.by_template = {True: {}, False: {}}
+        self.lock = threading.RLock()
+        # Monotonic time of the last complete listing, 0 when it must be refreshed
+        self.updated_at = 0
+        # True while the store holds a stale listing served because Proxmox couldn't answer
+        self.stale = False
+
+    def __len__(self):
+        return len(self.by_vmid)
+
+    def __contains__(self, vm_name):
+        return vm_name in self.by_name
+
+    def age(self):
+        """_summary_
+            Get the seconds since the last complete listing.
+        """
+        return time.monotonic() - self.updated_at
+
+    def expire(self):
+        """_summary_
+            Mark the store as out of date, so the next read refreshes it.
+        """
+        self.updated_at = 0
+
+    def index(self, record):
+        """_summary_
+            Add a record to the secondary indexes.
+        """
+        if record.name is not None:
+            self.by_name[record.name] = record
+        self.by_node.setdefault(record.node, {})[record.vmid] = record
+        self.by_status.setdefault(record.status, {})[record.vmid] = record
+        self.by_template[bool(record.template)][record.vmid] = record
+
+    def unindex(self, record):
+        """_summary_
+            Drop a record from the secondary indexes.
+        """
+        if self.by_name.get(record.name) is record:
+            del self.by_name[record.name]
+        for index, key in ((self.by_node, record.node), (self.by_status, record.status)):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(record.vmid, None)
+                if not bucket:
+                    del index[key]
+        self.by_template[bool(record.template)].pop(record.vmid, None)
+
+    def update(self, vm_list):
+        """_summary_
+            Update the store in place from a complete VM listing.
+            Records are only re-indexed when their name, node, status or template flag changed,
+            and VMs missing from the listing are dropped.
+
+            Args:
+                vm_list (list): VMs with name, node and vmid (qemu listing or cluster/resources).
+        """
+        with self.lock:
+            seen = set()
+            for resource in vm_list:
+                if resource.get("type", "qemu") != "qemu":
+                    continue
+                vm_id = resource.get("vmid")
+                seen.add(vm_id)
+                record = self.by_vmid.get(vm_id)
+                if record is None:
+                    record = self.by_vmid[vm_id] = VMRecord(resource)
+                    self.index(record)
+                    continue
+                key = record.index_key()
+                if key != (resource.get("name"), resource.get("node"), resource.get("status"),
+                           bool(resource.get("template"))):
+                    self.unindex(record)
+                    record.load(resource)
+                    self.index(record)
+                else:
+                    record.load(resource)
+            for vm_id in [vm_id for vm_id in self.by_vmid if vm_id not in seen]:
+                self.unindex(self.by_vmid.pop(vm_id))
+            self.updated_at = time.monotonic()
+
+    def put(self, vm_name, node_name, vm_id):
+        """_summary_
+            Add or move a VM (e.g. a new clone) before the next listing.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+                node_name (str): Name of the node.
+                vm_id (int): ID of the virtual machine.
+        """
+        with self.lock:
+            record = self.by_vmid.get(vm_id)
+            if record is None:
+                record = self.by_vmid[vm_id] = VMRecord({"type": "qemu", "vmid": vm_id})
+            else:
+                self.unindex(record)
+            record.name, record.node = vm_name, sys.intern(node_name)
+            self.index(record)
+
+    def remove(self, vm_name):
+        """_summary_
+            Drop a VM by name (e.g. when it went missing) and mark the store out of date.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+        """
+        with self.lock:
+            record = self.by_name.get(vm_name)
+            if record is not None:
+                self.unindex(record)
+                self.by_vmid.pop(record.vmid, None)
+            self.expire()
+
+    def locate(self, vm_name):
+        """_summary_
+            Get the node and ID of a VM by name.
+
+            Args:
+                vm_name (str): Name of the virtual machine.
+
+            Returns:
+                tuple: (node_name, vm_id), or None if the VM isn't known.
+        """
+        record = self.by_name.get(vm_name)
+        return (record.node, record.vmid) if record is not None else None
+
+    def get(self, vm_id):
+        """_summary_
+            Get a VM record by ID.
+        """
+        return self.by_vmid.get(vm_id)
+
+    def select(self, node=None, status=None, template=None):
+        """_summary_
+            Get the VM records matching indexed fields, starting from the smallest index bucket.
+
+            Args:
+                node (str): Name of the node.
+                status (str): Power status.
+                template (bool): Templates (True) or regular VMs (False).
+
+            Returns:
+                list: Matching records, in listing order.
+        """
+        with self.lock:
+            buckets = []
+            if node is not None:
+                buckets.append(self.by_node.get(node, {}))
+            if status is not None:
+                buckets.append(self.by_status.get(status, {}))
+            if template is not None:
+                buckets.append(self.by_template[bool(template)])
+            if not buckets:
+                return list(self.by_vmid.values())
+            smallest = min(buckets, key=len)
+            return [record for vm_id, record in smallest.items()
+                    if all(vm_id in bucket for bucket in buckets if bucket is not smallest)]
+
+    def count(self, node=None, status=None, template=None):
+        """_summary_
+            Count the VMs matching indexed fields (O(1) for a single field).
+
+            Args:
+                node (str): Name of the node.
+                status (str): Power status.
+                template (bool): Templates (True) or regular VMs (False).
+
+            Returns:
+                int: Number of VMs.
+        """
+        with self.lock:
+            given = [value is not None for value in (node, status, template)]
+            if not any(given):
+                return len(self.by_vmid)
+            if given.count(True) == 1:
+                if node is not None:
+                    return len(self.by_node.get(node, {}))
+                if status is not None:
+                    return len(self.by_status.get(status, {}))
+                return len(self.by_template[bool(template)])
+            return len(self.select(node, status, template))
+
+    def listing(self, records=None, sort_keys=True):
+        """_summary_
+            Build VM dicts from records.
+
+            Args:
+                records (list): Records to build, all of them if not given.
+                sort_keys (bool): Sort the keys (as listings do).
+
+            Returns:
+                list: List of virtual machines.
+        """
+        if records is None:
+            records = self.select()
+        return [record.as_dict(sort_keys) for record in records]
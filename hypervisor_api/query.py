@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import base64
+import fnmatch
+import json
+
+"""_summary_
+    This is the listing query engine for the hypervisor interface.
+    It filters, sorts, paginates (with opaque cursors) and projects VM listings
+    server-side, so clients that only need a few fields of a few VMs get small
+    responses.
+"""
+
+
+def split_list(value):
+    """_summary_
+        Split a comma separated query value ("name,status") into a list.
+    """
+    if value is None or isinstance(value, (list, tuple)):
+        return value
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def match_vm(vm, status=None, node=None, template=None, name=None, tags=None):
+    """_summary_
+        Check whether a VM matches the listing filters.
+
+        Args:
+            vm (dict): Virtual machine.
+            status (str): Power status (running, stopped...).
+            node (str): Name of the node.
+            template (bool): Templates (True) or regular VMs (False).
+            name (str): Name glob (e.g. lab-*).
+            tags (list): Tags the VM must all have.
+
+        Returns:
+            bool: True if the VM matches every given filter.
+    """
+    if status is not None and vm.get("status") != status:
+        return False
+    if node is not None and vm.get("node") != node:
+        return False
+    if template is not None and bool(vm.get("template")) != template:
+        return False
+    if name is not None and not fnmatch.fnmatchcase(vm.get("name") or "", name):
+        return False
+    if tags:
+        # Proxmox separates tags with ";" (older versions with ",")
+        vm_tags = set((vm.get("tags") or "").replace(",", ";").split(";"))
+        if not set(tags) <= vm_tags:
+            return False
+    return True
+
+
+def project(item, fields=None):
+    """_summary_
+        Keep only the requested fields of an item.
+
+        Args:
+            item (dict): Item to project.
+            fields (list): Fields to keep, all of them if not given.
+
+        Returns:
+            dict: Projected item.
+    """
+    if not fields:
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+def sort_key(item, field, descending=False):
+    """_summary_
+        Get the sort key of an item, items without the field go last and the VMID breaks ties.
+    """
+    value = item.get(field)
+    return (value is not None if descending else value is None, value, item.get("vmid") or 0)
+
+
+def encode_cursor(sort, key):
+    """_summary_
+        Encode the position after an item as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([sort, list(key)]).encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    """_summary_
+        Decode a cursor, checking it was made for the same sort order.
+
+        Raises:
+            ValueError: If the cursor is malformed or made for another sort order.
+    """
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    # Same shape as sort_key: (missing, value, VMID)
+    if (not isinstance(key, list) or len(key) != 3 or not isinstance(key[0], bool)
+            or not isinstance(key[2], int) or isinstance(key[2], bool)):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor was made for another sort order")
+    return tuple(key)
+
+
+def check_query(sort=None, limit=None, cursor=None):
+    """_summary_
+        Check the pagination parameters of a listing query.
+
+        Args:
+            sort (str): Field to sort by, prefixed with - for descending order.
+            limit (int): Page size.
+            cursor (str): Cursor returned with the previous page.
+
+        Returns:
+            str: Why the query is invalid, None if it is valid.
+    """
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        return "limit must be a positive integer"
+    if cursor:
+        try:
+            decode_cursor(cursor, sort or "vmid")
+        except ValueError as e:
+            return str(e)
+    return None
+
+
+def apply_query(items, status=None, node=None, template=None, name=None, tags=None,
+                fields=None, sort=None, limit=None, cursor=None):
+    """_summary_
+        Filter, sort, paginate and project a VM listing.
+        Without a sort or a limit, items keep their listing order.
+
+        Args:
+            items (iterable): Virtual machines.
+            status (str): Power status filter.
+            node (str): Node filter.
+            template (bool): Template filter.
+            name (str): Name glob filter.
+            tags (list): Tags filter (comma separated string or list).
+            fields (list): Fields to return (comma separated string or list).
+            sort (str): Field to sort by, prefixed with - for descending order.
+            limit (int): Page size.
+            cursor (str): Cursor returned with the previous page.
+
+        Returns:
+            dict: Matching items, with a next_cursor when there are more pages.
+    """
+    error = check_query(sort, limit, cursor)
+    if error:
+        return {"status": "error", "error": error}
+    tags, fields = split_list(tags), split_list(fields)
+    items = [item for item in items if match_vm(item, status, node, template, name, tags)]
+    response = {"status": "success"}
+    if sort or limit or cursor:
+        # Pages need a stable order, VMID unless asked otherwise
+        sort = sort or "vmid"
+        field, descending = sort.lstrip("-"), sort.startswith("-")
+        try:
+            items.sort(key=lambda item: sort_key(item, field, descending), reverse=descending)
+            if cursor:
+                after = decode_cursor(cursor, sort)
+                items = [item for item in items
+                         if (sort_key(item, field, descending) < after if descending
+                             else sort_key(item, field, descending) > after)]
+        except (TypeError, ValueError) as e:
+            return {"status": "error", "error": str(e) if isinstance(e, ValueError) else f"Cannot sort by {field}"}
+        if limit and len(items) > limit:
+            items = items[:limit]
+            response["next_cursor"] = encode_cursor(sort, sort_key(items[-1], field, descending))
+    response["data"] = [project(item, fields) for item in items]
+    return response
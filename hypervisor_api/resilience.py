@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+
+"""_summary_
+    This is the upstream resilience layer for the hypervisor interface.
+    Each API read gets a deadline that every hypervisor call it makes shares,
+    idempotent GETs are retried with jittered exponential backoff, and a
+    circuit breaker per node fails calls to a broken node fast instead of
+    waiting on it, so one rebooting host can't stall whole listings.
+"""
+
+# Monotonic time the request being served must be answered by (None outside of a request)
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+# Status codes of a broken upstream (bad gateway, unavailable, timeout, Proxmox's 595/596 for unreachable nodes)
+FAILURE_STATUS = 502
+
+
+def remaining():
+    """_summary_
+        Get the seconds left before the current request's deadline.
+
+        Returns:
+            float: Seconds left (0 or less once it passed), None without a deadline.
+    """
+    deadline = current_deadline.get()
+    return deadline - time.monotonic() if deadline is not None else None
+
+
+def is_failure(status_code):
+    """_summary_
+        Check whether an upstream status code means the node (not the request) is broken.
+    """
+    return status_code >= FAILURE_STATUS
+
+
+def breaker_key(resource):
+    """_summary_
+        Get the circuit breaker a resource goes through: its node, or the cluster for cluster-wide resources.
+    """
+    match = re.match(r"nodes/([^/]+)", resource)
+    return match.group(1) if match else "cluster"
+
+
+def unavailable(error):
+    """_summary_
+        Build the error result of a call that couldn't be answered (stale data may be served instead).
+    """
+    return {"status": "error", "error": error, "unavailable": True}
+
+# Create RetryPolicy class
+
+
+class RetryPolicy:
+
+    # Initialize RetryPolicy class
+    def __init__(self, retries=2, backoff=0.2, max_backoff=2):
+        # Retries after the first attempt, base and cap of the backoff (seconds)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_env(cls):
+        """_summary_
+            Build the retry policy from the environment.
+        """
+        return cls(retries=int(os.getenv("HYPERVISOR_RETRIES") or 2),
+                   backoff=float(os.getenv("HYPERVISOR_RETRY_BACKOFF") or 0.2),
+                   max_backoff=float(os.getenv("HYPERVISOR_RETRY_MAX_BACKOFF") or 2))
+
+    def delay(self, attempt):
+        """_summary_
+            Get the delay before a retry ("full jitter": uniform up to the exponential backoff).
+
+            Args:
+                attempt (int): Attempts made so far.
+
+            Returns:
+                float: Seconds to wait, None if no retry is left or the deadline can't fit it.
+        """
+        if attempt > self.retries:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        left = remaining()
+        if left is not None and delay >= left:
+            return None
+        return delay
+
+# Create CircuitBreaker class
+
+
+class CircuitBreaker:
+
+    # Initialize CircuitBreaker class
+    def __init__(self, failures=5, reset=30):
+        # Consecutive failures that open a circuit, seconds before an open circuit lets a probe through
+        self.failures = failures
+        self.reset = reset
+        # key -> {"state", "failures", "opened_at", "probed_at"}
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """_summary_
+            Build the circuit breaker from the environment.
+        """
+        return cls(failures=int(os.getenv("HYPERVISOR_BREAKER_FAILURES") or 5),
+                   reset=float(os.getenv("HYPERVISOR_BREAKER_RESET") or 30))
+
+    def allow(self, key):
+        """_summary_
+            Check whether a call may go through.
+            An open circuit lets a single probe through once reset seconds have passed (half-open).
+            A probe that hasn't settled after another reset seconds is taken as lost and replaced.
+
+            Args:
+                key (str): Node name (or "cluster").
+
+            Returns:
+                bool: True if the call may be made.
+        """
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit["state"] == "closed":
+                return True
+            now = time.monotonic()
+            if circuit["state"] == "open" and now - circuit["opened_at"] >= self.reset:
+                circuit.update(state="half-open", probed_at=now)
+                return True
+            if circuit["state"] == "half-open" and now - circuit["probed_at"] >= self.reset:
+                circuit["probed_at"] = now
+                return True
+            return False
+
+    def succeed(self, key):
+        """_summary_
+            Record a successful call, closing the circuit.
+        """
+        with self.lock:
+            if key in self.circuits:
+                self.circuits[key].update(state="closed", failures=0)
+
+    def release(self, key):
+        """_summary_
+            Record a call that ended without an outcome (deadline, cancellation).
+            If it was the probe, the circuit goes back to open and the next call probes again.
+        """
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is not None and circuit["state"] == "half-open":
+                circuit["state"] = "open"
+
+    def fail(self, key):
+        """_summary_
+            Record a failed call, opening the circuit after enough consecutive failures (or a failed probe).
+        """
+        with self.lock:
+            circuit = self.circuits.setdefault(key, {"state": "closed", "failures": 0, "opened_at": None})
+            circuit["failures"] += 1
+            if circuit["state"] == "half-open" or circuit["failures"] >= self.failures:
+                circuit.update(state="open", opened_at=time.monotonic())
+
+    def stats(self):
+        """_summary_
+            Get the state of every circuit that has seen a failure.
+
+            Returns:
+                dict: key -> state and consecutive failures.
+        """
+        with self.lock:
+            return {key: {"state": circuit["state"], "failures": circuit["failures"]}
+                    for key, circuit in self.circuits.items()}
+
+    def open_circuits(self):
+        """_summary_
+            List the keys whose circuit is not closed.
+        """
+        with self.lock:
+            return [key for key, circuit in self.circuits.items() if circuit["state"] != "closed"]
+
+# Create DeadlineMiddleware class
+
+
+class DeadlineMiddleware:
+
+    # Initialize DeadlineMiddleware class
+    def __init__(self, app, deadline=None):
+        self.app = app
+        # Seconds every read request gets, spread over the hypervisor calls it makes
+        self.deadline = deadline or float(os.getenv("HYPERVISOR_REQUEST_DEADLINE") or 30)
+
+    async def __call__(self, scope, receive, send):
+        """_summary_
+            Give a read request its deadline (writes, e.g. clones, are bounded by their own timeouts).
+        """
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        token = current_deadline.set(time.monotonic() + self.deadline)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_deadline.reset(token)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+import asyncio
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import orjson
+from loguru import logger
+from hypervisor_api.utils import maybe_await
+
+"""_summary_
+    This is the cross-process response store for multi-worker deployments.
+    Every worker's response cache writes through to a local SQLite database and
+    reads from it on a miss, so a response fetched by one worker serves all of
+    them. The inventory version log lives there too, so ETags and change feeds
+    agree whichever worker answers. One worker, elected with a file lock, refreshes the inventory and
+    node usage before they expire, so upstream traffic stays at the level of a
+    single worker however many workers serve reads.
+"""
+
+# Create SharedStore class
+
+
+class SharedStore:
+
+    # Initialize SharedStore class
+    def __init__(self, path, namespace=""):
+        # SQLite database shared by the workers, entries are prefixed with the namespace (the hypervisor URL)
+        self.path = path
+        self.namespace = namespace
+        # SQLite connections can't be shared between threads
+        self.local = threading.local()
+        self.connect().execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, resource TEXT, "
+                               "stored_at REAL, ttl REAL, body BLOB)")
+        self.connect().execute("CREATE TABLE IF NOT EXISTS versions (topic TEXT, version INTEGER, digest TEXT, "
+                               "body BLOB, PRIMARY KEY (topic, version))")
+        # Invalidations made by writes, replayed by the other workers on their local caches
+        self.connect().execute("CREATE TABLE IF NOT EXISTS invalidations (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "namespace TEXT, prefixes BLOB, stored_at REAL)")
+
+    @classmethod
+    def from_env(cls, namespace=""):
+        """_summary_
+            Open the shared store named by HYPERVISOR_SHARED_CACHE.
+
+            Returns:
+                SharedStore: Shared store, or None in single-process mode.
+        """
+        path = os.getenv("HYPERVISOR_SHARED_CACHE")
+        if not path:
+            return None
+        return cls(path, namespace)
+
+    def connect(self):
+        """_summary_
+            Get this thread's connection (WAL mode, so readers never wait for the writer).
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        """_summary_
+            Get a shared response.
+
+            Args:
+                key (str): Cache key.
+
+            Returns:
+                tuple: (resource, response, seconds since it was stored, ttl), or None if it isn't shared.
+        """
+        try:
+            row = self.connect().execute("SELECT resource, stored_at, ttl, body FROM entries WHERE key = ?",
+                                         (self.namespace + key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error: Shared cache read failed: {e}")
+            return None
+        if row is None:
+            return None
+        resource, stored_at, ttl, body = row
+        return resource, orjson.loads(body), max(0, time.time() - stored_at), ttl
+
+    def set(self, key, resource, response, ttl):
+        """_summary_
+            Share a response with the other workers.
+
+            Args:
+                key (str): Cache key.
+                resource (str): Resource path.
+                response (dict): Response to share.
+                ttl (float): TTL of the response.
+        """
+        try:
+            self.connect().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                                   (self.namespace + key, resource, time.time(), ttl, orjson.dumps(response)))
+        except (sqlite3.Error, TypeError) as e:
+            logger.error(f"Error: Shared cache write failed: {e}")
+
+    def prune(self, grace):
+        """_summary_
+            Drop the shared responses more than grace seconds past their TTL.
+        """
+        try:
+            self.connect().execute("DELETE FROM entries WHERE stored_at + ttl + ? < ?", (grace, time.time()))
+            self.connect().execute("DELETE FROM invalidations WHERE stored_at + ? < ?", (grace, time.time()))
+        except sqlite3.Error as e:
+            logger.error(f"Error: Shared cache prune failed: {e}")
+
+    def invalidate(self, *prefixes):
+        """_summary_
+            Drop the shared responses whose resource starts with one of the prefixes (all of them without prefixes),
+            and log the invalidation for the other workers' local caches.
+
+            Returns:
+                int: ID of the invalidation, None if the store couldn't be written.
+        """
+        try:
+            invalidation = self.connect().execute("INSERT INTO invalidations (namespace, prefixes, stored_at) "
+                                                  "VALUES (?, ?, ?)",
+                                                  (self.namespace, orjson.dumps(prefixes), time.time())).lastrowid
+            if not prefixes:
+                self.connect().execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?",
+                                       (len(self.namespace), self.namespace))
+                return invalidation
+            for prefix in prefixes:
+                self.connect().execute("DELETE FROM entries WHERE substr(key, 1, ?) = ? AND substr(resource, 1, ?) = ?",
+                                       (len(self.namespace), self.namespace, len(prefix), prefix))
+            return invalidation
+        except sqlite3.Error as e:
+            logger.error(f"Error: Shared cache invalidation failed: {e}")
+            return None
+
+    def invalidations(self, since=None):
+        """_summary_
+            Get the invalidations made (by any worker) after a given one.
+
+            Args:
+                since (int): ID of the last invalidation seen, None to only get the current ID.
+
+            Returns:
+                tuple: (ID of the last invalidation, list of prefix tuples), None if the store couldn't be read.
+        """
+        try:
+            if since is None:
+                row = self.connect().execute("SELECT MAX(id) FROM invalidations").fetchone()
+                return row[0] or 0, []
+            rows = self.connect().execute("SELECT id, prefixes FROM invalidations WHERE id > ? AND namespace = ? "
+                                          "ORDER BY id", (since, self.namespace)).fetchall()
+            last = self.connect().execute("SELECT MAX(id) FROM invalidations").fetchone()[0] or since
+        except sqlite3.Error as e:
+            logger.error(f"Error: Shared invalidation read failed: {e}")
+            return None
+        return last, [tuple(orjson.loads(prefixes)) for _, prefixes in rows]
+
+    def observe_version(self, topic, snapshot, history):
+        """_summary_
+            Record a complete listing in the shared version log, bumping the version if anything changed.
+
+            Args:
+                topic (str): Listing (vms, nodes).
+                snapshot (dict): Key -> item, without its usage counters.
+                history (int): Number of versions kept.
+
+            Returns:
+                int: Version of the listing, None if the store couldn't be used.
+        """
+        topic = self.namespace + topic
+        # (key, item) pairs keep integer keys (VMIDs) through JSON
+        body = orjson.dumps(sorted(snapshot.items(), key=lambda pair: str(pair[0])), option=orjson.OPT_SORT_KEYS)
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        query = "SELECT version, digest FROM versions WHERE topic = ? ORDER BY version DESC LIMIT 1"
+        try:
+            connection = self.connect()
+            latest = connection.execute(query, (topic,)).fetchone()
+            if latest is not None and latest[1] == digest:
+                return latest[0]
+            # Another worker may record the same change at the same time, the write lock serializes them
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                latest = connection.execute(query, (topic,)).fetchone()
+                if latest is not None and latest[1] == digest:
+                    return latest[0]
+                # Versions start from the clock, so they keep increasing across restarts
+                version = latest[0] + 1 if latest is not None else int(time.time() * 1000)
+                connection.execute("INSERT INTO versions VALUES (?, ?, ?, ?)", (topic, version, digest, body))
+                connection.execute("DELETE FROM versions WHERE topic = ? AND version <= ?", (topic, version - history))
+                return version
+            finally:
+                connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"Error: Shared version log write failed: {e}")
+            return None
+
+    def load_version(self, topic, version=None):
+        """_summary_
+            Get a listing from the shared version log.
+
+            Args:
+                topic (str): Listing (vms, nodes).
+                version (int): Version to get, the latest by default.
+
+            Returns:
+                tuple: (version, snapshot), None if the version isn't kept.
+        """
+        try:
+            if version is None:
+                row = self.connect().execute("SELECT version, body FROM versions WHERE topic = ? "
+                                             "ORDER BY version DESC LIMIT 1", (self.namespace + topic,)).fetchone()
+            else:
+                row = self.connect().execute("SELECT version, body FROM versions WHERE topic = ? AND version = ?",
+                                             (self.namespace + topic, version)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error: Shared version log read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return row[0], {key: item for key, item in orjson.loads(row[1])}
+
+# Create LeaderLock class
+
+
+class LeaderLock:
+
+    # Initialize LeaderLock class
+    def __init__(self, path):
+        # Lock file next to the shared database, held for as long as this worker is the refresher
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        """_summary_
+            Try to become the refresher (non-blocking). The lock is released by the OS if the worker dies.
+
+            Returns:
+                bool: True if this worker holds the lock.
+        """
+        if self.file is not None:
+            return True
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.file = lock_file
+        return True
+
+    def release(self):
+        """_summary_
+            Stop being the refresher.
+        """
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+# Create SharedRefresher class
+
+
+class SharedRefresher:
+
+    # Initialize SharedRefresher class
+    def __init__(self, hypervisor, interval=None):
+        # One backend, or every cluster of a federation
+        self.backends = [backend for backend in getattr(hypervisor, "members", {"": hypervisor}).values()
+                         if getattr(backend, "cache", None) is not None and backend.cache.shared is not None]
+        self.lock = LeaderLock((os.getenv("HYPERVISOR_SHARED_CACHE") or "") + ".lock") if self.backends else None
+        # Seconds between two checks (for leadership, and for entries due a refresh)
+        self.interval = interval or float(os.getenv("HYPERVISOR_SHARED_REFRESH_INTERVAL") or 1)
+        # (backend index, cache key) -> monotonic time of the next refresh
+        self.due = {}
+        # Backend index -> node names from the last node list refresh
+        self.nodes = {}
+        self.task = None
+
+    @property
+    def leader(self):
+        return self.lock is not None and self.lock.file is not None
+
+    def start(self):
+        """_summary_
+            Start competing for leadership and refreshing in the background.
+        """
+        if self.lock is not None and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """_summary_
+            Stop refreshing and hand leadership over.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.lock is not None:
+            self.lock.release()
+
+    def hot_resources(self, i):
+        """_summary_
+            List the resources the refresher keeps warm: inventory, node list and node usage.
+
+            Args:
+                i (int): Index of the backend.
+
+            Returns:
+                list: (resource, params) tuples.
+        """
+        resources = [("nodes", None), ("cluster/resources", {"type": "vm"}), ("cluster/resources", {"type": "node"}),
+                     ("cluster/resources", None)]
+        for node_name in self.nodes.get(i, []):
+            resources.append((f"nodes/{node_name}/rrddata", {"timeframe": "hour", "cf": "AVERAGE"}))
+        return resources
+
+    async def refresh(self):
+        """_summary_
+            Refresh every hot resource that is due, shortly before its TTL runs out.
+        """
+        now = time.monotonic()
+        for i, backend in enumerate(self.backends):
+            for resource, params in self.hot_resources(i):
+                key = (i, backend.cache.make_key(resource, params))
+                if self.due.get(key, 0) > now:
+                    continue
+                self.due[key] = now + max(self.interval, backend.cache.ttl_for(resource) * 0.8)
+                try:
+                    response = await maybe_await(backend.get_resource, resource, params, False)
+                except Exception as e:
+                    logger.error(f"Error: Shared refresh of {resource} failed: {e}")
+                    continue
+                if resource == "nodes" and response.get("status") == "success":
+                    self.nodes[i] = [node.get("node") for node in response.get("data") or []]
+            if self.due.get((i, "prune"), 0) <= now:
+                self.due[(i, "prune")] = now + 60
+                await asyncio.to_thread(backend.cache.shared.prune, backend.cache.fallback_ttl)
+
+    async def run(self):
+        """_summary_
+            Take over as the refresher whenever no other worker holds the lock, and refresh while leading.
+        """
+        while True:
+            if not self.leader and await asyncio.to_thread(self.lock.acquire):
+                logger.info(f"Worker {os.getpid()} is now the shared cache refresher")
+            if self.leader:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.error(f"Error: Shared refresh failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import asyncio
+import copy
+import threading
+
+"""_summary_
+    This is the request coalescing layer for the hypervisor interface.
+    Concurrent identical GETs (same resource and parameters) share a single
+    in-flight upstream request and all receive its result, so a burst of
+    dashboards loading at once costs one hypervisor call instead of one each.
+"""
+
+# Create SingleFlight class
+
+
+class SingleFlight:
+
+    # Initialize SingleFlight class
+    def __init__(self):
+        # key -> in-flight call (result / error and done event, or its asyncio task) and its number of waiters
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "upstream": 0, "collapsed": 0}
+
+    def join(self, key):
+        """_summary_
+            Join the in-flight call for a key, or register a new one.
+
+            Args:
+                key (str): Request key.
+
+            Returns:
+                tuple: (call, leader), leader is True if the caller has to make the request.
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            call = self.calls.get(key)
+            if call is not None:
+                call["waiters"] += 1
+                self.counters["collapsed"] += 1
+                return call, False
+            call = self.calls[key] = {"waiters": 0, "event": threading.Event()}
+            self.counters["upstream"] += 1
+            return call, True
+
+    def leave(self, key, call):
+        """_summary_
+            Unregister a finished call, so later requests go upstream again.
+        """
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+
+    def do(self, key, func, *args):
+        """_summary_
+            Call a function once for all concurrent callers with the same key (threads).
+
+            Args:
+                key (str): Request key.
+                func (callable): Function making the upstream request.
+                args: Arguments of the function.
+
+            Returns:
+                dict: Result of the function.
+        """
+        call, leader = self.join(key)
+        if not leader:
+            call["event"].wait()
+            if "error" in call:
+                raise call["error"]
+            # Callers modify responses in place, so followers get their own copy
+            return copy.deepcopy(call["result"])
+        try:
+            call["result"] = func(*args)
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            self.leave(key, call)
+            call["event"].set()
+        return copy.deepcopy(call["result"]) if call["waiters"] else call["result"]
+
+    async def do_async(self, key, func, *args):
+        """_summary_
+            Await a coroutine function once for all concurrent callers with the same key (asyncio).
+            The upstream request runs in its own task, so a caller being cancelled doesn't fail the others.
+
+            Args:
+                key (str): Request key.
+                func (callable): Coroutine function making the upstream request.
+                args: Arguments of the function.
+
+            Returns:
+                dict: Result of the function.
+        """
+        call, leader = self.join(key)
+        if leader:
+            call["task"] = asyncio.ensure_future(func(*args))
+            call["task"].add_done_callback(lambda task: self.leave(key, call))
+        result = await asyncio.shield(call["task"])
+        # Callers modify responses in place, so everyone gets their own copy once the result is shared
+        return copy.deepcopy(result) if call["waiters"] or not leader else result
+
+    def forget(self, *prefixes):
+        """_summary_
+            Detach in-flight calls whose key starts with one of the prefixes (e.g. after a write),
+            so later requests don't join a call started before the change.
+
+            Args:
+                prefixes (str): Key prefixes (resource paths).
+        """
+        with self.lock:
+            for key in [key for key in self.calls if key.startswith(prefixes)]:
+                del self.calls[key]
+
+    def stats(self):
+        """_summary_
+            Get coalescing statistics.
+
+            Returns:
+                dict: Request counters and calls in flight.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self.calls)
+        stats["collapse_ratio"] = stats["collapsed"] / stats["requests"] if stats["requests"] else 0
+        return stats
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import orjson
+
+"""_summary_
+    This is the streaming encoder for large list responses of the Ironsight API.
+    Items are encoded one by one with orjson as the hypervisor yields them, as
+    newline delimited JSON or as a chunked JSON array, so the first bytes go out
+    before the whole list exists and no full intermediate list is built.
+"""
+
+# Streaming formats and their media types
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+# Keys are sorted while encoding, so items don't have to be rebuilt in key order
+ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def stream_format(stream=None, accept=None):
+    """_summary_
+        Pick the streaming format of a list response.
+
+        Args:
+            stream (str): Requested format (ndjson or json).
+            accept (str): Accept header, application/x-ndjson asks for NDJSON.
+
+        Returns:
+            str: Streaming format, or None to answer with a regular response.
+    """
+    if stream in STREAM_MEDIA_TYPES:
+        return stream
+    if accept and STREAM_MEDIA_TYPES["ndjson"] in accept:
+        return "ndjson"
+    return None
+
+
+def encode_chunk(item, stream, first):
+    """_summary_
+        Encode one item of a stream.
+
+        Args:
+            item (dict): Item to encode.
+            stream (str): Streaming format (ndjson or json).
+            first (bool): Whether this is the first item (opens the JSON array).
+
+        Returns:
+            bytes: Encoded chunk.
+    """
+    data = orjson.dumps(item, option=ORJSON_OPTIONS)
+    if stream == "ndjson":
+        return data + b"\n"
+    return (b"[" if first else b",") + data
+
+
+def encode_chunks(items, stream):
+    """_summary_
+        Encode items of a (blocking) iterator as they are produced.
+
+        Args:
+            items (iterable): Items to encode.
+            stream (str): Streaming format (ndjson or json).
+
+        Yields:
+            bytes: Encoded chunks.
+    """
+    first = True
+    for item in items:
+        yield encode_chunk(item, stream, first)
+        first = False
+    if stream == "json":
+        yield b"[]" if first else b"]"
+
+
+async def aencode_chunks(items, stream):
+    """_summary_
+        Encode items of an async iterator as they are produced.
+
+        Args:
+            items (async iterable): Items to encode.
+            stream (str): Streaming format (ndjson or json).
+
+        Yields:
+            bytes: Encoded chunks.
+    """
+    first = True
+    async for item in items:
+        yield encode_chunk(item, stream, first)
+        first = False
+    if stream == "json":
+        yield b"[]" if first else b"]"
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from loguru import logger
+from hypervisor_api.utils import maybe_await
+
+"""_summary_
+    This is the upstream task tracker for the hypervisor interface.
+    It records the task IDs (Proxmox UPIDs) returned by write calls and polls
+    the status of every in-flight task in one background loop, so clients can
+    ask /tasks (or wait on a task) instead of polling the VM themselves.
+"""
+
+
+def parse_upid(upid):
+    """_summary_
+        Parse a Proxmox task ID.
+        (UPID:{node}:{pid}:{pstart}:{starttime}:{type}:{id}:{user}:)
+
+        Args:
+            upid (str): Task ID.
+
+        Returns:
+            dict: Task node, type, id, user and start time, or None if it isn't a UPID.
+    """
+    parts = (upid or "").split(":")
+    if len(parts) < 8 or parts[0] != "UPID":
+        return None
+    try:
+        starttime = int(parts[4], 16)
+    except ValueError:
+        starttime = None
+    return {"node": parts[1], "type": parts[5], "id": parts[6], "user": parts[7], "starttime": starttime}
+
+# Create TaskTracker class
+
+
+class TaskTracker:
+
+    # Initialize TaskTracker class
+    def __init__(self, hypervisor, interval=None, history=None):
+        self.hypervisor = hypervisor
+        # Seconds between two status polls of the in-flight tasks
+        self.interval = interval or float(os.getenv("HYPERVISOR_TASK_POLL_INTERVAL") or 1)
+        # Number of tasks remembered (oldest finished tasks are dropped first)
+        self.history = history or int(os.getenv("HYPERVISOR_TASK_HISTORY") or 1000)
+        # upid -> task record
+        self.records = OrderedDict()
+        # upid -> asyncio.Event set when the task finishes, and the event loop waiting on them
+        self.events = {}
+        self.loop = None
+        self.lock = threading.Lock()
+        self.task = None
+
+    def record(self, upid, resource=None):
+        """_summary_
+            Start tracking a task.
+
+            Args:
+                upid (str): Task ID returned by the hypervisor.
+                resource (str): Resource that started the task.
+
+            Returns:
+                dict: Task record, or None if upid isn't a task ID.
+        """
+        task = parse_upid(upid)
+        if task is None:
+            return None
+        with self.lock:
+            if upid in self.records:
+                return dict(self.records[upid])
+            task.update({"upid": upid, "resource": resource, "status": "running",
+                         "exitstatus": None, "submitted_at": time.time(), "updated_at": None})
+            self.records[upid] = task
+            self.trim()
+            return dict(task)
+
+    def trim(self):
+        """_summary_
+            Drop the oldest finished tasks once there are more than history.
+        """
+        finished = [upid for upid, task in self.records.items() if task["status"] != "running"]
+        for upid in finished[:max(0, len(self.records) - self.history)]:
+            del self.records[upid]
+            self.events.pop(upid, None)
+
+    def get(self, upid):
+        """_summary_
+            Get a task record.
+
+            Args:
+                upid (str): Task ID.
+
+            Returns:
+                dict: Task record, or None if it isn't tracked.
+        """
+        with self.lock:
+            task = self.records.get(upid)
+            return dict(task) if task is not None else None
+
+    def list(self, status=None):
+        """_summary_
+            List tracked tasks, newest first.
+
+            Args:
+                status (str): Only tasks with this status (running or stopped).
+
+            Returns:
+                list: Task records.
+        """
+        with self.lock:
+            return [dict(task) for task in reversed(self.records.values())
+                    if status is None or task["status"] == status]
+
+    def in_flight(self):
+        """_summary_
+            List the tasks that are still running.
+        """
+        return self.list("running")
+
+    def update(self, upid, response):
+        """_summary_
+            Update a task from a nodes/{node}/tasks/{upid}/status response.
+
+            Args:
+                upid (str): Task ID.
+                response (dict): Result of the API call.
+        """
+        if not isinstance(response, dict) or response.get("status") != "success":
+            return
+        data = response.get("data") or {}
+        with self.lock:
+            task = self.records.get(upid)
+            if task is None:
+                return
+            task["status"] = data.get("status", task["status"])
+            task["exitstatus"] = data.get("exitstatus")
+            task["updated_at"] = time.time()
+            finished = task["status"] != "running"
+            event = self.events.get(upid)
+        # Updates also come from the worker threads of the synchronous backend, asyncio events aren't thread-safe
+        if finished and event is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, upid, timeout):
+        """_summary_
+            Wait until a task finishes (long-poll).
+
+            Args:
+                upid (str): Task ID.
+                timeout (float): Maximum seconds to wait.
+
+            Returns:
+                dict: Task record, or None if it isn't tracked.
+        """
+        task = self.get(upid)
+        if task is None or task["status"] != "running" or not timeout:
+            return task
+        with self.lock:
+            self.loop = asyncio.get_running_loop()
+            event = self.events.setdefault(upid, asyncio.Event())
+        # The task may have finished before the event was registered
+        task = self.get(upid)
+        if task is None or task["status"] != "running":
+            return task
+        self.start()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.get(upid)
+
+    async def poll(self):
+        """_summary_
+            Poll the status of every in-flight task concurrently.
+        """
+        tasks = self.in_flight()
+        responses = await asyncio.gather(
+            *(maybe_await(self.hypervisor.get_task_status, task["node"], task["upid"]) for task in tasks),
+            return_exceptions=True)
+        for task, response in zip(tasks, responses):
+            if isinstance(response, Exception):
+                logger.error(f"Error: Could not poll task {task['upid']}: {response}")
+                continue
+            self.update(task["upid"], response)
+
+    def start(self):
+        """_summary_
+            Start polling in the background (must be called from the event loop).
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """_summary_
+            Stop polling.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        """_summary_
+            Poll in-flight tasks every interval.
+        """
+        while True:
+            if self.in_flight():
+                try:
+                    await self.poll()
+                except Exception as e:
+                    logger.error(f"Error: Task poll failed: {e}")
+            await asyncio.sleep(self.interval)
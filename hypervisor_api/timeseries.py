@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+import math
+import os
+import threading
+import time
+import warnings
+import numpy as np
+
+"""_summary_
+    This is the local usage time-series store for the hypervisor interface.
+    It keeps RRD samples for each node / VM in NumPy ring buffers (one column
+    per metric) that grow up to a fixed capacity, so usage can be served for
+    arbitrary time ranges and kept beyond the hypervisor's own timeframe
+    buckets, while only new samples have to be ingested on every refresh.
+    Older ranges are fetched once when a request first reaches back to them.
+"""
+
+# Hypervisor RRD timeframes and the span (seconds) each one covers
+TIMEFRAMES = [
+    ("hour", 3600),
+    ("day", 86400),
+    ("week", 604800),
+    ("month", 2592000),
+    ("year", 31536000),
+]
+
+# Samples a series allocates room for at first, doubled whenever it fills up (up to its capacity)
+INITIAL_ALLOCATION = 64
+
+
+def to_number(value):
+    """_summary_
+        Convert a NumPy scalar to a JSON friendly number (NaN becomes None).
+    """
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def summarize(times, matrix, labels, top=10):
+    """_summary_
+        Aggregate stacked series (one row per series, one column per timestamp).
+
+        Args:
+            times (numpy.ndarray): Shared timestamps.
+            matrix (numpy.ndarray): Values, NaN where a series has no sample.
+            labels (list): Label of each row.
+            top (int): Number of series to return, ranked by their mean.
+
+        Returns:
+            dict: Cluster totals, overall mean / p95 / max and the top series.
+    """
+    summary = {"series": len(labels), "samples": int(len(times)),
+               "total": {"mean": None, "max": None, "last": None},
+               "mean": None, "p95": None, "max": None, "top": []}
+    if matrix.size == 0 or np.all(np.isnan(matrix)):
+        return summary
+    with warnings.catch_warnings():
+        # All-NaN rows/columns are expected (series without samples in the window)
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        present = ~np.isnan(matrix)
+        # Cluster total at each timestamp that has at least one sample
+        totals = np.nansum(matrix, axis=0)[present.any(axis=0)]
+        series_mean = np.nanmean(matrix, axis=1)
+        series_max = np.nanmax(matrix, axis=1)
+        series_p95 = np.nanpercentile(matrix, 95, axis=1)
+        # Newest sample of each series
+        last_index = matrix.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+        series_last = np.where(present.any(axis=1), matrix[np.arange(len(labels)), last_index], np.nan)
+        summary["total"] = {"mean": to_number(totals.mean()), "max": to_number(totals.max()),
+                            "last": to_number(totals[-1])}
+        summary["mean"] = to_number(np.nanmean(matrix))
+        summary["p95"] = to_number(np.nanpercentile(matrix, 95))
+        summary["max"] = to_number(np.nanmax(matrix))
+    # Rank by mean, series without samples last
+    order = np.argsort(-np.nan_to_num(series_mean, nan=-np.inf), kind="stable")[:top]
+    summary["top"] = [{"name": labels[row], "mean": to_number(series_mean[row]),
+                       "p95": to_number(series_p95[row]), "max": to_number(series_max[row]),
+                       "last": to_number(series_last[row])}
+                      for row in order if not math.isnan(series_mean[row])]
+    return summary
+
+# Create RingSeries class
+
+
+class RingSeries:
+
+    # Initialize RingSeries class
+    def __init__(self, capacity):
+        # Most samples held, the buffers only wrap around once they reach it
+        self.capacity = capacity
+        # Sample timestamps, shared by every metric column (grown on demand)
+        self.times = np.zeros(min(capacity, INITIAL_ALLOCATION), dtype=np.int64)
+        # metric -> float64 column, NaN where a sample has no value
+        self.columns = {}
+        # Next write position and number of samples held
+        self.head = 0
+        self.size = 0
+
+    def last_time(self):
+        """_summary_
+            Get the timestamp of the newest sample.
+
+            Returns:
+                int: Timestamp, or None if the series is empty.
+        """
+        if self.size == 0:
+            return None
+        return int(self.times[(self.head - 1) % len(self.times)])
+
+    def first_time(self):
+        """_summary_
+            Get the timestamp of the oldest sample.
+
+            Returns:
+                int: Timestamp, or None if the series is empty.
+        """
+        if self.size == 0:
+            return None
+        return int(self.times[(self.head - self.size) % len(self.times)])
+
+    def grow(self):
+        """_summary_
+            Double the buffers (up to the capacity). Only called before the ring wraps, so samples stay in order.
+        """
+        allocated = min(self.capacity, len(self.times) * 2)
+        extra = allocated - len(self.times)
+        self.times = np.concatenate([self.times, np.zeros(extra, dtype=np.int64)])
+        for metric, column in self.columns.items():
+            self.columns[metric] = np.concatenate([column, np.full(extra, np.nan)])
+        # The head wrapped to 0 when the buffers filled up, samples continue after the last one
+        self.head = self.size
+
+    def append(self, samples):
+        """_summary_
+            Append samples (sorted by time) to the series, overwriting the oldest when full.
+
+            Args:
+                samples (list): RRD samples with a "time" key and metric values.
+        """
+        for sample in samples:
+            if self.size == len(self.times) < self.capacity:
+                self.grow()
+            position = self.head
+            self.times[position] = sample["time"]
+            for column in self.columns.values():
+                column[position] = np.nan
+            for metric, value in sample.items():
+                if metric == "time" or not isinstance(value, (int, float)):
+                    continue
+                column = self.columns.get(metric)
+                if column is None:
+                    column = self.columns[metric] = np.full(len(self.times), np.nan)
+                column[position] = value
+            self.head = (position + 1) % len(self.times)
+            self.size = min(self.size + 1, self.capacity)
+
+    def samples(self):
+        """_summary_
+            Get every sample held, oldest first, shaped like RRD data.
+        """
+        positions = self.select()
+        columns = {metric: column[positions].tolist() for metric, column in self.columns.items()}
+        samples = []
+        for index, timestamp in enumerate(self.times[positions].tolist()):
+            sample = {"time": timestamp}
+            for metric, values in columns.items():
+                if not math.isnan(values[index]):
+                    sample[metric] = values[index]
+            samples.append(sample)
+        return samples
+
+    def select(self, start=None, end=None):
+        """_summary_
+            Get the ring positions of the samples in a time range, oldest first.
+
+            Args:
+                start (int): Start of the range (inclusive).
+                end (int): End of the range (inclusive).
+
+            Returns:
+                numpy.ndarray: Positions in time order.
+        """
+        if self.size < len(self.times):
+            positions = np.arange(self.size)
+        else:
+            positions = (np.arange(self.size) + self.head) % self.size
+        times = self.times[positions]
+        mask = np.ones(len(positions), dtype=bool)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        return positions[mask]
+
+# Create TimeSeriesStore class
+
+
+class TimeSeriesStore:
+
+    # Initialize TimeSeriesStore class
+    def __init__(self, capacity=10080, interval=60):
+        # Samples kept per node / VM (default is a week of one minute samples)
+        self.capacity = capacity
+        # Minimum seconds between two fetches of the same series
+        self.interval = interval
+        # (kind, name) -> RingSeries, series of deleted VMs are dropped (see retain)
+        self.series = {}
+        # (kind, name) -> time of the last successful ingest
+        self.fetched_at = {}
+        # (kind, name) -> oldest time a fetch has covered, older ranges are backfilled on demand
+        self.covered_from = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """_summary_
+            Create a time-series store from the environment variables.
+
+            Returns:
+                TimeSeriesStore: Time-series store.
+        """
+        return cls(capacity=int(os.getenv("HYPERVISOR_USAGE_HISTORY") or 10080),
+                   interval=float(os.getenv("HYPERVISOR_USAGE_INTERVAL") or 60))
+
+    def is_due(self, key):
+        """_summary_
+            Check whether a series should be refreshed from the hypervisor.
+
+            Args:
+                key (tuple): (kind, name) of the series.
+
+            Returns:
+                bool: True if the last ingest is older than the refresh interval.
+        """
+        return time.time() - self.fetched_at.get(key, 0) >= self.interval
+
+    def needs_backfill(self, key, start=None):
+        """_summary_
+            Check whether a range starts before what has been fetched for a series so far.
+
+            Args:
+                key (tuple): (kind, name) of the series.
+                start (int): Oldest timestamp wanted.
+
+            Returns:
+                bool: True if older samples have to be fetched.
+        """
+        if start is None or key not in self.covered_from:
+            return False
+        # Nothing is kept further back than the largest timeframe
+        return max(start, time.time() - TIMEFRAMES[-1][1]) < self.covered_from[key]
+
+    def timeframe_for(self, key, start=None):
+        """_summary_
+            Pick the smallest RRD timeframe that covers everything not ingested yet,
+            reaching back to start when the series doesn't cover it.
+
+            Args:
+                key (tuple): (kind, name) of the series.
+                start (int): Oldest timestamp wanted.
+
+            Returns:
+                str: RRD timeframe (hour, day, week, month or year).
+        """
+        now = time.time()
+        series = self.series.get(key)
+        last_time = series.last_time() if series is not None else None
+        if last_time is None or self.needs_backfill(key, start):
+            oldest = start if start is not None else now - 3600
+        else:
+            oldest = last_time
+        for timeframe, span in TIMEFRAMES:
+            # A minute of slack for the time since the range was resolved
+            if now - oldest <= span + 60:
+                return timeframe
+        return TIMEFRAMES[-1][0]
+
+    def ingest(self, key, samples, timeframe=None):
+        """_summary_
+            Ingest RRD samples, keeping those newer than the last ingested one
+            and, for a backfill, those older than the first one.
+
+            Args:
+                key (tuple): (kind, name) of the series.
+                samples (list): RRD samples with a "time" key.
+                timeframe (str): RRD timeframe the samples were fetched with.
+
+            Returns:
+                int: Number of samples added.
+        """
+        now = time.time()
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = RingSeries(self.capacity)
+            first_time, last_time = series.first_time(), series.last_time()
+            # Buckets the hypervisor hasn't filled in yet only carry a timestamp, skip them
+            samples = [sample for sample in samples or [] if sample.get("time") is not None and len(sample) > 1]
+            new_samples = sorted((sample for sample in samples if last_time is None or sample["time"] > last_time),
+                                 key=lambda sample: sample["time"])
+            old_samples = sorted((sample for sample in samples if first_time is not None
+                                  and sample["time"] < first_time), key=lambda sample: sample["time"])
+            if old_samples:
+                # Rare (first request for an older range): rebuild the series in time order
+                held = series.samples()
+                series = self.series[key] = RingSeries(self.capacity)
+                series.append((old_samples + held)[-self.capacity:])
+            series.append(new_samples)
+            self.fetched_at[key] = now
+            span = dict(TIMEFRAMES).get(timeframe, 0)
+            self.covered_from[key] = min(self.covered_from.get(key, now), now - span)
+        return len(new_samples) + len(old_samples)
+
+    def retain(self, kind, names):
+        """_summary_
+            Drop the series of the nodes / VMs that are gone.
+
+            Args:
+                kind (str): Kind of series (node, vm).
+                names (set): Names (node names or VMIDs) that still exist.
+
+            Returns:
+                int: Number of series dropped.
+        """
+        with self.lock:
+            gone = [key for key in self.series.keys() | self.fetched_at.keys()
+                    if key[0] == kind and key[1] not in names]
+            for key in gone:
+                self.series.pop(key, None)
+                self.fetched_at.pop(key, None)
+                self.covered_from.pop(key, None)
+        return len(gone)
+
+    def query(self, key, start=None, end=None):
+        """_summary_
+            Get the samples of a series in a time range.
+
+            Args:
+                key (tuple): (kind, name) of the series.
+                start (int): Start of the range (inclusive).
+                end (int): End of the range (inclusive).
+
+            Returns:
+                list: Samples (oldest first), shaped like RRD data.
+        """
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                return []
+            positions = series.select(start, end)
+            times = series.times[positions].tolist()
+            columns = {metric: column[positions].tolist() for metric, column in series.columns.items()}
+        samples = []
+        for index, timestamp in enumerate(times):
+            sample = {"time": timestamp}
+            for metric, values in columns.items():
+                if not math.isnan(values[index]):
+                    sample[metric] = values[index]
+            samples.append(sample)
+        return samples
+
+    def stack(self, keys, metric, start=None, end=None):
+        """_summary_
+            Stack one metric of several series on a shared time axis.
+
+            Args:
+                keys (list): (kind, name) of each series.
+                metric (str): Metric to stack.
+                start (int): Start of the range (inclusive).
+                end (int): End of the range (inclusive).
+
+            Returns:
+                tuple: (timestamps, matrix) with one row per key, NaN where a series has no sample.
+        """
+        parts = []
+        with self.lock:
+            for key in keys:
+                series = self.series.get(key)
+                if series is None or metric not in series.columns:
+                    parts.append((np.empty(0, dtype=np.int64), np.empty(0)))
+                    continue
+                positions = series.select(start, end)
+                parts.append((series.times[positions], series.columns[metric][positions]))
+        times = np.unique(np.concatenate([part[0] for part in parts])) if parts else np.empty(0, dtype=np.int64)
+        matrix = np.full((len(keys), len(times)), np.nan)
+        for row, (series_times, values) in enumerate(parts):
+            if len(series_times):
+                matrix[row, np.searchsorted(times, series_times)] = values
+        return times, matrix
+
+    def aggregate(self, keys, labels, metrics, start=None, end=None, top=10):
+        """_summary_
+            Aggregate metrics over several series in a time range.
+
+            Args:
+                keys (list): (kind, name) of each series.
+                labels (list): Label of each series in the result.
+                metrics (list): Metrics to aggregate.
+                start (int): Start of the range (inclusive).
+                end (int): End of the range (inclusive).
+                top (int): Number of top series to return per metric.
+
+            Returns:
+                dict: Aggregate per metric.
+        """
+        return {metric: summarize(*self.stack(keys, metric, start, end), labels, top)
+                for metric in metrics}
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import contextvars
+import os
+import time
+import uuid
+from collections import OrderedDict
+from loguru import logger
+
+"""_summary_
+    This is the per-request upstream tracing for the Ironsight API.
+    Every hypervisor call made while serving a request is recorded as a span
+    (path, duration, status) in a context variable, so the summary can go out
+    in Server-Timing / X-Upstream-Calls headers. Debug mode keeps the full span
+    lists of recent requests and logs the slow ones, to find call amplification.
+"""
+
+# Trace of the request being served (None outside of a request)
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def record_span(method, resource, template, status, started, duration):
+    """_summary_
+        Record an upstream call in the current request's trace, if any.
+
+        Args:
+            method (str): HTTP method.
+            resource (str): Resource path.
+            template (str): Resource template.
+            status (str): HTTP status code, or "exception".
+            started (float): perf_counter at the start of the call.
+            duration (float): Seconds the call took.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(method, resource, template, status, started, duration)
+
+# Create Trace class
+
+
+class Trace:
+
+    # Initialize Trace class
+    def __init__(self, method, path):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.duration = None
+        # Spans are appended from worker threads too (list.append is atomic)
+        self.spans = []
+
+    def add(self, method, resource, template, status, started, duration):
+        """_summary_
+            Add an upstream call span.
+        """
+        self.spans.append({"method": method, "resource": resource, "template": template, "status": status,
+                           "start_ms": round((started - self.started) * 1000, 3),
+                           "duration_ms": round(duration * 1000, 3)})
+
+    def finish(self):
+        """_summary_
+            Stop the request clock.
+        """
+        self.duration = time.perf_counter() - self.started
+
+    def upstream_ms(self):
+        """_summary_
+            Get the summed duration of the upstream calls (concurrent calls overlap).
+        """
+        return sum(span["duration_ms"] for span in list(self.spans))
+
+    def server_timing(self):
+        """_summary_
+            Build the Server-Timing header value.
+        """
+        calls = len(self.spans)
+        elapsed = (time.perf_counter() - self.started) * 1000
+        return f'upstream;dur={self.upstream_ms():.1f};desc="{calls} calls", total;dur={elapsed:.1f}'
+
+    def summary(self):
+        """_summary_
+            Summarize the trace, with the calls per resource template.
+
+            Returns:
+                dict: Trace summary and spans.
+        """
+        spans = list(self.spans)
+        by_template = {}
+        for span in spans:
+            by_template[span["template"]] = by_template.get(span["template"], 0) + 1
+        return {"id": self.id, "method": self.method, "path": self.path,
+                "duration_ms": round((self.duration or 0) * 1000, 3), "calls": len(spans),
+                "upstream_ms": round(self.upstream_ms(), 3),
+                "by_template": dict(sorted(by_template.items(), key=lambda item: -item[1])), "spans": spans}
+
+# Create TraceLog class
+
+
+class TraceLog:
+
+    # Initialize TraceLog class
+    def __init__(self, debug=None, size=None, slow=None):
+        # Keep full traces and log slow requests for every request (or per request with X-Debug: trace)
+        self.debug = debug if debug is not None else \
+            (os.getenv("HYPERVISOR_TRACE_DEBUG") or "false").lower() in ("1", "true", "yes")
+        # Number of traces kept
+        self.size = size or int(os.getenv("HYPERVISOR_TRACE_HISTORY") or 200)
+        # Requests slower than this (seconds) are logged in debug mode
+        self.slow = slow if slow is not None else float(os.getenv("HYPERVISOR_TRACE_SLOW") or 1)
+        # trace id -> summary
+        self.traces = OrderedDict()
+
+    def keep(self, trace):
+        """_summary_
+            Keep a finished trace and log it if it was slow.
+
+            Args:
+                trace (Trace): Finished trace.
+        """
+        summary = trace.summary()
+        self.traces[trace.id] = summary
+        while len(self.traces) > self.size:
+            self.traces.popitem(last=False)
+        if trace.duration >= self.slow:
+            top = ", ".join(f"{template} x{count}" for template, count in list(summary["by_template"].items())[:3])
+            logger.warning(f"Slow request {trace.method} {trace.path}: {summary['duration_ms']:.0f} ms, "
+                           f"{summary['calls']} upstream calls ({top}), trace {trace.id}")
+
+    def get(self, trace_id):
+        """_summary_
+            Get a kept trace.
+        """
+        return self.traces.get(trace_id)
+
+    def slowest(self, limit=20):
+        """_summary_
+            Get the slowest kept traces, without their spans.
+        """
+        traces = sorted(self.traces.values(), key=lambda summary: -summary["duration_ms"])[:limit]
+        return [{key: value for key, value in summary.items() if key != "spans"} for summary in traces]
+
+# Create TracingMiddleware class
+
+
+class TracingMiddleware:
+
+    # Initialize TracingMiddleware class
+    def __init__(self, app, trace_log):
+        self.app = app
+        self.trace_log = trace_log
+
+    async def __call__(self, scope, receive, send):
+        """_summary_
+            Trace the upstream calls of a request and report them in the response headers.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(scope["method"], scope["path"])
+        headers = dict(scope.get("headers") or [])
+        debug = self.trace_log.debug or headers.get(b"x-debug", b"").lower() == b"trace"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Streamed responses only report the calls made before the first chunk
+                message["headers"] = list(message.get("headers") or []) + [
+                    (b"server-timing", trace.server_timing().encode()),
+                    (b"x-upstream-calls", str(len(trace.spans)).encode())]
+                if debug:
+                    message["headers"].append((b"x-trace-id", trace.id.encode()))
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            trace.finish()
+            if debug:
+                self.trace_log.keep(trace)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import inspect
+
+"""_summary_
+    Shared helpers for the hypervisor interface.
+"""
+
+
+async def maybe_await(func, *args, **kwargs):
+    """_summary_
+        Call a hypervisor method from async code, whether the backend is sync or async.
+        Coroutine functions are awaited, blocking functions are run in a worker
+        thread so they don't stall the event loop.
+
+        Args:
+            func (callable): Hypervisor method to call.
+
+        Returns:
+            any: Result of the method.
+    """
+    if inspect.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    result = await asyncio.to_thread(func, *args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def flow(method):
+    """_summary_
+        Write a hypervisor method once for the blocking and the asyncio backends.
+        The method is a generator that yields every backend call it makes and is
+        sent back the result: blocking calls have already returned it, async calls
+        are awaited by the asyncio backend (see asynchronous).
+        Between two yields the flow runs on the event loop, so it may only do CPU
+        work and take the short locks of the in-memory stores (cache, VM store,
+        time series), which are never held across I/O. Calls to the hypervisor
+        are yielded through send, and any other blocking I/O (the shared SQLite
+        store) through offload.
+
+        Args:
+            method (callable): Generator method.
+
+        Returns:
+            callable: Blocking method running the generator to completion.
+    """
+    @functools.wraps(method)
+    def run(self, *args, **kwargs):
+        return run_flow(method(self, *args, **kwargs))
+
+    run.flow = method
+    return run
+
+
+def run_flow(steps):
+    """_summary_
+        Run a flow whose calls are blocking, so each step already holds its result.
+    """
+    try:
+        result = next(steps)
+        while True:
+            result = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_flow_async(steps):
+    """_summary_
+        Run a flow, awaiting the calls it yields. A failed call is raised where it was yielded.
+    """
+    result, error = None, None
+    try:
+        while True:
+            step = steps.throw(error) if error is not None else steps.send(result)
+            result, error = step, None
+            if inspect.isawaitable(step):
+                try:
+                    result = await step
+                except Exception as e:
+                    error = e
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        # A flow cut off mid-call (e.g. cancelled) is unwound now, so its cleanup runs
+        steps.close()
+
+
+def asynchronous(cls):
+    """_summary_
+        Turn the flows a backend class inherits into coroutine methods (class decorator).
+        Flows the class defines itself are left alone.
+    """
+    def awaitable(method):
+        @functools.wraps(method)
+        async def run(self, *args, **kwargs):
+            return await run_flow_async(method(self, *args, **kwargs))
+        return run
+
+    for base in reversed(cls.__mro__[1:]):
+        for name, member in vars(base).items():
+            if hasattr(member, "flow") and name not in vars(cls):
+                setattr(cls, name, awaitable(member.flow))
+    return cls
+
+
+def item_key(item, field):
+    """_summary_
+        Get the key of a listing item, prefixed with its cluster in a federation (VMIDs / node names can repeat).
+    """
+    cluster = item.get("cluster")
+    return item.get(field) if cluster is None else f"{cluster}/{item.get(field)}"
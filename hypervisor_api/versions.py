@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from hypervisor_api.poller import diff_snapshots
+from hypervisor_api.shared import SharedStore
+
+"""_summary_
+    This is the inventory version log for the hypervisor interface.
+    Every complete VM/node listing is compared with the previous one and bumps
+    a monotonic version when anything changed, so clients can revalidate with
+    ETags (304 Not Modified) or ask for only what changed since their version.
+    With several workers the log is kept in the shared store, so every worker
+    hands out the same versions.
+"""
+
+# Usage counters of VMs and nodes, which move on every refresh without the inventory changing
+USAGE_FIELDS = frozenset(("cpu", "mem", "disk", "uptime", "netin", "netout", "diskread", "diskwrite"))
+
+
+def make_etag(topic, version, variant=""):
+    """_summary_
+        Build the ETag of a listing.
+
+        Args:
+            topic (str): Listing (vms, nodes).
+            version (int): Inventory version the listing was built from.
+            variant (str): What else shapes the response (e.g. the query string).
+
+        Returns:
+            str: Weak ETag.
+    """
+    return f'W/"{topic}-{version}-{zlib.crc32(variant.encode()):08x}"'
+
+
+def etag_matches(etag, if_none_match):
+    """_summary_
+        Check an ETag against an If-None-Match header.
+
+        Args:
+            etag (str): Current ETag.
+            if_none_match (str): Header sent by the client.
+
+        Returns:
+            bool: True if the client already has this version.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, W/ prefixes are ignored
+    return "*" in tags or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+
+def inventory_fields(item):
+    """_summary_
+        Strip the usage counters from a listing item, keeping what it is and how it is set up.
+
+        Args:
+            item (dict): VM or node.
+
+        Returns:
+            dict: Item without its usage counters.
+    """
+    return {field: value for field, value in item.items() if field not in USAGE_FIELDS}
+
+# Create InventoryVersions class
+
+
+class InventoryVersions:
+
+    # Initialize InventoryVersions class
+    def __init__(self, history=None, shared=None):
+        # Number of versions kept per topic to diff against
+        self.history = history or int(os.getenv("HYPERVISOR_CHANGE_HISTORY") or 32)
+        # Version log shared by the workers (None in single-process mode)
+        self.shared = shared
+        # topic -> {"version": latest version, "snapshots": version -> snapshot (key -> item)}
+        self.topics = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, namespace=""):
+        """_summary_
+            Build the version log, shared by the workers when HYPERVISOR_SHARED_CACHE is set.
+
+            Args:
+                namespace (str): Hypervisor the listings come from.
+        """
+        return cls(shared=SharedStore.from_env(namespace + "|" if namespace else ""))
+
+    def observe(self, topic, snapshot):
+        """_summary_
+            Record a complete listing, bumping the version if its inventory changed.
+            Usage counters are left out, so they don't bump the version or show up as changes.
+
+            Args:
+                topic (str): Listing (vms, nodes).
+                snapshot (dict): Key -> item.
+
+            Returns:
+                int: Version of the listing.
+        """
+        snapshot = {key: inventory_fields(item) for key, item in snapshot.items()}
+        if self.shared is not None:
+            version = self.shared.observe_version(topic, snapshot, self.history)
+            if version is not None:
+                return version
+        with self.lock:
+            state = self.topics.setdefault(topic, {"version": None, "snapshots": OrderedDict()})
+            if state["version"] is None:
+                # Versions start from the clock, so they keep increasing across restarts
+                version = int(time.time() * 1000)
+                previous = {}
+            else:
+                previous = state["snapshots"][state["version"]]
+                if previous == snapshot:
+                    return state["version"]
+                version = state["version"] + 1
+            # Unchanged items are shared with the previous snapshot, history only costs what changed
+            snapshot = {key: previous[key] if previous.get(key) == item else item for key, item in snapshot.items()}
+            state["snapshots"][version] = snapshot
+            state["version"] = version
+            while len(state["snapshots"]) > self.history:
+                state["snapshots"].popitem(last=False)
+            return version
+
+    def version(self, topic):
+        """_summary_
+            Get the latest version of a listing.
+
+            Returns:
+                int: Version, or None if the listing was never seen.
+        """
+        if self.shared is not None:
+            latest = self.shared.load_version(topic)
+            if latest is not None:
+                return latest[0]
+        with self.lock:
+            state = self.topics.get(topic)
+            return state["version"] if state is not None else None
+
+    def changes(self, topic, since=None):
+        """_summary_
+            Get what changed in a listing since a version.
+            When the version is unknown (too old, from another instance...) the full listing is returned instead.
+
+            Args:
+                topic (str): Listing (vms, nodes).
+                since (int): Version the client has.
+
+            Returns:
+                dict: Added items, removed keys and changed fields, or a full snapshot. None if the listing was never seen.
+        """
+        latest = self.shared.load_version(topic) if self.shared is not None else None
+        if latest is not None:
+            version, current = latest
+            old = self.shared.load_version(topic, since) if since is not None else None
+            old = old[1] if old is not None else None
+        else:
+            with self.lock:
+                state = self.topics.get(topic)
+                if state is None:
+                    return None
+                version = state["version"]
+                current = state["snapshots"][version]
+                old = state["snapshots"].get(since) if since is not None else None
+        if old is None:
+            return {"type": "snapshot", "version": version, "data": list(current.values())}
+        return {"type": "changes", "since": since, "version": version, **diff_snapshots(old, current)}
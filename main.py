@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 
 import hypervisor_api
-from fastapi import FastAPI
+from hypervisor_api.utils import maybe_await
+from hypervisor_api.poller import InventoryPoller
+from hypervisor_api.streaming import STREAM_MEDIA_TYPES, stream_format, encode_chunks, aencode_chunks
+from hypervisor_api.versions import make_etag, etag_matches
+from hypervisor_api.query import check_query
+from hypervisor_api.metrics import MetricsMiddleware, register_collector, render_metrics, count_items, close_metrics
+from hypervisor_api.tracing import TraceLog, TracingMiddleware
+from hypervisor_api.resilience import DeadlineMiddleware
+from hypervisor_api.shared import SharedRefresher
+from hypervisor_api.batch import run_batch
+from fastapi import FastAPI, Request, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
 import os
 import json
 import sys
+import tempfile
 from loguru import logger
 from dotenv import load_dotenv
 load_dotenv()
@@ -14,6 +29,7 @@ load_dotenv()
 
 # Get ENV variables
 SERVER_PORT = os.getenv("SERVER_PORT")
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS") or 1)
 HYPERVISOR = os.getenv("HYPERVISOR")
 
 
@@ -23,17 +39,153 @@ with open("build_info.json", "r") as f:
 BUILD_INFO = json.loads(BUILD_INFO)
 API_VERSION = BUILD_INFO["api_version"]
 
-# Set up API
-ironsight_api = FastAPI()
-
 # Set up hypervisor object
 hypervisor = hypervisor_api.init_hypervisor(HYPERVISOR)
 
+# Set up background poller that pushes inventory/usage changes to /events subscribers
+poller = InventoryPoller(hypervisor)
+
+# With several workers, one elected worker keeps the shared cache warm for all of them
+refresher = SharedRefresher(hypervisor) if hypervisor is not None else None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    poller.start()
+    if hypervisor is not None:
+        # Registered by the app being served (worker processes import this module twice)
+        register_collector(hypervisor)
+        # Poll in-flight upstream tasks (UPIDs) in the background
+        hypervisor.tasks.start()
+        refresher.start()
+    yield
+    await poller.stop()
+    # Close pooled hypervisor connections on shutdown
+    if hypervisor is not None:
+        await refresher.stop()
+        await hypervisor.tasks.stop()
+        await maybe_await(hypervisor.close)
+    close_metrics()
+
+
+# Set up API
+ironsight_api = FastAPI(lifespan=lifespan)
+# Time every route and count the bytes it returns (scraped at /metrics)
+ironsight_api.add_middleware(MetricsMiddleware)
+# Trace the upstream calls of every request (Server-Timing / X-Upstream-Calls, /traces in debug mode)
+trace_log = TraceLog()
+ironsight_api.add_middleware(TracingMiddleware, trace_log=trace_log)
+# Give every read a deadline shared by the hypervisor calls it makes
+ironsight_api.add_middleware(DeadlineMiddleware)
+
+
+# Request bodies
+class BulkPowerRequest(BaseModel):
+    names: list[str] | None = None
+    node: str | None = None
+    prefix: str | None = None
+    template: bool = False
+    status: str | None = None
+    concurrency: int | None = None
+
+
+class VMQuery(BaseModel):
+    status: str | None = None
+    node: str | None = None
+    template: bool | None = None
+    name: str | None = None
+    tags: str | None = None
+    fields: str | None = None
+    sort: str | None = None
+    limit: int | None = None
+    cursor: str | None = None
+
+
+class ProvisionRequest(BaseModel):
+    template_name: str
+    names: list[str] = None
+    prefix: str = None
+    count: int = None
+    linked: bool = None
+    config: dict = None
+    start: bool = False
+    concurrency: int = None
+    strategy: str = None
+    affinity: dict[str, str] = None
+    stream: bool = True
+
+
+class BatchQuery(BaseModel):
+    id: str = None
+    path: str
+    params: dict = None
+
+
+class BatchRequest(BaseModel):
+    queries: list[BatchQuery]
+
+
+# Provisioning runs keep going when their client disconnects
+provision_tasks = set()
+
+
+def bad_query(query):
+    """_summary_
+        Reject a listing query with invalid pagination (limit, cursor) with a 400.
+    """
+    error = check_query(query.sort, query.limit, query.cursor)
+    if error:
+        return JSONResponse({"status": "error", "error": error}, status_code=400)
+    return None
+
+
+def listed(request, result):
+    """_summary_
+        Count the items of a listing response in the route's metrics.
+    """
+    data = result.get("data") if isinstance(result, dict) else result
+    if isinstance(data, list):
+        count_items(request.scope["route"].path, len(data))
+    return result
+
+
+def stream_items(request, items, stream):
+    """_summary_
+        Stream the items of a hypervisor iterator (blocking or async) as they are produced.
+    """
+    route = request.scope["route"].path
+    if hasattr(items, "__aiter__"):
+        async def counted():
+            async for item in items:
+                count_items(route, 1)
+                yield item
+        chunks = aencode_chunks(counted(), stream)
+    else:
+        def counted():
+            for item in items:
+                count_items(route, 1)
+                yield item
+        chunks = encode_chunks(counted(), stream)
+    return StreamingResponse(chunks, media_type=STREAM_MEDIA_TYPES[stream])
+
+
+def conditional(request, result, topic):
+    """_summary_
+        Tag a versioned listing with its ETag, answering 304 Not Modified if the client already has it.
+    """
+    if not isinstance(result, dict) or result.get("version") is None:
+        return result
+    listed(request, result)
+    headers = {"ETag": make_etag(topic, result["version"], request.url.query), "Cache-Control": "no-cache"}
+    if etag_matches(headers["ETag"], request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(result, headers=headers)
+
 
 # Set up API routes
 @ironsight_api.get("/")
 async def root():
-    return {"description": "Ironsight API", "api_version": API_VERSION, "hypervisor": hypervisor.get_summary()}
+    return {"description": "Ironsight API", "api_version": API_VERSION, "hypervisor": await maybe_await(hypervisor.get_summary)}
 
 
 @ironsight_api.get("/health")
@@ -41,103 +193,295 @@ async def health():
     return {"status": "ok"}
 
 
+@ironsight_api.get("/metrics")
+async def metrics():
+    body, media_type = render_metrics()
+    return Response(body, media_type=media_type)
+
+
+@ironsight_api.get("/events")
+async def events(request: Request, topics: str = None):
+    """_summary_
+        Server-Sent Events stream of inventory/usage changes.
+        Topics (comma separated): vms, nodes, usage_nodes. Defaults to all of them.
+    """
+    queue = poller.subscribe(topics.split(",") if topics else None)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Keep the connection alive through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['topic']}\nid: {event['version']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            poller.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@ironsight_api.get("/tasks")
+async def get_tasks(request: Request, status: str = None):
+    return listed(request, await maybe_await(hypervisor.get_tasks, status))
+
+
+@ironsight_api.get("/tasks/{upid}")
+async def get_task(upid: str, wait: float = 0):
+    # Track tasks started elsewhere (e.g. before a restart) on demand
+    if hypervisor.tasks.get(upid) is None and hypervisor.tasks.record(upid) is None:
+        return {"status": "error", "error": "Task not found"}
+    # Long-poll: hold the request until the task finishes or wait seconds pass
+    task = await hypervisor.tasks.wait(upid, wait)
+    return {"status": "success", "data": task}
+
+
+@ironsight_api.get("/traces")
+async def get_traces(limit: int = 20):
+    return {"status": "success", "data": trace_log.slowest(limit)}
+
+
+@ironsight_api.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    trace = trace_log.get(trace_id)
+    if trace is None:
+        return {"status": "error", "error": "Trace not found"}
+    return {"status": "success", "data": trace}
+
+
+@ironsight_api.post("/batch")
+async def batch(request: Request, batch: BatchRequest):
+    """_summary_
+        Run several read routes (e.g. /nodes, /vms, /usage/nodes) concurrently in one request.
+        Upstream resources the sub-queries have in common are fetched once for the whole batch.
+    """
+    return await run_batch(ironsight_api.router, request.scope, [query.model_dump() for query in batch.queries])
+
+
+@ironsight_api.get("/cache")
+async def get_cache_stats():
+    return await maybe_await(hypervisor.get_cache_stats)
+
+
+@ironsight_api.get("/coalescing")
+async def get_coalescing_stats():
+    return await maybe_await(hypervisor.get_coalescing_stats)
+
+
+@ironsight_api.get("/circuits")
+async def get_circuit_stats():
+    return await maybe_await(hypervisor.get_circuit_stats)
+
+
 # Set up hypervisor APIs
 
 # Node management APIs
 
 @ironsight_api.get("/nodes")
-async def get_nodes():
-    return hypervisor.get_nodes()
+async def get_nodes(request: Request):
+    return conditional(request, await maybe_await(hypervisor.get_nodes), "nodes")
 
 
 @ironsight_api.get("/nodes/{node_name}")
 async def get_node(node_name: str):
-    return hypervisor.get_node(node_name)
+    return await maybe_await(hypervisor.get_node, node_name)
 
 
 @ironsight_api.get("/nodes/{node_name}/vms")
-async def get_vms(node_name: str):
-    return hypervisor.get_vms_on_node(node_name)
+async def get_vms(request: Request, node_name: str, query: VMQuery = Depends()):
+    if error := bad_query(query):
+        return error
+    return listed(request, await maybe_await(hypervisor.get_vms_on_node, node_name,
+                                             **query.model_dump(exclude_none=True, exclude={"node"})))
 
 
 @ironsight_api.get("/nodes/{node_name}/vms/{vm_id}")
 async def get_vm(node_name: str, vm_id: int):
-    return hypervisor.get_vm_by_id(node_name, vm_id)
+    return await maybe_await(hypervisor.get_vm_by_id, node_name, vm_id)
 
 
 # Template management APIs
 
 
 @ironsight_api.get("/templates")
-async def get_templates():
-    return hypervisor.get_templates()
+async def get_templates(request: Request, query: VMQuery = Depends()):
+    if error := bad_query(query):
+        return error
+    return listed(request, await maybe_await(hypervisor.get_templates,
+                                             **query.model_dump(exclude_none=True, exclude={"template"})))
 
 
 # VM management APIs
 
 @ironsight_api.get("/vms")
-async def get_vms():
-    return hypervisor.get_vms()
+async def get_vms(request: Request, stream: str = None, query: VMQuery = Depends()):
+    # Opt-in streaming (?stream=ndjson|json or Accept: application/x-ndjson), filters and fields only
+    if error := bad_query(query):
+        return error
+    stream = stream_format(stream, request.headers.get("accept"))
+    if stream:
+        return stream_items(request, hypervisor.iter_vms(
+            **query.model_dump(exclude_none=True, exclude={"sort", "limit", "cursor"})), stream)
+    return conditional(request, await maybe_await(hypervisor.get_vms, **query.model_dump(exclude_none=True)), "vms")
+
+
+@ironsight_api.get("/vms/count")
+async def count_vms(node: str = None, status: str = None, template: bool = None):
+    return await maybe_await(hypervisor.count_vms, node, status, template)
+
+
+@ironsight_api.get("/vms/changes")
+async def get_vm_changes(since: int = None):
+    return await maybe_await(hypervisor.get_vm_changes, since)
 
 
 @ironsight_api.get("/vms/{vm_name}")
 async def get_vm_by_name(vm_name: str):
-    return hypervisor.get_vm_by_name(vm_name)
+    return await maybe_await(hypervisor.get_vm_by_name, vm_name)
+
+
+@ironsight_api.post("/vms/bulk/{action}")
+async def bulk_power(action: str, request: BulkPowerRequest):
+    return await maybe_await(hypervisor.bulk_power, action, request.names, request.node, request.prefix,
+                             request.template, request.status, request.concurrency)
 
 
 @ironsight_api.post("/vms/{vm_name}/start")
 async def start_vm(vm_name: str):
-    return hypervisor.start_vm(vm_name)
+    return await maybe_await(hypervisor.start_vm, vm_name)
 
 
 @ironsight_api.post("/vms/{vm_name}/stop")
 async def stop_vm(vm_name: str):
-    return hypervisor.stop_vm(vm_name)
+    return await maybe_await(hypervisor.stop_vm, vm_name)
 
 
 @ironsight_api.post("/vms/{vm_name}/toggle_power")
 async def power_toggle_vm(vm_name: str):
-    return hypervisor.power_toggle_vm(vm_name)
+    return await maybe_await(hypervisor.power_toggle_vm, vm_name)
 
 
 @ironsight_api.post("/vms/{vm_name}/reboot")
 async def reboot_vm(vm_name: str):
-    return hypervisor.reboot_vm(vm_name)
+    return await maybe_await(hypervisor.reboot_vm, vm_name)
+
+
+@ironsight_api.post("/vms/provision")
+async def provision_vms(request: ProvisionRequest):
+    """_summary_
+        Clone many VMs from a template in one request.
+        Progress is streamed as newline delimited JSON, one event per step per VM,
+        followed by the result (unless stream is false).
+    """
+    args = (request.template_name, request.names, request.prefix, request.count, request.linked,
+            request.config, request.start, request.concurrency)
+    placement = {"strategy": request.strategy, "affinity": request.affinity}
+    if not request.stream:
+        return await maybe_await(hypervisor.provision_vms, *args, **placement)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def progress(event):
+        # The synchronous backend reports from worker threads
+        loop.call_soon_threadsafe(queue.put_nowait, {"type": "progress", **event})
+
+    async def provision():
+        try:
+            result = await maybe_await(hypervisor.provision_vms, *args, progress=progress, **placement)
+        except Exception as e:
+            logger.error(f"Error: Provisioning failed: {e}")
+            result = {"status": "error", "error": str(e)}
+        loop.call_soon_threadsafe(queue.put_nowait, {"type": "result", **result})
+
+    task = asyncio.create_task(provision())
+    provision_tasks.add(task)
+    task.add_done_callback(provision_tasks.discard)
+
+    async def stream():
+        while True:
+            event = await queue.get()
+            yield json.dumps(event) + "\n"
+            if event["type"] == "result":
+                break
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@ironsight_api.post("/vms/placement")
+async def plan_placement(request: ProvisionRequest):
+    """_summary_
+        Dry run of a provisioning request: shows the node each clone would be placed on.
+    """
+    return await maybe_await(hypervisor.plan_placement, request.template_name, request.names, request.prefix,
+                             request.count, request.linked, request.strategy, request.affinity)
 
 
 @ironsight_api.post("/vms/create")
 async def create_vm(vm_name: str, template_name: str):
-    return hypervisor.create_vm(vm_name, template_name)
+    return await maybe_await(hypervisor.create_vm, vm_name, template_name)
 
 
 @ironsight_api.post("/vms/{vm_name}/vnc")
 async def configure_vnc(vm_name: str, port: int):
-    return hypervisor.configure_vnc(vm_name, port)
+    return await maybe_await(hypervisor.configure_vnc, vm_name, port)
 
 
 @ironsight_api.get("/vms/{vm_name}/config")
 async def get_vm_config(vm_name: str):
-    return hypervisor.get_vm_config(vm_name)
+    return await maybe_await(hypervisor.get_vm_config, vm_name)
 
 
 @ironsight_api.get("/usage/nodes")
-async def get_usage_graph():
-    return hypervisor.get_usage_graph()
+async def get_usage_graph(request: Request, start: int = None, end: int = None, stream: str = None):
+    stream = stream_format(stream, request.headers.get("accept"))
+    if stream:
+        return stream_items(request, hypervisor.iter_usage_graph(start, end), stream)
+    return listed(request, await maybe_await(hypervisor.get_usage_graph, None, start, end))
 
 
 @ironsight_api.get("/usage/nodes/{node_name}")
-async def get_usage_graph(node_name: str):
-    return hypervisor.get_usage_graph(node_name)
+async def get_usage_graph(node_name: str, start: int = None, end: int = None):
+    return await maybe_await(hypervisor.get_usage_graph, node_name, start, end)
 
 
 @ironsight_api.get("/usage/vms")
-async def get_vm_usage_graph():
-    return hypervisor.get_vm_usage_graph()
+async def get_vm_usage_graph(request: Request, start: int = None, end: int = None, stream: str = None):
+    stream = stream_format(stream, request.headers.get("accept"))
+    if stream:
+        return stream_items(request, hypervisor.iter_vm_usage_graph(start, end), stream)
+    return listed(request, await maybe_await(hypervisor.get_vm_usage_graph, None, start, end))
+
+
+@ironsight_api.get("/usage/vms/{vm_name}")
+async def get_vm_usage_graph(vm_name: str, start: int = None, end: int = None):
+    return await maybe_await(hypervisor.get_vm_usage_graph, vm_name, start, end)
+
+
+@ironsight_api.get("/usage/aggregate/nodes")
+async def get_usage_aggregate(metrics: str = "cpu,memused", start: int = None, end: int = None, top: int = 10):
+    return await maybe_await(hypervisor.get_usage_aggregate, metrics.split(","), start, end, top)
+
+
+@ironsight_api.get("/usage/aggregate/vms")
+async def get_vm_usage_aggregate(metrics: str = "cpu,mem", start: int = None, end: int = None, top: int = 10):
+    return await maybe_await(hypervisor.get_vm_usage_aggregate, metrics.split(","), start, end, top)
 
 
 @logger.catch
 def main():
-    uvicorn.run(ironsight_api, host="0.0.0.0", port=int((SERVER_PORT)))
+    if SERVER_WORKERS <= 1:
+        uvicorn.run(ironsight_api, host="0.0.0.0", port=int((SERVER_PORT)))
+        return
+    # Workers share upstream responses through SQLite and merge their metrics, both set before they start
+    # Empty values (e.g. from a .env copied from .env_template) count as unset
+    if not os.getenv("HYPERVISOR_SHARED_CACHE"):
+        os.environ["HYPERVISOR_SHARED_CACHE"] = os.path.join(tempfile.gettempdir(), "ironsight-shared.db")
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="ironsight-metrics-")
+    uvicorn.run("main:ironsight_api", host="0.0.0.0", port=int((SERVER_PORT)), workers=SERVER_WORKERS)
 
 
 if __name__ == "__main__":
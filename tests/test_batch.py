@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from hypervisor_api.batch import run_batch
+
+"""_summary_
+    Tests for POST /batch sub-query dispatch, against a small stand-in API.
+"""
+
+app = FastAPI()
+
+
+@app.get("/vms")
+async def get_vms(status: str = None, node: str = None):
+    return {"status": "success", "query": {"status": status, "node": node}}
+
+
+@app.get("/vms/{vm_name}")
+async def get_vm(vm_name: str):
+    return {"status": "success", "name": vm_name}
+
+
+@app.post("/batch")
+async def batch(request: Request):
+    return await run_batch(app.router, request.scope, (await request.json())["queries"])
+
+
+client = TestClient(app)
+
+
+def run(*queries):
+    response = client.post("/batch", json={"queries": list(queries)})
+    assert response.status_code == 200
+    return response.json()["data"]
+
+
+def test_query_string_in_path():
+    result = run({"path": "/vms?status=running"})[0]
+    assert result["status_code"] == 200
+    assert result["result"]["query"] == {"status": "running", "node": None}
+
+
+def test_query_string_and_params_are_merged():
+    result = run({"path": "/vms?status=running", "params": {"node": "pve01"}})[0]
+    assert result["result"]["query"] == {"status": "running", "node": "pve01"}
+
+
+def test_path_parameters():
+    result = run({"id": "vm", "path": "/vms/vm-101"})[0]
+    assert result["id"] == "vm"
+    assert result["result"]["name"] == "vm-101"
+
+
+def test_unknown_and_excluded_paths():
+    missing, events, absolute = run({"path": "/missing?x=1"}, {"path": "/events?topics=vms"},
+                                    {"path": "http://example.com/vms"})
+    assert missing["status_code"] == 404
+    assert events["status_code"] == 400
+    assert absolute["status_code"] == 400
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import threading
+import pytest
+from hypervisor_api import cache as cache_module
+from hypervisor_api.cache import ResponseCache, parse_ttls
+from hypervisor_api.proxmox.proxmox import Proxmox
+
+"""_summary_
+    Tests for the TTL / stale-while-revalidate response cache.
+"""
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+class Response:
+
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+        self.text = ""
+        self.content = b""
+
+    def json(self):
+        return {"data": self.data}
+
+
+class CountingProxmox(Proxmox):
+
+    def __init__(self):
+        super().__init__("http://pve.test")
+        self.cache = ResponseCache(stale_ttl=30, ttls=[("nodes", 10)])
+        self.calls = 0
+        # Cleared to hold upstream calls until it is set
+        self.upstream = threading.Event()
+        self.upstream.set()
+
+    def send(self, method, url, timeout, **kwargs):
+        self.calls += 1
+        self.upstream.wait(5)
+        return Response([{"node": "pve1", "call": self.calls}])
+
+
+def test_ttls():
+    cache = ResponseCache(ttls=parse_ttls("nodes/*/rrddata=60, version=0"))
+    assert cache.ttl_for("nodes/pve1/rrddata") == 60
+    assert cache.ttl_for("nodes/pve1/status") == 5
+    assert cache.ttl_for("somewhere/else") == cache.default_ttl
+    # A TTL of 0 turns caching off for the resource
+    cache.set("version", "version", {"status": "success"})
+    assert cache.get("version") == (None, None)
+
+
+def test_entries_expire(clock):
+    cache = ResponseCache(stale_ttl=30, fallback_ttl=300, ttls=[("nodes", 10)])
+    cache.set("nodes", "nodes", {"status": "success", "data": []})
+    assert cache.get("nodes")[1] == "fresh"
+    clock.now += 11
+    assert cache.get("nodes")[1] == "stale"
+    clock.now += 30
+    assert cache.get("nodes") == (None, None)
+    # Still kept to serve when the hypervisor can't answer
+    assert cache.fallback("nodes")["stale"]
+    clock.now += 300
+    assert cache.fallback("nodes") is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.set(key, "nodes", {"key": key})
+    cache.get("a")
+    cache.set("c", "nodes", {"key": "c"})
+    assert cache.get("b") == (None, None)
+    assert cache.get("a")[0] == {"key": "a"}
+    assert cache.get("c")[0] == {"key": "c"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_stale_hits_trigger_one_refresh(clock):
+    proxmox = CountingProxmox()
+    assert proxmox.get_resource("nodes")["data"][0]["call"] == 1
+    clock.now += 15
+    proxmox.upstream.clear()
+    # Every stale read is answered from the cache while a single refresh runs
+    for _ in range(5):
+        assert proxmox.get_resource("nodes")["data"][0]["call"] == 1
+    assert proxmox.cache.stats()["refreshes"] == 1
+    proxmox.upstream.set()
+    for _ in range(50):
+        if not proxmox.cache.refreshing:
+            break
+        threading.Event().wait(0.05)
+    assert proxmox.calls == 2
+    assert proxmox.get_resource("nodes")["data"][0]["call"] == 2
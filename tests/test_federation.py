@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import asyncio
+from hypervisor_api.federation import FederatedHypervisor
+from hypervisor_api.query import apply_query
+
+"""_summary_
+    Tests for merging the listings and streams of several clusters.
+"""
+
+
+class Cluster:
+
+    def __init__(self, templates=None, delays=()):
+        # None when the cluster can't list its VMs
+        self.templates = templates
+        # Seconds before each streamed item
+        self.delays = delays
+
+    async def get_templates(self, **query):
+        if self.templates is None:
+            return [] if not query else {"status": "error", "error": "VM list could not be retrieved"}
+        return self.templates if not query else apply_query(self.templates, **query)
+
+    async def iter_vms(self):
+        for i, delay in enumerate(self.delays):
+            await asyncio.sleep(delay)
+            yield {"vmid": 100 + i}
+
+
+def template(vmid):
+    return {"vmid": vmid, "name": f"template-{vmid}", "template": 1, "status": "stopped", "node": "pve1"}
+
+
+def test_failed_template_listing_is_degraded():
+    federation = FederatedHypervisor({"east": Cluster([template(100)]), "west": Cluster()})
+    response = asyncio.run(federation.get_templates())
+    assert response["status"] == "success"
+    assert [item["cluster"] for item in response["data"]] == ["east"]
+    assert response["clusters"]["east"] == {"status": "ok"}
+    assert response["clusters"]["west"]["status"] == "degraded"
+    paged = asyncio.run(federation.get_templates(limit=1))
+    assert paged["clusters"]["west"]["status"] == "degraded"
+
+
+def test_steady_stream_outlives_the_cluster_timeout():
+    federation = FederatedHypervisor({"east": Cluster(delays=[0.05] * 6), "west": Cluster(delays=[0.5])},
+                                     timeout=0.2)
+
+    async def collect():
+        return [item async for item in federation.merged_stream("iter_vms")]
+
+    items = asyncio.run(collect())
+    # East took 0.3s in all but never went quiet for 0.2s, west did
+    assert [item["vmid"] for item in items if item["cluster"] == "east"] == list(range(100, 106))
+    assert [item for item in items if item["cluster"] == "west"] == \
+        [{"status": "error", "error": "Cluster west is degraded", "cluster": "west"}]
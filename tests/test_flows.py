@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import asyncio
+import inspect
+import pytest
+from hypervisor_api.utils import flow, asynchronous
+
+"""_summary_
+    Tests for flows, the methods shared by the blocking and asyncio backends.
+"""
+
+
+class Backend:
+
+    def fetch(self, value):
+        if value is None:
+            raise ValueError("No value")
+        return value
+
+    @flow
+    def double(self, value):
+        return 2 * (yield self.fetch(value))
+
+    @flow
+    def double_or_error(self, value):
+        try:
+            return (yield self.double(value))
+        except ValueError as e:
+            return str(e)
+
+
+@asynchronous
+class AsyncBackend(Backend):
+
+    async def fetch(self, value):
+        await asyncio.sleep(0)
+        if value is None:
+            raise ValueError("No value")
+        return value
+
+
+def test_blocking_flows():
+    assert Backend().double(2) == 4
+    assert Backend().double_or_error(None) == "No value"
+
+
+def test_async_flows():
+    backend = AsyncBackend()
+    assert inspect.iscoroutinefunction(backend.double)
+    assert asyncio.run(backend.double(2)) == 4
+    # A failed call is raised where the flow yielded it
+    assert asyncio.run(backend.double_or_error(None)) == "No value"
+    with pytest.raises(ValueError):
+        asyncio.run(backend.double(None))
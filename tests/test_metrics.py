@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+from prometheus_client import REGISTRY
+from hypervisor_api.metrics import HypervisorCollector, resource_template
+from hypervisor_api.proxmox.proxmox import Proxmox
+from hypervisor_api.resilience import RetryPolicy
+
+"""_summary_
+    Tests for the upstream call metrics and the hypervisor collector.
+"""
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class Response:
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+        self.text = ""
+        self.content = b"{}"
+
+    def json(self):
+        return {"data": self.data}
+
+
+class FlakyProxmox(Proxmox):
+
+    def __init__(self, cluster=None):
+        super().__init__("http://pve.test", cluster=cluster)
+        self.cache = None
+        self.retry = RetryPolicy(retries=2, backoff=0)
+        # Status codes of the next calls
+        self.statuses = [503, 200]
+
+    def send(self, method, url, timeout, **kwargs):
+        return Response(self.statuses.pop(0), {"status": "running"})
+
+
+class Federation:
+
+    def __init__(self, members):
+        self.members = members
+
+
+def test_resource_template():
+    assert resource_template("nodes/pve1/qemu/100/status/current") == "nodes/{node}/qemu/{vmid}/status/current"
+    assert resource_template("/nodes/pve1/tasks/UPID:pve1:0001:00:65:qmstart:100:root@pam:/status") == \
+        "nodes/{node}/tasks/{upid}/status"
+    assert resource_template("cluster/resources") == "cluster/resources"
+
+
+def test_upstream_calls_are_counted_per_cluster():
+    labels = {"cluster": "east", "method": "GET", "resource": "nodes/{node}/qemu/{vmid}/status/current"}
+    before = {name: sample(name, **labels) for name in ("ironsight_upstream_request_duration_seconds_count",
+                                                        "ironsight_upstream_response_bytes_total",
+                                                        "ironsight_upstream_retries_total")}
+    errors = sample("ironsight_upstream_errors_total", status_code="503", **labels)
+    response = FlakyProxmox(cluster="east").request_resource("nodes/pve1/qemu/100/status/current")
+    assert response["status"] == "success"
+    assert sample("ironsight_upstream_request_duration_seconds_count", **labels) - \
+        before["ironsight_upstream_request_duration_seconds_count"] == 2
+    assert sample("ironsight_upstream_response_bytes_total", **labels) - \
+        before["ironsight_upstream_response_bytes_total"] == 4
+    assert sample("ironsight_upstream_retries_total", **labels) - before["ironsight_upstream_retries_total"] == 1
+    assert sample("ironsight_upstream_errors_total", status_code="503", **labels) - errors == 1
+    assert sample("ironsight_upstream_requests_in_progress", cluster="east", method="GET") == 0
+
+
+def test_collector_labels_federated_clusters():
+    east, west = FlakyProxmox(cluster="east"), FlakyProxmox(cluster="west")
+    west.breaker.failures = 1
+    west.breaker.fail("pve3")
+    collector = HypervisorCollector(Federation({"east": east, "west": west}))
+    families = {family.name: family for family in collector.collect()}
+    assert sorted(sample.labels["cluster"] for sample in families["ironsight_vms"].samples) == ["east", "west"]
+    assert [(sample.labels, sample.value) for sample in families["ironsight_circuit_open"].samples] == \
+        [({"cluster": "west", "node": "pve3"}, 1)]
+    # On its own, the hypervisor's samples have no cluster label
+    families = {family.name: family for family in HypervisorCollector(FlakyProxmox()).collect()}
+    assert [sample.labels for sample in families["ironsight_vms"].samples] == [{}]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+from hypervisor_api.placement import PlacementPlanner, disk_storages, on_shared_storage
+from hypervisor_api.proxmox.proxmox import Proxmox
+
+"""_summary_
+    Tests for clone placement, and how template storage limits it.
+"""
+
+GIB = 2 ** 30
+
+NODES = [
+    # The template's node is busy, the other one idle
+    {"type": "node", "node": "pve1", "status": "online", "maxcpu": 8, "cpu": 0.8, "maxmem": 64 * GIB, "mem": 48 * GIB,
+     "maxdisk": 500 * GIB, "disk": 100 * GIB},
+    {"type": "node", "node": "pve2", "status": "online", "maxcpu": 8, "cpu": 0.1, "maxmem": 64 * GIB, "mem": 8 * GIB,
+     "maxdisk": 500 * GIB, "disk": 100 * GIB},
+]
+
+STORAGES = [
+    {"type": "storage", "storage": "local-lvm", "node": node, "shared": 0, "content": "rootdir,images",
+     "maxdisk": 1000 * GIB, "disk": 100 * GIB} for node in ("pve1", "pve2")
+] + [
+    {"type": "storage", "storage": "ceph", "node": node, "shared": 1, "content": "images",
+     "maxdisk": 4000 * GIB, "disk": 100 * GIB} for node in ("pve1", "pve2")
+]
+
+TEMPLATE = {"type": "qemu", "vmid": 9000, "name": "debian", "node": "pve1", "template": 1, "status": "stopped",
+            "maxcpu": 2, "maxmem": 2 * GIB, "maxdisk": 32 * GIB}
+
+
+class Response:
+
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+        self.text = ""
+        self.content = b""
+
+    def json(self):
+        return {"data": self.data}
+
+
+class StubProxmox(Proxmox):
+
+    def __init__(self, storage):
+        super().__init__("http://pve.test")
+        self.cache = None
+        self.template_config = {"name": "debian", "scsi0": f"{storage}:base-9000-disk-0,size=32G",
+                                "ide2": "local:iso/debian.iso,media=cdrom"}
+
+    def send(self, method, url, timeout, **kwargs):
+        if url.endswith("cluster/nextid"):
+            return Response("100")
+        if url.endswith("/config"):
+            return Response(self.template_config)
+        return Response(NODES + STORAGES + [TEMPLATE])
+
+
+def test_disk_storages():
+    config = {"scsi0": "ceph:vm-100-disk-0,size=32G", "efidisk0": "local-lvm:vm-100-disk-1,size=4M",
+              "ide2": "local:iso/debian.iso,media=cdrom", "net0": "virtio=AA:BB:CC:DD:EE:FF,bridge=vmbr0",
+              "virtio1": "/dev/disk/by-id/ata-disk,size=100G"}
+    assert disk_storages(config) == {"ceph", "local-lvm", "/dev/disk/by-id/ata-disk"}
+    assert not on_shared_storage(config, STORAGES)
+    assert on_shared_storage({"scsi0": "ceph:vm-100-disk-0", "ide2": "none,media=cdrom"}, STORAGES)
+
+
+def test_spread_and_binpack():
+    demand = {"cpus": 2, "mem": 2 * GIB, "disk": 0}
+    assert [decision["node"] for decision in PlacementPlanner(NODES, STORAGES).plan(["a", "b"], demand)] == \
+        ["pve2", "pve2"]
+    assert PlacementPlanner(NODES, STORAGES).place("a", demand, "binpack")["node"] == "pve1"
+    assert PlacementPlanner(NODES, STORAGES).place("a", demand, nodes=["pve1"])["node"] == "pve1"
+
+
+def test_template_on_shared_storage_spreads():
+    plan = StubProxmox("ceph").plan_placement("debian", count=2, prefix="web")
+    assert plan["status"] == "success"
+    assert [decision["node"] for decision in plan["data"]["placement"]] == ["pve2", "pve2"]
+
+
+def test_template_on_local_storage_stays_on_its_node():
+    proxmox = StubProxmox("local-lvm")
+    plan = proxmox.plan_placement("debian", count=2, prefix="web")
+    assert plan["status"] == "success"
+    assert [decision["node"] for decision in plan["data"]["placement"]] == ["pve1", "pve1"]
+    # Whatever strategy the caller asks for
+    plan = proxmox.plan_placement("debian", count=1, prefix="web", strategy="spread")
+    assert plan["data"]["placement"][0]["node"] == "pve1"
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import base64
+import json
+from hypervisor_api.query import apply_query, check_query
+
+"""_summary_
+    Tests for listing pagination and its validation.
+"""
+
+VMS = [{"vmid": vmid, "name": f"vm-{vmid}", "status": "running"} for vmid in range(100, 110)]
+
+
+def test_pages_follow_cursors():
+    first = apply_query(VMS, limit=4)
+    second = apply_query(VMS, limit=4, cursor=first["next_cursor"])
+    assert [vm["vmid"] for vm in first["data"]] == [100, 101, 102, 103]
+    assert [vm["vmid"] for vm in second["data"]] == [104, 105, 106, 107]
+
+
+def test_non_positive_limits_are_rejected():
+    for limit in (-1, 0):
+        response = apply_query(VMS, limit=limit)
+        assert response["status"] == "error"
+        assert "next_cursor" not in response
+
+
+def test_malformed_cursors_are_rejected():
+    for key in (5, [False, "vm-1"], [False, "vm-1", "101"], [False, "vm-1", 1.5]):
+        cursor = base64.urlsafe_b64encode(json.dumps(["vmid", key]).encode()).decode()
+        assert check_query(limit=4, cursor=cursor) == "Invalid cursor"
+    assert check_query(limit=4, cursor="not a cursor") == "Invalid cursor"
+
+
+def test_cursor_for_another_sort_is_rejected():
+    cursor = apply_query(VMS, sort="name", limit=4)["next_cursor"]
+    assert check_query(sort="-name", cursor=cursor) == "Cursor was made for another sort order"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+import requests
+from hypervisor_api.proxmox.proxmox import Proxmox
+from hypervisor_api.proxmox.async_proxmox import AsyncProxmox
+from hypervisor_api.resilience import CircuitBreaker, current_deadline
+
+"""_summary_
+    Tests for the per-node circuit breaker, and how upstream calls settle its probes.
+"""
+
+
+def open_circuit(breaker, key):
+    # Open the circuit, as if its last failure was longer ago than reset
+    for _ in range(breaker.failures):
+        breaker.fail(key)
+    breaker.circuits[key]["opened_at"] -= breaker.reset
+
+
+def test_breaker_transitions():
+    breaker = CircuitBreaker(failures=2, reset=30)
+    assert breaker.allow("pve1")
+    breaker.fail("pve1")
+    assert breaker.allow("pve1")
+    breaker.fail("pve1")
+    assert not breaker.allow("pve1")
+    assert breaker.open_circuits() == ["pve1"]
+    # Once reset has passed, a single probe goes through
+    breaker.circuits["pve1"]["opened_at"] -= 30
+    assert breaker.allow("pve1")
+    assert breaker.stats()["pve1"]["state"] == "half-open"
+    assert not breaker.allow("pve1")
+    # A failed probe opens the circuit again, a successful one closes it
+    breaker.fail("pve1")
+    assert breaker.stats()["pve1"]["state"] == "open"
+    assert not breaker.allow("pve1")
+    breaker.circuits["pve1"]["opened_at"] -= 30
+    assert breaker.allow("pve1")
+    breaker.succeed("pve1")
+    assert breaker.stats()["pve1"] == {"state": "closed", "failures": 0}
+    assert breaker.allow("pve1")
+
+
+def test_lost_probe_is_replaced():
+    breaker = CircuitBreaker(failures=1, reset=30)
+    open_circuit(breaker, "pve1")
+    assert breaker.allow("pve1")
+    breaker.circuits["pve1"]["probed_at"] -= 30
+    assert breaker.allow("pve1")
+    assert breaker.stats()["pve1"]["state"] == "half-open"
+
+
+class StalledProxmox(AsyncProxmox):
+
+    async def send(self, method, url, timeout, **kwargs):
+        await asyncio.Event().wait()
+
+
+class TimingOutProxmox(Proxmox):
+
+    def send(self, method, url, timeout, **kwargs):
+        raise requests.ConnectTimeout("Timed out")
+
+
+def test_cancelled_probe_reopens_circuit():
+    async def probe():
+        proxmox = StalledProxmox("http://pve.test")
+        proxmox.breaker = CircuitBreaker(failures=1, reset=30)
+        open_circuit(proxmox.breaker, "pve1")
+        task = asyncio.ensure_future(proxmox.request_resource("nodes/pve1/status"))
+        await asyncio.sleep(0.01)
+        assert proxmox.breaker.stats()["pve1"]["state"] == "half-open"
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await proxmox.close()
+        return proxmox.breaker
+
+    breaker = asyncio.run(probe())
+    assert breaker.stats()["pve1"]["state"] == "open"
+    # The next call probes again rather than failing fast forever
+    assert breaker.allow("pve1")
+
+
+def test_probe_cut_short_by_deadline_reopens_circuit():
+    proxmox = TimingOutProxmox("http://pve.test")
+    proxmox.breaker = CircuitBreaker(failures=1, reset=30)
+    open_circuit(proxmox.breaker, "pve1")
+    token = current_deadline.set(time.monotonic() + 1)
+    try:
+        response = proxmox.request_resource("nodes/pve1/status")
+    finally:
+        current_deadline.reset(token)
+    assert response["error"] == "Deadline exceeded"
+    assert proxmox.breaker.stats()["pve1"]["state"] == "open"
+    assert proxmox.breaker.allow("pve1")
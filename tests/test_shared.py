@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+from hypervisor_api.cache import ResponseCache
+from hypervisor_api.shared import SharedStore
+from hypervisor_api.proxmox.async_proxmox import AsyncProxmox
+
+"""_summary_
+    Tests for the response cache and version log shared between workers.
+"""
+
+
+def shared_cache(path, sync_interval=0):
+    cache = ResponseCache()
+    cache.shared = SharedStore(str(path))
+    cache.sync_interval = sync_interval
+    return cache
+
+
+def test_responses_are_shared(tmp_path):
+    first, second = shared_cache(tmp_path / "shared.db"), shared_cache(tmp_path / "shared.db")
+    first.set("nodes", "nodes", {"status": "success", "data": [1]})
+    assert second.get("nodes") == (None, None)
+    assert second.needs_shared("nodes")
+    second.load_shared("nodes")
+    assert second.get("nodes")[0]["data"] == [1]
+    # Fresh local copies don't go to the database
+    assert not second.needs_shared("nodes")
+
+
+def test_invalidations_are_checked_at_an_interval(tmp_path):
+    first, second = shared_cache(tmp_path / "shared.db"), shared_cache(tmp_path / "shared.db", sync_interval=60)
+    for cache in (first, second):
+        cache.set("cluster/resources", "cluster/resources", {"status": "success", "data": []})
+    assert second.sync_due()
+    second.sync_invalidations()
+    first.invalidate("cluster/resources")
+    # Not due again until the interval has passed
+    assert not second.sync_due()
+    assert second.get("cluster/resources")[1] == "fresh"
+    second.synced_at -= 60
+    assert second.sync_due()
+    second.sync_invalidations()
+    assert second.get("cluster/resources") == (None, None)
+
+
+def test_async_backend_uses_the_database_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("HYPERVISOR_SHARED_CACHE", str(tmp_path / "shared.db"))
+
+    async def offload():
+        proxmox = AsyncProxmox("http://pve.test")
+        thread = await proxmox.offload(threading.get_ident)
+        await proxmox.close()
+        return thread
+
+    assert asyncio.run(offload()) != threading.get_ident()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from hypervisor_api.singleflight import SingleFlight
+from hypervisor_api.proxmox.async_proxmox import AsyncProxmox
+
+"""_summary_
+    Tests for coalescing concurrent identical upstream GETs.
+"""
+
+
+class Response:
+
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+        self.text = ""
+        self.content = b""
+
+    def json(self):
+        return {"data": self.data}
+
+
+class CountingProxmox(AsyncProxmox):
+
+    def __init__(self):
+        super().__init__("http://pve.test")
+        self.cache = None
+        self.calls = 0
+
+    async def send(self, method, url, timeout, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return Response([{"node": "pve1"}])
+
+
+def test_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"status": "success", "data": []}
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(flight.do, "nodes", fetch) for _ in range(8)]
+        while flight.stats()["requests"] < 8:
+            threading.Event().wait(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(result == {"status": "success", "data": []} for result in results)
+    # Every caller gets its own copy
+    assert len({id(result) for result in results}) == 8
+    # Once it is done, the next call goes upstream again
+    flight.do("nodes", fetch)
+    assert len(calls) == 2
+
+
+def test_concurrent_gets_make_one_upstream_call():
+    async def burst():
+        proxmox = CountingProxmox()
+        results = await asyncio.gather(*(proxmox.get_resource("nodes") for _ in range(10)))
+        await proxmox.close()
+        return proxmox, results
+
+    proxmox, results = asyncio.run(burst())
+    assert proxmox.calls == 1
+    assert all(result["data"] == [{"node": "pve1"}] for result in results)
+    assert proxmox.inflight.stats()["collapsed"] == 9
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+from hypervisor_api.tasks import TaskTracker, parse_upid
+
+"""_summary_
+    Tests for the upstream task tracker.
+"""
+
+
+def upid(pid, node="pve1", type="qmstart", id="100"):
+    return f"UPID:{node}:{pid:08X}:00000000:65000000:{type}:{id}:root@pam:"
+
+
+class StubHypervisor:
+
+    def __init__(self):
+        # upid -> status returned by the next poll
+        self.statuses = {}
+        self.polls = 0
+
+    def get_task_status(self, node, upid):
+        self.polls += 1
+        return {"status": "success", "data": self.statuses.get(upid, {"status": "running"})}
+
+
+def test_parse_upid():
+    assert parse_upid(upid(1)) == {"node": "pve1", "type": "qmstart", "id": "100", "user": "root@pam",
+                                   "starttime": 0x65000000}
+    assert parse_upid("not a task") is None
+    assert parse_upid(None) is None
+
+
+def test_finished_tasks_are_trimmed():
+    tracker = TaskTracker(StubHypervisor(), history=2)
+    assert tracker.record("not a task") is None
+    for pid in range(3):
+        tracker.record(upid(pid), resource="nodes/pve1/qemu/100/status/start")
+    # Running tasks are kept past history
+    assert len(tracker.list()) == 3
+    tracker.update(upid(0), {"status": "success", "data": {"status": "stopped", "exitstatus": "OK"}})
+    tracker.update(upid(1), {"status": "error", "error": "Timed out"})
+    assert tracker.get(upid(1))["status"] == "running"
+    tracker.record(upid(3))
+    assert tracker.get(upid(0)) is None
+    assert [task["upid"] for task in tracker.in_flight()] == [upid(3), upid(2), upid(1)]
+
+
+def test_wait_returns_when_polled_task_finishes():
+    hypervisor = StubHypervisor()
+    tracker = TaskTracker(hypervisor, interval=0.01)
+
+    async def wait():
+        tracker.record(upid(1))
+        waiter = asyncio.ensure_future(tracker.wait(upid(1), timeout=5))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        hypervisor.statuses[upid(1)] = {"status": "stopped", "exitstatus": "OK"}
+        task = await waiter
+        await tracker.stop()
+        return task
+
+    task = asyncio.run(wait())
+    assert task["status"] == "stopped" and task["exitstatus"] == "OK"
+    assert hypervisor.polls >= 2
+
+
+def test_wait_times_out_and_wakes_on_updates_from_threads():
+    tracker = TaskTracker(StubHypervisor(), interval=60)
+
+    async def wait():
+        tracker.record(upid(1))
+        tracker.record(upid(2))
+        running = await tracker.wait(upid(1), timeout=0.05)
+        # As the synchronous backend's worker threads report a task
+        finish = threading.Timer(0.05, tracker.update, (upid(2), {"status": "success", "data": {"status": "stopped"}}))
+        finish.start()
+        stopped = await tracker.wait(upid(2), timeout=5)
+        await tracker.stop()
+        return running, stopped
+
+    running, stopped = asyncio.run(wait())
+    assert running["status"] == "running"
+    assert stopped["status"] == "stopped"
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import time
+from hypervisor_api.proxmox.proxmox import Proxmox
+from hypervisor_api.timeseries import TimeSeriesStore
+
+"""_summary_
+    Tests for the local usage store.
+"""
+
+
+def samples(count, end=None):
+    end = int(end or time.time())
+    return [{"time": end - 60 * (count - i), "cpu": i / count} for i in range(count)]
+
+
+def test_ingest_keeps_new_samples_only():
+    store = TimeSeriesStore(capacity=100)
+    now = time.time()
+    assert store.ingest(("vm", 100), samples(10, now)) == 10
+    assert store.ingest(("vm", 100), samples(10, now)) == 0
+    assert store.ingest(("vm", 100), samples(12, now + 120)) == 2
+    assert len(store.query(("vm", 100))) == 12
+
+
+def test_retain_drops_gone_series():
+    store = TimeSeriesStore(capacity=100)
+    for key in (("vm", 100), ("vm", 101), ("node", "pve1")):
+        store.ingest(key, samples(5), "hour")
+    assert store.retain("vm", {101}) == 1
+    assert ("vm", 100) not in store.series
+    assert ("vm", 100) not in store.fetched_at and ("vm", 100) not in store.covered_from
+    assert store.query(("vm", 100)) == []
+    assert len(store.query(("vm", 101))) == 5
+    # Other kinds are left alone
+    assert len(store.query(("node", "pve1"))) == 5
+
+
+def test_deleted_vms_lose_their_usage():
+    proxmox = Proxmox("http://pve.test")
+    proxmox.usage_store.ingest(("vm", 100), samples(5))
+    proxmox.usage_store.ingest(("vm", 101), samples(5))
+    proxmox.update_vm_index([{"vmid": 101, "name": "db", "node": "pve1", "type": "qemu"}])
+    assert set(proxmox.usage_store.series) == {("vm", 101)}
+
+
+def test_aggregate():
+    store = TimeSeriesStore(capacity=100)
+    store.ingest(("node", "pve1"), [{"time": 60, "cpu": 0.2}, {"time": 120, "cpu": 0.4}])
+    store.ingest(("node", "pve2"), [{"time": 60, "cpu": 0.6}, {"time": 120, "cpu": 0.8}, {"time": 180, "cpu": 1.0}])
+    keys = [("node", "pve1"), ("node", "pve2"), ("node", "pve3")]
+    cpu = store.aggregate(keys, ["pve1", "pve2", "pve3"], ["cpu"], top=2)["cpu"]
+    assert cpu["series"] == 3 and cpu["samples"] == 3
+    assert cpu["max"] == 1.0
+    assert round(cpu["mean"], 6) == 0.6
+    # Totals add up the series at each timestamp
+    assert [round(value, 6) for value in (cpu["total"]["mean"], cpu["total"]["max"], cpu["total"]["last"])] == \
+        [1.0, 1.2, 1.0]
+    # Ranked by mean, a series without samples is left out
+    assert [series["name"] for series in cpu["top"]] == ["pve2", "pve1"]
+    assert cpu["top"][0]["last"] == 1.0
+    assert store.aggregate(keys, ["pve1", "pve2", "pve3"], ["cpu"], start=150)["cpu"]["top"] == \
+        [{"name": "pve2", "mean": 1.0, "p95": 1.0, "max": 1.0, "last": 1.0}]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from hypervisor_api.proxmox.proxmox import Proxmox
+from hypervisor_api.tracing import TraceLog, TracingMiddleware
+
+"""_summary_
+    Tests for the per-request upstream traces (Server-Timing / X-Upstream-Calls).
+"""
+
+
+class Response:
+
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+        self.text = ""
+        self.content = b""
+
+    def json(self):
+        return {"data": self.data}
+
+
+class StubProxmox(Proxmox):
+
+    def __init__(self):
+        super().__init__("http://pve.test")
+        self.cache = None
+
+    def send(self, method, url, timeout, **kwargs):
+        return Response({"status": "running"})
+
+
+def traced_app(trace_log):
+    proxmox = StubProxmox()
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware, trace_log=trace_log)
+
+    # Synchronous routes run in a worker thread, with the request's trace
+    @app.get("/vms/{vmid}")
+    def get_vm(vmid: int):
+        proxmox.request_resource(f"nodes/pve1/qemu/{vmid}/status/current")
+        proxmox.request_resource(f"nodes/pve1/qemu/{vmid}/config")
+        return {"status": "success"}
+
+    @app.get("/version")
+    def get_version():
+        return {"status": "success"}
+
+    return TestClient(app)
+
+
+def test_upstream_calls_are_reported():
+    trace_log = TraceLog(debug=False)
+    client = traced_app(trace_log)
+    response = client.get("/vms/100")
+    assert response.headers["x-upstream-calls"] == "2"
+    assert response.headers["server-timing"].startswith("upstream;dur=")
+    assert 'desc="2 calls"' in response.headers["server-timing"]
+    assert "x-trace-id" not in response.headers
+    assert client.get("/version").headers["x-upstream-calls"] == "0"
+    # Traces are only kept in debug mode
+    assert trace_log.slowest() == []
+
+
+def test_debug_requests_keep_their_trace():
+    trace_log = TraceLog(debug=False, size=1)
+    client = traced_app(trace_log)
+    response = client.get("/vms/100", headers={"X-Debug": "trace"})
+    trace = trace_log.get(response.headers["x-trace-id"])
+    assert trace["path"] == "/vms/100" and trace["calls"] == 2
+    assert trace["by_template"] == {"nodes/{node}/qemu/{vmid}/status/current": 1,
+                                    "nodes/{node}/qemu/{vmid}/config": 1}
+    assert [span["resource"] for span in trace["spans"]] == ["nodes/pve1/qemu/100/status/current",
+                                                             "nodes/pve1/qemu/100/config"]
+    # Only the last size traces are kept
+    second = client.get("/vms/101", headers={"X-Debug": "trace"}).headers["x-trace-id"]
+    assert trace_log.get(response.headers["x-trace-id"]) is None
+    assert [trace["id"] for trace in trace_log.slowest()] == [second]
+    assert "spans" not in trace_log.slowest()[0]
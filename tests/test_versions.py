@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+from hypervisor_api.proxmox.proxmox import Proxmox
+from hypervisor_api.versions import InventoryVersions, make_etag, etag_matches
+
+"""_summary_
+    Tests for inventory versions, ETag revalidation and the VM change feed.
+"""
+
+
+def vm(vmid, name, status="running", **fields):
+    return {"vmid": vmid, "name": name, "node": "pve1", "type": "qemu", "status": status, "template": 0,
+            "maxmem": 2048, "maxcpu": 2, "cpu": 0.1, "mem": 512, "uptime": 100, "netin": 1, "netout": 1, **fields}
+
+
+class Response:
+
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+        self.text = ""
+        self.content = b""
+
+    def json(self):
+        return {"data": self.data}
+
+
+class StubProxmox(Proxmox):
+
+    def __init__(self):
+        super().__init__("http://pve.test")
+        self.cache = None
+        self.inventory_ttl = 0
+        self.vms = []
+
+    def send(self, method, url, timeout, **kwargs):
+        return Response(self.vms)
+
+
+def test_usage_counters_keep_the_version():
+    versions = InventoryVersions(shared=None)
+    first = versions.observe("vms", {100: vm(100, "web")})
+    busy = vm(100, "web", cpu=0.9, mem=1900, uptime=160, netin=5000, netout=7000, diskread=10, diskwrite=20)
+    assert versions.observe("vms", {100: busy}) == first
+    assert versions.observe("vms", {100: vm(100, "web", status="stopped")}) == first + 1
+
+
+def test_changes_list_inventory_fields_only():
+    versions = InventoryVersions(shared=None)
+    since = versions.observe("vms", {100: vm(100, "web"), 101: vm(101, "db")})
+    versions.observe("vms", {100: vm(100, "web", status="stopped", cpu=0, uptime=0),
+                             101: vm(101, "db", cpu=0.7), 102: vm(102, "cache")})
+    changes = versions.changes("vms", since)
+    assert changes["type"] == "changes"
+    assert changes["changed"] == [{"key": 100, "fields": {"status": "stopped"}}]
+    assert changes["removed"] == []
+    assert [item["vmid"] for item in changes["added"]] == [102]
+    assert "cpu" not in changes["added"][0]
+
+
+def test_unchanged_inventory_revalidates():
+    proxmox = StubProxmox()
+    proxmox.vms = [vm(100, "web"), vm(101, "db")]
+    first = proxmox.get_vms()
+    etag = make_etag("vms", first["version"])
+    # Only the load moved, so the client's ETag still matches (304 Not Modified)
+    proxmox.vms = [vm(100, "web", cpu=0.8, uptime=130), vm(101, "db", mem=1024)]
+    second = proxmox.get_vms()
+    assert second["version"] == first["version"]
+    assert etag_matches(make_etag("vms", second["version"]), etag)
+    proxmox.vms = [vm(100, "web-1"), vm(101, "db")]
+    third = proxmox.get_vms()
+    assert not etag_matches(make_etag("vms", third["version"]), etag)
+    assert proxmox.get_vm_changes(first["version"])["changed"] == [{"key": 100, "fields": {"name": "web-1"}}]
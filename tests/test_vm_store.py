@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from hypervisor_api.proxmox.vm_store import VMStore
+
+"""_summary_
+    Tests for the indexed in-memory VM store.
+"""
+
+
+def vm(vmid, name, node="pve1", status="running", template=0, **fields):
+    return {"type": "qemu", "vmid": vmid, "name": name, "node": node, "status": status, "template": template,
+            "maxcpu": 2, **fields}
+
+
+def names(store, **query):
+    return sorted(record.name for record in store.select(**query))
+
+
+def test_listing_builds_the_indexes():
+    store = VMStore()
+    store.update([vm(100, "web"), vm(101, "db", node="pve2", status="stopped"), vm(9000, "debian", template=1),
+                  {"type": "lxc", "vmid": 200, "name": "ct", "node": "pve1"}])
+    assert len(store) == 3 and "ct" not in store
+    assert store.locate("db") == ("pve2", 101)
+    assert names(store, node="pve1") == ["debian", "web"]
+    assert names(store, status="stopped") == ["db"]
+    assert names(store, template=True) == ["debian"]
+    assert store.count(node="pve1", template=False) == 1
+
+
+def test_moved_and_renamed_vms_are_reindexed():
+    store = VMStore()
+    store.update([vm(100, "web"), vm(101, "db")])
+    store.update([vm(100, "web", node="pve2"), vm(101, "db-1", status="stopped")])
+    assert store.locate("web") == ("pve2", 100)
+    assert names(store, node="pve1") == ["db-1"]
+    assert names(store, node="pve2") == ["web"]
+    assert "db" not in store and store.locate("db") is None
+    assert store.locate("db-1") == ("pve1", 101)
+    assert names(store, status="running") == ["web"]
+    assert names(store, status="stopped") == ["db-1"]
+
+
+def test_missing_vms_are_dropped():
+    store = VMStore()
+    store.update([vm(100, "web"), vm(101, "db")])
+    store.update([vm(101, "db")])
+    assert "web" not in store
+    assert store.get(100) is None
+    assert store.count() == 1
+    assert names(store, node="pve1") == ["db"]
+
+
+def test_usage_updates_keep_the_records():
+    store = VMStore()
+    store.update([vm(100, "web", cpu=0.1)])
+    record = store.get(100)
+    store.update([vm(100, "web", cpu=0.9)])
+    assert store.get(100) is record
+    assert store.listing()[0]["cpu"] == 0.9
+    assert store.listing()[0]["cpus"] == 2